@@ -5,7 +5,8 @@ from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+import httpx
 import json
 from datetime import datetime, timedelta
 from sharepoint import download_excel, upload_excel
@@ -19,16 +20,46 @@ load_dotenv()
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
+# Copy of create_http_client in rag-agent/clients.py (the two apps ship as separate containers);
+# keep the env names and defaults of both in step
+def create_http_client() -> httpx.AsyncClient:
+    """
+    New async HTTP client tuned for Azure OpenAI: keep-alive, HTTP/2 when the h2
+    package is installed, and bounded connection pool.
+
+    Configured by OPENAI_HTTP2, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE,
+    OPENAI_KEEPALIVE_EXPIRY, OPENAI_CONNECT_TIMEOUT and OPENAI_READ_TIMEOUT.
+    """
+    http2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("⚠  HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+
+    read_timeout = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+        ),
+        timeout=httpx.Timeout(read_timeout, connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")))
+    )
+
+# Initialize Azure OpenAI client (async, so a slow completion does not block other requests)
+client = AsyncAzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
     api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    http_client=create_http_client()
 )
 
 
 EXCEL_FILE = "contracts.xlsx"
-SHAREPOINT_SYNC_ENABLED = False
+SHAREPOINT_SYNC_ENABLED = os.getenv("SHAREPOINT_SYNC_ENABLED", "false").lower() == "true"
 
 HEADERS = [
     "Sr. No.",
@@ -213,7 +244,7 @@ def update_excel(data, update_existing=False):
     
     return True, "Success (synced to SharePoint)", url
 
-def parse_input_with_llm(user_input):
+async def parse_input_with_llm(user_input):
     system_prompt = f"""
 You are an expert at extracting contract information from natural language. 
 Return a JSON object with EXACTLY these keys: {', '.join(HEADERS)}.
@@ -244,7 +275,8 @@ Input: "{user_input}"
 """
 
     try:
-        response = client.chat.completions.create(
+        content = None
+        response = await client.chat.completions.create(
             model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o"),
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -271,6 +303,10 @@ Input: "{user_input}"
         print(f"LLM Parsing Error: {e}\nRaw Response: {content}")
         raise ValueError(f"Failed to parse contract details: {e}")
 
+@app.on_event("shutdown")
+async def close_client():
+    await client.close()
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     initialize_excel()
@@ -282,7 +318,7 @@ async def preview(data: InputRequest):
         # Redirect to localhost:8005
         raise HTTPException(status_code=307, detail="Redirecting to sheets mode endpoint")
     try:
-        parsed_data = parse_input_with_llm(data.input)
+        parsed_data = await parse_input_with_llm(data.input)
         
         _, ws = get_active_sheet()
         duplicate_info = check_duplicate(parsed_data, ws)
@@ -303,7 +339,7 @@ async def submit(data: InputRequest):
         # Redirect to localhost:8005
         raise HTTPException(status_code=307, detail="Redirecting to sheets mode endpoint")
     try:
-        parsed_data = parse_input_with_llm(data.input)
+        parsed_data = await parse_input_with_llm(data.input)
         
         success, message ,url= update_excel(parsed_data, data.overwrite)
         
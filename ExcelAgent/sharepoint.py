@@ -14,18 +14,22 @@ CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 SITE_ID = os.getenv("SITE_ID")
 DRIVE_ID = os.getenv("DRIVE_ID")
 
+# Base URLs, overridable to point at a local stand-in for load tests
+GRAPH_BASE_URL = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0").rstrip("/")
+LOGIN_BASE_URL = os.getenv("LOGIN_BASE_URL", "https://login.microsoftonline.com").rstrip("/")
+
 SCOPE = (
     "https://graph.microsoft.com/.default"  # .default scope for client credentials flow
 )
 
-TOKEN_URL = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
+TOKEN_URL = f"{LOGIN_BASE_URL}/{TENANT_ID}/oauth2/v2.0/token"
 FILENAME = "contracts.xlsx"
 FOLDER_PATH = "XCEL_SHEETS"
 
-DOWNLOAD_URL = f"https://graph.microsoft.com/v1.0/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{FILENAME}:/content"
-UPLOAD_URL = f"https://graph.microsoft.com/v1.0/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{FILENAME}:/content"
+DOWNLOAD_URL = f"{GRAPH_BASE_URL}/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{FILENAME}:/content"
+UPLOAD_URL = f"{GRAPH_BASE_URL}/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{FILENAME}:/content"
 
-TOKEN_CACHE_FILE = "token_cache.json"
+TOKEN_CACHE_FILE = os.getenv("TOKEN_CACHE_FILE", "token_cache.json")
 
 
 def get_token_from_cache():
@@ -36,13 +40,22 @@ def get_token_from_cache():
     if time.time() >= data.get("expires_at", 0):
         # Token expired
         return None
+    if (data.get("login_base_url", "https://login.microsoftonline.com"),
+            data.get("graph_base_url", "https://graph.microsoft.com/v1.0")) != (LOGIN_BASE_URL, GRAPH_BASE_URL):
+        # Issued by another login service (e.g. the load-test mock), not valid here
+        return None
     return data.get("access_token")
 
 
 def save_token_to_cache(token_response):
     expires_in = int(token_response["expires_in"])  # usually seconds
     expires_at = time.time() + expires_in - 60  # minus 60 sec as buffer before expiry
-    data = {"access_token": token_response["access_token"], "expires_at": expires_at}
+    data = {
+        "access_token": token_response["access_token"],
+        "expires_at": expires_at,
+        "login_base_url": LOGIN_BASE_URL,
+        "graph_base_url": GRAPH_BASE_URL,
+    }
     with open(TOKEN_CACHE_FILE, "w") as f:
         json.dump(data, f)
 
@@ -79,7 +92,7 @@ def download_excel(output_path="downloaded_data.xlsx", filename=None):
         filename = FILENAME
     
     # Build dynamic URL with the specified filename
-    download_url = f"https://graph.microsoft.com/v1.0/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{filename}:/content"
+    download_url = f"{GRAPH_BASE_URL}/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{filename}:/content"
     
     access_token = get_access_token()
     headers = {"Authorization": f"Bearer {access_token}"}
@@ -101,7 +114,7 @@ def upload_excel(local_file_path, filename=None):
         filename = FILENAME
     
     # Build dynamic URL with the specified filename
-    upload_url = f"https://graph.microsoft.com/v1.0/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{filename}:/content"
+    upload_url = f"{GRAPH_BASE_URL}/sites/{SITE_ID}/drives/{DRIVE_ID}/root:/{FOLDER_PATH}/{filename}:/content"
     
     access_token = get_access_token()
     with open(local_file_path, "rb") as f:
@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import logging
+from latency import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first when requests wait for the shared capacity
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SPEECH = 1
+PRIORITY_BATCH = 2
+
+class Overloaded(Exception):
+    def __init__(self, lane: str, status_code: int, retry_after: int, reason: str):
+        """
+        Raised when a request is not admitted.
+
+        Args:
+            lane: Lane the request was for
+            status_code: 429 when the lane's queue is full, 503 when the request waited too long
+            retry_after: Suggested wait in seconds before retrying
+            reason: Human-readable explanation
+        """
+        super().__init__(reason)
+        self.lane = lane
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+class Lane:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, priority: int, max_wait: float):
+        """
+        Admission settings and counters of one endpoint (or group of endpoints).
+
+        Args:
+            name: Lane name
+            max_concurrency: Requests of this lane running at once
+            max_queue: Requests of this lane allowed to wait; more are rejected with 429
+            priority: Order in which waiting lanes get freed capacity (lower first)
+            max_wait: Seconds a request may wait before it is rejected with 503
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.priority = priority
+        self.max_wait = max_wait
+
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waits = LatencyTracker()
+        # Recent request durations, for Retry-After estimates
+        self.service_times: deque = deque(maxlen=100)
+
+    @classmethod
+    def from_env(cls, name: str, max_concurrency: int, max_queue: int, priority: int, max_wait: float) -> "Lane":
+        """Lane with defaults overridable by ADMISSION_<NAME>_CONCURRENCY, _QUEUE and _WAIT."""
+        prefix = f"ADMISSION_{name.upper()}"
+        return cls(
+            name,
+            max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(max_concurrency))),
+            max_queue=int(os.getenv(f"{prefix}_QUEUE", str(max_queue))),
+            priority=priority,
+            max_wait=float(os.getenv(f"{prefix}_WAIT", str(max_wait)))
+        )
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        service = sum(self.service_times) / len(self.service_times) if self.service_times else 1.0
+        return max(1, math.ceil(service * (self.queued + 1) / max(1, self.max_concurrency)))
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 64):
+        """
+        Concurrency limits with bounded priority wait queues, for asyncio request handlers.
+
+        A request runs when its lane is below its own limit and the process is below
+        max_concurrency overall. Otherwise it waits in its lane's queue; freed capacity
+        goes to the waiting request of the highest-priority lane (then oldest first),
+        so interactive chat overtakes uploads and batch work. Requests that find their
+        lane's queue full are rejected immediately, and those that wait longer than the
+        lane's max_wait are rejected when the wait expires.
+
+        Args:
+            max_concurrency: Requests of all lanes running at once
+        """
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.lanes: Dict[str, Lane] = {}
+        # (priority, sequence, lane, future) of waiting requests
+        self._waiters: List[tuple] = []
+        self._sequence = itertools.count()
+
+    def add_lane(self, lane: Lane) -> None:
+        self.lanes[lane.name] = lane
+
+    def _can_run(self, lane: Lane) -> bool:
+        return self.in_flight < self.max_concurrency and lane.in_flight < lane.max_concurrency
+
+    def _start(self, lane: Lane) -> None:
+        self.in_flight += 1
+        lane.in_flight += 1
+        lane.admitted += 1
+
+    def _dispatch(self) -> None:
+        """Hand freed capacity to waiting requests, highest priority first."""
+        for waiter in sorted(self._waiters, key=lambda w: (w[0], w[1])):
+            if self.in_flight >= self.max_concurrency:
+                break
+            _, _, lane, future = waiter
+            if future.done() or not self._can_run(lane):
+                continue
+            self._waiters.remove(waiter)
+            lane.queued -= 1
+            self._start(lane)
+            future.set_result(None)
+
+    async def acquire(self, name: str) -> float:
+        """
+        Wait for a slot in a lane.
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            Overloaded: If the lane's queue is full or the wait exceeded the lane's max_wait
+        """
+        lane = self.lanes[name]
+        # Run at once only if no request that should go first is already waiting
+        if self._can_run(lane) and not any(
+                priority <= lane.priority and self._can_run(waiting_lane)
+                for priority, _, waiting_lane, _ in self._waiters):
+            self._start(lane)
+            lane.waits.record("wait", 0.0)
+            return 0.0
+
+        if lane.queued >= lane.max_queue:
+            lane.rejected += 1
+            raise Overloaded(name, 429, lane.retry_after(),
+                             f"Too many {name} requests waiting, please retry later")
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        waiter = (lane.priority, next(self._sequence), lane, future)
+        self._waiters.append(waiter)
+        lane.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=lane.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._waiters.remove(waiter)
+                lane.queued -= 1
+                lane.timed_out += 1
+                logger.warning(f"Rejected {name} request after waiting {lane.max_wait:g}s for capacity")
+                raise Overloaded(name, 503, lane.retry_after(),
+                                 f"Server busy, {name} request waited too long for capacity")
+        except asyncio.CancelledError:
+            # Client went away while waiting; give back a slot granted meanwhile
+            if future.done():
+                self.release(name)
+            else:
+                self._waiters.remove(waiter)
+                lane.queued -= 1
+            raise
+
+        waited = time.perf_counter() - started
+        lane.waits.record("wait", waited * 1000)
+        return waited
+
+    def release(self, name: str, service_seconds: Optional[float] = None) -> None:
+        """Give back a lane's slot, recording how long the request ran."""
+        lane = self.lanes[name]
+        self.in_flight -= 1
+        lane.in_flight -= 1
+        if service_seconds is not None:
+            lane.service_times.append(service_seconds)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, name: str):
+        """Hold a slot in a lane for the duration of the block; raises Overloaded if not admitted."""
+        await self.acquire(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(name, time.perf_counter() - started)
+
+    def stats(self) -> Dict:
+        """Queue depth, in-flight requests, admission counters and wait percentiles per lane."""
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queued": sum(lane.queued for lane in self.lanes.values()),
+            "lanes": {
+                name: {
+                    "priority": lane.priority,
+                    "in_flight": lane.in_flight,
+                    "queued": lane.queued,
+                    "max_concurrency": lane.max_concurrency,
+                    "max_queue": lane.max_queue,
+                    "admitted": lane.admitted,
+                    "rejected": lane.rejected,
+                    "timed_out": lane.timed_out,
+                    "wait": lane.waits.stats().get("wait")
+                }
+                for name, lane in self.lanes.items()
+            }
+        }
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl_seconds: float = 3600, max_size: int = 1000):
+        """
+        Cache of generated answers, looked up by query embedding.
+
+        A stored answer is reused when a new query's embedding has cosine similarity
+        of at least threshold with the stored query and retrieval returned exactly the
+        same chunks. Entries expire after ttl_seconds, the least recently used entry is
+        evicted when the cache is full, and everything is dropped when the index
+        version changes.
+
+        Query embeddings live in one preallocated matrix, so a lookup is a single
+        matrix-vector product over all entries.
+
+        Args:
+            threshold: Minimum cosine similarity between the queries
+            ttl_seconds: Lifetime of an entry
+            max_size: Maximum number of entries
+        """
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+
+        # Slot in the embedding matrix -> entry, least recently used first
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._occupied = np.zeros(max_size, dtype=bool)
+        self._free: List[int] = list(range(max_size - 1, -1, -1))
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding: np.ndarray) -> Optional[np.ndarray]:
+        embedding = np.asarray(embedding, dtype='float32').ravel()
+        norm = float(np.linalg.norm(embedding))
+        return embedding / norm if norm > 0 else None
+
+    def get(self, query_embedding: np.ndarray, chunk_ids: Iterable[int], version: int) -> Optional[Dict]:
+        """
+        Look up an answer.
+
+        Args:
+            query_embedding: Embedding of the new query
+            chunk_ids: Vector IDs of the chunks retrieved for it
+            version: Index version the chunks were retrieved from
+
+        Returns:
+            Optional[Dict]: Copy of the stored response, or None on a miss
+        """
+        query = self._unit(query_embedding)
+        chunk_ids = tuple(sorted(set(chunk_ids)))
+        with self._lock:
+            self._sync_version(version)
+            if query is None or not self._entries or len(query) != self._matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            similarities = self._matrix @ query
+            similarities[~self._occupied] = -np.inf
+            now = time.time()
+            for slot in np.argsort(-similarities).tolist():
+                if similarities[slot] < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if now - entry["created_at"] > self.ttl_seconds:
+                    self._drop(slot)
+                    self.expirations += 1
+                    continue
+                if entry["chunk_ids"] == chunk_ids:
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    logger.debug(f"Answer cache hit (similarity {similarities[slot]:.3f})")
+                    return dict(entry["response"])
+
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding: np.ndarray, chunk_ids: Iterable[int], version: int, response: Dict) -> None:
+        """Store the answer generated for a query and its retrieved chunks."""
+        query = self._unit(query_embedding)
+        if query is None:
+            return
+        with self._lock:
+            self._sync_version(version)
+            if self._matrix is None or self._matrix.shape[1] != len(query):
+                self._clear()
+                self._matrix = np.zeros((self.max_size, len(query)), dtype='float32')
+
+            self._expire()
+            while not self._free:
+                slot, _ = next(iter(self._entries.items()))
+                self._drop(slot)
+                self.evictions += 1
+
+            slot = self._free.pop()
+            self._matrix[slot] = query
+            self._occupied[slot] = True
+            self._entries[slot] = {
+                "chunk_ids": tuple(sorted(set(chunk_ids))),
+                "response": dict(response),
+                "created_at": time.time()
+            }
+
+    def _sync_version(self, version: int) -> None:
+        """Drop every entry when the corpus changed since they were stored."""
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Index version changed to {version}, invalidating {len(self._entries)} cached answers")
+                self.invalidations += len(self._entries)
+                self._clear()
+            self._version = version
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [slot for slot, entry in self._entries.items() if entry["created_at"] < cutoff]
+        for slot in expired:
+            self._drop(slot)
+        self.expirations += len(expired)
+
+    def _drop(self, slot: int) -> None:
+        del self._entries[slot]
+        self._occupied[slot] = False
+        self._free.append(slot)
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._occupied[:] = False
+        self._free = list(range(self.max_size - 1, -1, -1))
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict:
+        """Return hit/miss/eviction counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "version": self._version
+            }
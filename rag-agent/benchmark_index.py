@@ -0,0 +1,103 @@
+import argparse
+import time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+import faiss
+import logging
+from index_engine import build_index, measure_recall, normalize, exact_rerank, _sample_queries, COMPRESSED_ENGINES
+
+logger = logging.getLogger(__name__)
+
+def load_vectors(embeddings_dir: Path, limit: Optional[int] = None) -> np.ndarray:
+    """Load the stored embedding matrices of all processed PDFs."""
+    matrices = [np.load(path, mmap_mode='r') for path in sorted(embeddings_dir.glob("*/embeddings.npy"))]
+    if not matrices:
+        raise FileNotFoundError(f"No embeddings.npy stores found under {embeddings_dir}")
+    vectors = np.concatenate(matrices)
+    return normalize(vectors[:limit] if limit else vectors)
+
+def synthetic_vectors(n_vectors: int, dimension: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered random unit vectors, roughly shaped like a corpus of document chunks."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dimension)).astype('float32')
+    assignments = rng.integers(0, n_clusters, n_vectors)
+    noise = rng.standard_normal((n_vectors, dimension)).astype('float32')
+    return normalize(centers[assignments] + 0.7 * noise)
+
+def benchmark(vectors: np.ndarray,
+              engines: List[str],
+              k: int = 10,
+              rerank: int = 4,
+              n_queries: int = 200,
+              target_recall: float = 0.95) -> List[dict]:
+    """
+    Build each engine over the same vectors and measure size, recall and latency.
+
+    Returns:
+        List[dict]: One row per engine
+    """
+    n_vectors, dimension = vectors.shape
+    ids = np.arange(n_vectors, dtype='int64')
+    queries = _sample_queries(vectors, n_queries, np.random.default_rng(1))
+    _, positions = faiss.knn(queries, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+    ground_truth = ids[positions]
+    raw_bytes = vectors.nbytes
+
+    rows = []
+    for engine in engines:
+        index, card = build_index(vectors, ids, dimension, engine, target_recall, rerank=rerank)
+        index_bytes = faiss.serialize_index(index).size
+        card_rerank = card["params"].get("rerank", 1)
+
+        recall_first_pass = measure_recall(index, vectors, ids, queries, k, ground_truth)
+        recall = measure_recall(index, vectors, ids, queries, k, ground_truth, card_rerank)
+
+        started = time.perf_counter()
+        for query in queries:
+            _, candidates = index.search(query[None, :], k * card_rerank)
+            if card_rerank > 1:
+                exact_rerank(query[None, :], candidates, lambda found: vectors[found], k)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        rows.append({
+            "engine": card["engine"],
+            "params": card["params"],
+            "index_mb": index_bytes / 2**20,
+            "compression": raw_bytes / index_bytes,
+            "recall_first_pass": recall_first_pass,
+            "recall": recall,
+            "latency_ms": latency_ms
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare index engines: memory, recall@k and latency")
+    parser.add_argument("--data-dir", help="Benchmark the stored embeddings under DATA_DIR/embeddings "
+                                           "instead of synthetic vectors")
+    parser.add_argument("--vectors", type=int, default=50_000, help="Number of vectors (synthetic, or a cap on stored)")
+    parser.add_argument("--dimension", type=int, default=1536, help="Dimension of synthetic vectors")
+    parser.add_argument("--engines", default="flat,sq8,ivf,ivfpq,hnsw", help="Comma-separated engines to compare")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours compared for recall@k")
+    parser.add_argument("--rerank", type=int, default=4, help="Candidates re-scored per result on compressed engines")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="Recall the engines are tuned for")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.data_dir:
+        vectors = load_vectors(Path(args.data_dir) / "embeddings", args.vectors)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dimension)
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, float32 size {vectors.nbytes / 2**20:.1f} MB, "
+          f"recall@{args.k}, rerank x{args.rerank} on {', '.join(COMPRESSED_ENGINES)}")
+    print(f"{'engine':<8} {'index MB':>9} {'ratio':>6} {'recall 1st':>10} {'recall':>7} {'ms/query':>9}  params")
+    for row in benchmark(vectors, engines, args.k, args.rerank, args.queries, args.target_recall):
+        print(f"{row['engine']:<8} {row['index_mb']:>9.1f} {row['compression']:>5.1f}x "
+              f"{row['recall_first_pass']:>10.3f} {row['recall']:>7.3f} {row['latency_ms']:>9.2f}  {row['params']}")
+
+if __name__ == "__main__":
+    main()
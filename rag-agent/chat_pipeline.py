@@ -0,0 +1,243 @@
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, TYPE_CHECKING
+import numpy as np
+import logging
+from conversation_store import DEFAULT_SESSION
+from clients import run_sync
+
+if TYPE_CHECKING:
+    from rag import RAGSystem
+    from vector_store import IndexSnapshot
+
+logger = logging.getLogger(__name__)
+
+NO_CONTEXT_RESPONSE = "No relevant information found in the documents. Please try a different query."
+ERROR_RESPONSE = "I apologize, but I encountered an error while generating the response. Please try again."
+
+class ChatPipeline:
+    def __init__(self,
+                 rag_system: "RAGSystem",
+                 query: str,
+                 history: Optional[List[Dict]] = None,
+                 filters: Optional[Dict[str, List[str]]] = None,
+                 k: int = 5,
+                 require_context: bool = False,
+                 session_id: str = DEFAULT_SESSION):
+        """
+        One chat request: retrieve, assemble prompt, generate, post-process.
+
+        Each stage reads what the previous ones left on the pipeline, so retrieval
+        runs exactly once per message, and records how long it took.
+
+        Args:
+            rag_system: RAG system providing retrieval, the LLM, memory and the answer cache
+            query: User query
+            history: Chat history sent by the client (list of {"role", "text"} dicts)
+            filters: Restrict retrieval by metadata: {"sources": [...], "doc_sets": [...], "tags": [...]}
+            k: Number of context chunks to retrieve
+            require_context: Answer with a fixed message instead of calling the LLM when nothing is retrieved
+            session_id: Chat session whose conversation memory is used and updated
+        """
+        self.rag = rag_system
+        self.query = query
+        self.history = history or []
+        self.filters = filters
+        self.k = k
+        self.require_context = require_context
+        self.session_id = session_id
+
+        # Intermediate results, filled in by the stages
+        self.snapshot: Optional["IndexSnapshot"] = None
+        self.context: List[Dict] = []
+        self.chunk_ids: List[int] = []
+        self.query_embedding: Optional[np.ndarray] = None
+        self.messages: Optional[List[Dict]] = None
+        self.prompt_tokens: Optional[Dict] = None
+        self.response: Optional[Dict] = None
+        self.cached = False
+
+        # Stage name -> duration in milliseconds, in execution order
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def _stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (time.perf_counter() - started) * 1000
+
+    def run(self) -> Dict:
+        """
+        Run all stages from sync code and return the response; see arun().
+        """
+        return run_sync(self.arun())
+
+    async def arun(self) -> Dict:
+        """
+        Run all stages and return the response.
+
+        Returns:
+            Dict: Response containing text, optional audio, and whether it came from the answer cache
+        """
+        started = time.perf_counter()
+        try:
+            await self._prepare()
+            if self.response is None:
+                with self._stage("generate"):
+                    await self.generate()
+            # The whole answer arrives at once
+            self.timings["ttft"] = (time.perf_counter() - started) * 1000
+            with self._stage("postprocess"):
+                self.postprocess()
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            self.response = {"responses": [ERROR_RESPONSE], "audio": None, "cached": False, "error": True}
+        self._finish(started)
+        return self.response
+
+    async def stream(self) -> AsyncIterator[Dict]:
+        """
+        Run all stages, streaming the answer while it is generated.
+
+        The first event carries the retrieval metadata; conversation memory and the
+        answer cache are only updated once the whole answer has been streamed.
+
+        Yields:
+            Dict: {"event": "metadata" | "token" | "done" | "error", "data": {...}}
+        """
+        started = time.perf_counter()
+        try:
+            await self._prepare()
+            yield {"event": "metadata", "data": self.metadata()}
+
+            if self.response is not None:
+                # Cached or fixed answer: send it as a single piece
+                self.timings["ttft"] = (time.perf_counter() - started) * 1000
+                yield {"event": "token", "data": {"text": self.response["responses"][0]}}
+            else:
+                pieces: List[str] = []
+                usage = None
+                deployment = None
+                with self._stage("generate"):
+                    async for piece in self.rag.llm_handler.astream(self.messages):
+                        if "usage" in piece:
+                            usage = piece["usage"]
+                            continue
+                        if "deployment" in piece:
+                            deployment = piece["deployment"]
+                            continue
+                        if not pieces:
+                            self.timings["ttft"] = (time.perf_counter() - started) * 1000
+                        pieces.append(piece["delta"])
+                        yield {"event": "token", "data": {"text": piece["delta"]}}
+                self.response = {"responses": ["".join(pieces).strip()], "audio": None, "usage": usage,
+                                 "deployment": deployment}
+
+            with self._stage("postprocess"):
+                self.postprocess()
+            self._finish(started)
+            yield {"event": "done", "data": {
+                "cached": self.cached,
+                "prompt_tokens": self.prompt_tokens,
+                "usage": self.response.get("usage"),
+                "deployment": self.response.get("deployment"),
+                "timings": {name: round(duration, 1) for name, duration in self.timings.items()}
+            }}
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            self._finish(started)
+            yield {"event": "error", "data": {"message": ERROR_RESPONSE}}
+
+    async def _prepare(self) -> None:
+        """Retrieve, then either reuse a cached answer, settle on the no-context answer, or assemble the prompt."""
+        with self._stage("retrieve"):
+            await self.retrieve()
+        if self.context or not self.require_context:
+            with self._stage("cache"):
+                await self.lookup_cache()
+            if self.response is None:
+                with self._stage("assemble"):
+                    self.assemble()
+        else:
+            logger.info("No relevant context found for query")
+            self.response = {"responses": [NO_CONTEXT_RESPONSE], "audio": None}
+
+    def _finish(self, started: float) -> None:
+        self.timings["total"] = (time.perf_counter() - started) * 1000
+        self.rag.latency.record("ttft", self.timings.get("ttft"))
+        self.rag.latency.record("total", self.timings["total"])
+
+    def metadata(self) -> Dict:
+        """Retrieval results sent ahead of a streamed answer."""
+        return {
+            "session_id": self.session_id,
+            "cached": self.cached,
+            "index_version": self.snapshot.version if self.snapshot is not None else None,
+            "sources": [
+                {
+                    "source": Path(chunk["metadata"].get("source", "")).name,
+                    "chunk_ids": chunk.get("ids", []),
+                    "score": float(chunk["score"]) if chunk.get("score") is not None else None
+                }
+                for chunk in self.context
+            ],
+            "prompt_tokens": self.prompt_tokens
+        }
+
+    async def retrieve(self) -> None:
+        """Search one pinned index version for context."""
+        self.snapshot = self.rag.pdf_processor.store.snapshot()
+        self.context = await self.rag.aquery(self.query, k=self.k, filters=self.filters, snapshot=self.snapshot) or []
+        self.chunk_ids = [vector_id for chunk in self.context for vector_id in chunk.get("ids", [])]
+
+    async def lookup_cache(self) -> None:
+        """
+        Reuse the answer to an earlier paraphrase that retrieved the same chunks.
+
+        Answers that depend on a conversation (session memory or client history) are
+        neither looked up nor stored, since a follow-up means something else in another session.
+        """
+        cache = self.rag.answer_cache
+        if cache is None or not self.chunk_ids:
+            return
+        if self.history or self.rag.get_memory(self.session_id):
+            return
+        self.query_embedding = await self.rag.pdf_processor.aembed_query(self.query)
+        cached = cache.get(self.query_embedding, self.chunk_ids, self.snapshot.version)
+        if cached is not None:
+            self.response = cached
+            self.cached = True
+
+    def assemble(self) -> None:
+        """Build the prompt from instructions, conversation memory, chat history and context within the token budget."""
+        self.messages, self.prompt_tokens = self.rag.llm_handler.build_prompt(
+            self.query,
+            self.context,
+            conversation_history=self.rag.get_memory(self.session_id),
+            chat_history=self.history
+        )
+
+    async def generate(self) -> None:
+        """Call the LLM."""
+        self.response = await self.rag.llm_handler.acomplete(self.messages)
+
+    def postprocess(self) -> None:
+        """Update conversation memory and the answer cache, and report how the response was produced."""
+        answered = bool(self.context) or not self.require_context
+        if answered and self.response.get("responses"):
+            self.rag.add_to_memory(self.query, self.response["responses"][0], self.session_id)
+            if (not self.cached and self.query_embedding is not None
+                    and not self.response.get("error")):
+                self.rag.answer_cache.put(self.query_embedding, self.chunk_ids, self.snapshot.version, self.response)
+        self.response["cached"] = self.cached
+        self.response["prompt_tokens"] = self.prompt_tokens
+        if self.cached:
+            self.response["usage"] = None
+            self.response["deployment"] = None
+
+    def server_timing(self) -> str:
+        """Stage timings as a Server-Timing header value."""
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in self.timings.items())
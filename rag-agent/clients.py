@@ -0,0 +1,140 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+import httpx
+from openai import AsyncAzureOpenAI
+import logging
+
+logger = logging.getLogger(__name__)
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Retry-After (or retry-after-ms) of a failed OpenAI request, if the server sent one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    retry_after = response.headers.get("retry-after-ms")
+    if retry_after:
+        try:
+            return float(retry_after) / 1000
+        except ValueError:
+            pass
+    retry_after = response.headers.get("retry-after")
+    try:
+        return float(retry_after) if retry_after else None
+    except ValueError:
+        return None
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+# ExcelAgent/excel.py carries a copy of this function (the two apps ship as separate containers);
+# keep the env names and defaults of both in step
+def create_http_client() -> httpx.AsyncClient:
+    """
+    New async HTTP client tuned for Azure OpenAI: keep-alive, HTTP/2 when the h2
+    package is installed, and bounded connection pool.
+
+    Configured by OPENAI_HTTP2, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE,
+    OPENAI_KEEPALIVE_EXPIRY, OPENAI_CONNECT_TIMEOUT and OPENAI_READ_TIMEOUT.
+    """
+    http2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+    if http2 and not _http2_available():
+        logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+
+    read_timeout = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+        ),
+        timeout=httpx.Timeout(read_timeout, connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")))
+    )
+
+def create_async_openai(endpoint: str,
+                        api_key: str,
+                        api_version: str,
+                        **kwargs) -> AsyncAzureOpenAI:
+    """New AsyncAzureOpenAI client with its own tuned connection pool; the caller closes it."""
+    return AsyncAzureOpenAI(
+        api_key=api_key,
+        api_version=api_version,
+        azure_endpoint=endpoint,
+        http_client=create_http_client(),
+        **kwargs
+    )
+
+# Connections belong to the event loop that opened them, so clients are shared per loop.
+# On the server that is a single loop: every handler, the LLM and the embedding calls share one pool.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str, str, Optional[int]], AsyncAzureOpenAI]]" = \
+    weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def get_async_openai(endpoint: str,
+                     api_key: str,
+                     api_version: str,
+                     max_retries: Optional[int] = None) -> AsyncAzureOpenAI:
+    """
+    Shared AsyncAzureOpenAI client for the running event loop.
+
+    Chat and embedding deployments on the same resource use the same client and
+    connection pool; the deployment is chosen per request.
+
+    Args:
+        endpoint: Resource endpoint
+        api_key: API key
+        api_version: API version
+        max_retries: SDK retries per request (None for the SDK default); callers that
+            retry or fail over themselves pass 0
+
+    Raises:
+        RuntimeError: If called outside a running event loop
+    """
+    loop = asyncio.get_running_loop()
+    key = (endpoint, api_key, api_version, max_retries)
+    with _clients_lock:
+        clients = _clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            kwargs = {"max_retries": max_retries} if max_retries is not None else {}
+            client = create_async_openai(endpoint, api_key, api_version, **kwargs)
+            clients[key] = client
+            logger.info(f"Opened shared Azure OpenAI connection pool for {endpoint}")
+    return client
+
+async def close_async_clients() -> None:
+    """Close the shared clients of the running event loop."""
+    with _clients_lock:
+        clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from sync code, even if called inside a running event loop.
+
+    The coroutine gets a fresh event loop; shared clients opened on it are closed before returning.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_async_clients()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(main())
+
+    # A loop is already running in this thread; run the coroutine on a fresh loop in a worker thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, main()).result()
@@ -0,0 +1,289 @@
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List
+import logging
+from tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Session used when the caller does not identify one (CLI, scripts)
+DEFAULT_SESSION = "default"
+
+class ConversationStore(ABC):
+    def __init__(self,
+                 max_turns: int = 7,
+                 session_tokens: int = 2000,
+                 ttl_seconds: float = 3600,
+                 max_sessions: int = 10_000,
+                 max_total_tokens: int = 2_000_000):
+        """
+        Question-answer history per chat session.
+
+        Each session keeps its most recent turns within max_turns and session_tokens;
+        older turns are dropped first. Sessions idle for longer than ttl_seconds expire,
+        and when the store holds more than max_sessions sessions or max_total_tokens
+        tokens overall, the least recently used sessions are evicted.
+
+        Args:
+            max_turns: Maximum number of turns kept per session
+            session_tokens: Token budget of one session's history
+            ttl_seconds: Idle time after which a session is dropped
+            max_sessions: Maximum number of sessions kept
+            max_total_tokens: Token budget of all sessions together
+        """
+        self.max_turns = max_turns
+        self.session_tokens = session_tokens
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_total_tokens = max_total_tokens
+
+        self.evictions = 0
+        self.expirations = 0
+
+    @abstractmethod
+    def append(self, session_id: str, query: str, response: str) -> None:
+        """Add a question-answer pair to a session, trimming it to its budget."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> List[Dict]:
+        """
+        Return a session's turns, oldest first.
+
+        Returns:
+            List[Dict]: Turns with "query", "response", "tokens" and "created_at"
+        """
+
+    @abstractmethod
+    def clear(self, session_id: str) -> None:
+        """Forget a session."""
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """Return the number of sessions and tokens held, and eviction counters."""
+
+    def _make_turn(self, query: str, response: str) -> Dict:
+        tokens = count_tokens(query) + count_tokens(response)
+        if tokens > self.session_tokens:
+            # Keep the start of an answer too long for the session rather than losing the whole history
+            response = truncate_tokens(response, max(0, self.session_tokens - count_tokens(query)))
+            tokens = count_tokens(query) + count_tokens(response)
+        return {
+            "query": query,
+            "response": response,
+            "tokens": tokens,
+            "created_at": time.time()
+        }
+
+    def _kept(self, token_counts: List[int]) -> int:
+        """Number of most recent turns, given their token counts oldest first, that fit the session budget."""
+        kept, total = 0, 0
+        for tokens in reversed(token_counts):
+            if kept >= self.max_turns or total + tokens > self.session_tokens:
+                break
+            kept += 1
+            total += tokens
+        return kept
+
+class InMemoryConversationStore(ConversationStore):
+    def __init__(self, **limits):
+        """
+        Conversation store local to this process.
+
+        Args:
+            **limits: See ConversationStore
+        """
+        super().__init__(**limits)
+        # Session ID -> {"turns", "tokens", "last_used"}, least recently used first
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+
+    def append(self, session_id: str, query: str, response: str) -> None:
+        turn = self._make_turn(query, response)
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            session = self._sessions.pop(session_id, None) or {"turns": [], "tokens": 0}
+            turns = session["turns"] + [turn]
+            turns = turns[len(turns) - self._kept([t["tokens"] for t in turns]):]
+            tokens = sum(t["tokens"] for t in turns)
+            self._total_tokens += tokens - session["tokens"]
+            if turns:
+                self._sessions[session_id] = {"turns": turns, "tokens": tokens, "last_used": now}
+            self._enforce_caps()
+
+    def get(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            session["last_used"] = now
+            self._sessions.move_to_end(session_id)
+            return [dict(turn) for turn in session["turns"]]
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._total_tokens -= session["tokens"]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "tokens": self._total_tokens,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["last_used"] >= cutoff:
+                break
+            del self._sessions[session_id]
+            self._total_tokens -= session["tokens"]
+            self.expirations += 1
+
+    def _enforce_caps(self) -> None:
+        while self._sessions and (len(self._sessions) > self.max_sessions
+                                  or self._total_tokens > self.max_total_tokens):
+            _, session = self._sessions.popitem(last=False)
+            self._total_tokens -= session["tokens"]
+            self.evictions += 1
+
+class SQLiteConversationStore(ConversationStore):
+    def __init__(self, db_path: str, **limits):
+        """
+        Conversation store in a SQLite file, shared by every worker process on the host.
+
+        Stands in for a networked store such as Redis: all state lives in the
+        database, and every change runs in its own write transaction, so workers
+        serving the same session see each other's turns.
+
+        Args:
+            db_path: Path of the database file
+            **limits: See ConversationStore
+        """
+        super().__init__(**limits)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, tokens INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, query TEXT NOT NULL, "
+            "response TEXT NOT NULL, tokens INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_turns_session ON turns(session_id, id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions(last_used)")
+        self._lock = threading.Lock()
+        logger.info(f"Shared conversation store at {db_path}")
+
+    def append(self, session_id: str, query: str, response: str) -> None:
+        turn = self._make_turn(query, response)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                self._expire(now)
+                self._db.execute(
+                    "INSERT INTO turns (session_id, query, response, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, turn["query"], turn["response"], turn["tokens"], turn["created_at"])
+                )
+                rows = self._db.execute(
+                    "SELECT id, tokens FROM turns WHERE session_id = ? ORDER BY id", (session_id,)
+                ).fetchall()
+                kept = self._kept([tokens for _, tokens in rows])
+                dropped = len(rows) - kept
+                if dropped:
+                    self._db.execute(
+                        "DELETE FROM turns WHERE session_id = ? AND id <= ?", (session_id, rows[dropped - 1][0])
+                    )
+                if kept:
+                    self._db.execute(
+                        "INSERT INTO sessions (session_id, tokens, last_used) VALUES (?, ?, ?) "
+                        "ON CONFLICT(session_id) DO UPDATE SET tokens = excluded.tokens, last_used = excluded.last_used",
+                        (session_id, sum(tokens for _, tokens in rows[dropped:]), now)
+                    )
+                else:
+                    self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._enforce_caps()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def get(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            now = time.time()
+            updated = self._db.execute(
+                "UPDATE sessions SET last_used = ? WHERE session_id = ? AND last_used >= ?",
+                (now, session_id, now - self.ttl_seconds)
+            ).rowcount
+            if not updated:
+                return []
+            rows = self._db.execute(
+                "SELECT query, response, tokens, created_at FROM turns WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+        return [
+            {"query": query, "response": response, "tokens": tokens, "created_at": created_at}
+            for query, response, tokens, created_at in rows
+        ]
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.execute("COMMIT")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sessions, tokens = self._db.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM sessions").fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "tokens": tokens,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def _delete_sessions(self, session_ids: List[str]) -> None:
+        for session_id in session_ids:
+            self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _expire(self, now: float) -> None:
+        expired = [row[0] for row in self._db.execute(
+            "SELECT session_id FROM sessions WHERE last_used < ?", (now - self.ttl_seconds,)
+        )]
+        self._delete_sessions(expired)
+        self.expirations += len(expired)
+
+    def _enforce_caps(self) -> None:
+        sessions, tokens = self._db.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM sessions").fetchone()
+        if sessions <= self.max_sessions and tokens <= self.max_total_tokens:
+            return
+        evicted = []
+        for session_id, session_tokens in self._db.execute(
+                "SELECT session_id, tokens FROM sessions ORDER BY last_used"):
+            if sessions <= self.max_sessions and tokens <= self.max_total_tokens:
+                break
+            evicted.append(session_id)
+            sessions -= 1
+            tokens -= session_tokens
+        self._delete_sessions(evicted)
+        self.evictions += len(evicted)
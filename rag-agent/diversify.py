@@ -0,0 +1,103 @@
+from typing import Dict, List
+import numpy as np
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_: float = 0.7) -> List[int]:
+    """
+    Pick a diverse top-k with Maximal Marginal Relevance.
+
+    The candidate similarity matrix is computed once; each greedy step is a vector
+    operation over all remaining candidates.
+
+    Args:
+        relevance: Relevance of each candidate to the query, shape (n,)
+        vectors: Normalized candidate embeddings, shape (n, dimension)
+        k: Number of candidates to select
+        lambda_: Trade-off between relevance (1.0) and diversity (0.0)
+
+    Returns:
+        List[int]: Positions of the selected candidates, in selection order
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype='float32')
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+
+    while len(selected) < k:
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return selected
+
+def _join_overlapping(first: str, second: str, max_overlap: int) -> str:
+    """Concatenate two consecutive chunks, dropping the text they share."""
+    probe = second[:32]
+    if probe:
+        start = first.find(probe, max(0, len(first) - max_overlap))
+        while start != -1:
+            if second.startswith(first[start:]):
+                return first + second[len(first) - start:]
+            start = first.find(probe, start + 1)
+    return first + "\n" + second
+
+def merge_adjacent(hits: List[Dict], max_overlap: int = 4000) -> List[Dict]:
+    """
+    Collapse hits that are consecutive chunks of the same source into one passage.
+
+    A merged passage keeps the rank and score of its best chunk and lists every
+    chunk it covers in metadata["chunk_ids"].
+
+    Args:
+        hits: Search hits, best first, with metadata["source"] and metadata["chunk_id"]
+        max_overlap: Longest shared text (in characters) looked for between neighbours
+
+    Returns:
+        List[Dict]: Passages, best first
+    """
+    by_source: Dict[str, List[int]] = {}
+    for position, hit in enumerate(hits):
+        by_source.setdefault(hit["metadata"]["source"], []).append(position)
+
+    passages = []
+    for positions in by_source.values():
+        positions.sort(key=lambda p: hits[p]["metadata"]["chunk_id"])
+        run = [positions[0]]
+        for position in positions[1:]:
+            if hits[position]["metadata"]["chunk_id"] == hits[run[-1]]["metadata"]["chunk_id"] + 1:
+                run.append(position)
+            else:
+                passages.append(run)
+                run = [position]
+        passages.append(run)
+
+    merged = []
+    for run in passages:
+        best = min(run)
+        if len(run) == 1:
+            merged.append((best, hits[best]))
+            continue
+
+        text = hits[run[0]]["text"]
+        for position in run[1:]:
+            text = _join_overlapping(text, hits[position]["text"], max_overlap)
+        passage = dict(hits[best])
+        passage["text"] = text
+        passage["metadata"] = dict(hits[best]["metadata"])
+        passage["metadata"]["chunk_ids"] = [hits[p]["metadata"]["chunk_id"] for p in run]
+        passage["metadata"]["chunk_id"] = hits[run[0]]["metadata"]["chunk_id"]
+        passage["metadata"]["chunk_size"] = len(text)
+        passage["ids"] = [vector_id for p in run for vector_id in hits[p]["ids"]]
+        merged.append((best, passage))
+
+    return [passage for _, passage in sorted(merged, key=lambda item: item[0])]
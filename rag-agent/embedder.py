@@ -0,0 +1,179 @@
+import asyncio
+import random
+from typing import Callable, List, Optional
+import numpy as np
+import openai
+from openai import AsyncAzureOpenAI
+from tqdm import tqdm
+import logging
+from clients import retry_after_seconds
+from quota import QuotaScheduler, PRIORITY_BATCH
+from tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Per-input limit of the Azure OpenAI embedding models
+MAX_INPUT_TOKENS = 8191
+
+class AsyncEmbedder:
+    def __init__(self,
+                 client_factory: Callable[[], AsyncAzureOpenAI],
+                 deployment: str,
+                 dimension: int = 1536,
+                 max_concurrency: int = 4,
+                 max_batch_tokens: int = 32000,
+                 max_batch_size: int = 256,
+                 max_retries: int = 6,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0,
+                 quota: Optional[QuotaScheduler] = None):
+        """
+        Concurrent embedding pipeline on AsyncAzureOpenAI.
+
+        Texts are packed into batches by token count, batches are sent with bounded
+        concurrency, and throttled or failed requests are retried with exponential
+        backoff. A batch that still fails raises instead of producing placeholder vectors.
+
+        Args:
+            client_factory: Returns a new AsyncAzureOpenAI client; one is opened per embed() call
+            deployment: Embedding deployment name
+            dimension: Embedding dimension
+            max_concurrency: Maximum number of requests in flight
+            max_batch_tokens: Maximum total tokens per request
+            max_batch_size: Maximum number of texts per request
+            max_retries: Retries per batch on 429, 5xx and connection errors
+            base_delay: First backoff delay in seconds
+            max_delay: Upper bound on a single backoff delay in seconds
+            quota: Optional scheduler shared with interactive calls to the same deployment;
+                batches then only use the quota those leave over
+        """
+        self.client_factory = client_factory
+        self.deployment = deployment
+        self.dimension = dimension
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.quota = quota
+
+    def _prepare(self, text: str) -> tuple:
+        """Return the text (truncated to the model's input limit) and its token count."""
+        n_tokens = count_tokens(text)
+        if n_tokens > MAX_INPUT_TOKENS:
+            logger.warning(f"Truncating text of {n_tokens} tokens to {MAX_INPUT_TOKENS}")
+            text = truncate_tokens(text, MAX_INPUT_TOKENS)
+            n_tokens = count_tokens(text)
+        return text, n_tokens
+
+    def _make_batches(self, token_counts: List[int]) -> List[List[int]]:
+        """Pack text positions into batches bounded by token count and batch size."""
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+
+        for i, n_tokens in enumerate(token_counts):
+            if current and (current_tokens + n_tokens > self.max_batch_tokens
+                            or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += n_tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Backoff delay, honouring the server's Retry-After header when present."""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return delay * (0.5 + random.random() / 2)
+
+    async def _embed_batch(self,
+                           client: AsyncAzureOpenAI,
+                           texts: List[str],
+                           n_tokens: int,
+                           semaphore: asyncio.Semaphore) -> List[List[float]]:
+        """Embed one batch, retrying throttled and transient failures."""
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    if self.quota is None:
+                        response = await client.embeddings.create(input=texts, model=self.deployment)
+                    else:
+                        await self.quota.acquire(n_tokens, PRIORITY_BATCH)
+                        raw = await client.embeddings.with_raw_response.create(input=texts, model=self.deployment)
+                        self.quota.record_headers(raw.headers)
+                        response = raw.parse()
+                return [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+            except Exception as e:
+                if self.quota is not None and isinstance(e, openai.RateLimitError):
+                    self.quota.record_throttle(retry_after_seconds(e))
+                if not self._is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+                logger.warning(f"Embedding batch of {len(texts)} failed ({str(e)}), "
+                               f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def embed(self,
+                    texts: List[str],
+                    desc: Optional[str] = None,
+                    on_progress: Optional[Callable[[int], None]] = None) -> np.ndarray:
+        """
+        Embed a list of texts.
+
+        Args:
+            texts: Non-empty texts to embed
+            desc: Optional progress bar label
+            on_progress: Optional callback receiving the number of texts embedded by each finished batch
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(texts), dimension), row i for texts[i]
+        """
+        if any(not text or not text.strip() for text in texts):
+            raise ValueError("Cannot embed empty text")
+
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        if not texts:
+            return embeddings
+
+        prepared, token_counts = zip(*(self._prepare(text) for text in texts))
+        batches = self._make_batches(list(token_counts))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self.client_factory() as client:
+            async def run(positions: List[int]) -> int:
+                vectors = await self._embed_batch(client, [prepared[i] for i in positions],
+                                                  sum(token_counts[i] for i in positions), semaphore)
+                embeddings[positions] = np.asarray(vectors, dtype='float32')
+                return len(positions)
+
+            tasks = [asyncio.ensure_future(run(positions)) for positions in batches]
+            try:
+                with tqdm(total=len(texts), desc=desc or "Generating embeddings with Azure OpenAI") as progress:
+                    for finished in asyncio.as_completed(tasks):
+                        n_done = await finished
+                        progress.update(n_done)
+                        if on_progress:
+                            on_progress(n_done)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+        return embeddings
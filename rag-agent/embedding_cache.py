@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(text: str) -> str:
+    """Normalize query text so trivially different spellings share a cache entry."""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.lower().split())
+
+class QueryEmbeddingCache:
+    def __init__(self,
+                 max_size: int = 1024,
+                 db_path: Optional[str] = None,
+                 max_disk_entries: int = 100_000):
+        """
+        Two-tier cache for query embeddings.
+
+        The first tier is an in-process LRU. The optional second tier is a SQLite file
+        that survives restarts; entries found there are promoted into the LRU.
+
+        Args:
+            max_size: Maximum number of embeddings kept in memory
+            db_path: Path of the persistent store, or None for memory only
+            max_disk_entries: Maximum number of embeddings kept on disk
+        """
+        self.max_size = max_size
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+            self._db.commit()
+            logger.info(f"Persistent query embedding cache at {db_path}")
+
+    @staticmethod
+    def make_key(text: str, deployment: str) -> str:
+        """Build the cache key from the normalized text and the embedding deployment."""
+        return hashlib.sha256(f"{deployment}\n{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, deployment: str) -> Optional[np.ndarray]:
+        """
+        Look up a query embedding.
+
+        Returns:
+            Optional[np.ndarray]: Cached embedding, or None on a miss
+        """
+        key = self.make_key(text, deployment)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+            if self._db is not None:
+                row = self._db.execute("SELECT embedding FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype='float32')
+                    self._db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, deployment: str, embedding: np.ndarray) -> None:
+        """Store a query embedding in both tiers."""
+        key = self.make_key(text, deployment)
+        embedding = np.ascontiguousarray(embedding, dtype='float32')
+        embedding.setflags(write=False)
+        with self._lock:
+            self._remember(key, embedding)
+
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                    (key, embedding.tobytes(), time.time())
+                )
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, embedding: np.ndarray) -> None:
+        """Insert into the in-memory LRU, evicting the least recently used entries."""
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current sizes."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            disk_size = None
+            if self._db is not None:
+                disk_size = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_size": len(self._memory),
+                "disk_size": disk_size
+            }
+
+class ChunkEmbeddingCache:
+    def __init__(self, db_path: str, dimension: int = 1536):
+        """
+        Content-addressed store of chunk embeddings, shared across all documents.
+
+        Entries are keyed by the hash of the embedding model and the chunk text, so
+        re-ingesting a revised PDF or an overlapping document only embeds new chunks.
+
+        Args:
+            db_path: Path of the SQLite store
+            dimension: Embedding dimension
+        """
+        self.dimension = dimension
+        self._lock = threading.Lock()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self._db.commit()
+        logger.info(f"Chunk embedding cache at {db_path}")
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        """Build the content address of a chunk for a given embedding model."""
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str], model: str) -> Dict[int, np.ndarray]:
+        """
+        Look up embeddings for a list of chunk texts.
+
+        Returns:
+            Dict[int, np.ndarray]: Position in `texts` -> cached embedding, for hits only
+        """
+        keys = [self.make_key(text, model) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, embedding FROM chunk_embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    embedding = np.frombuffer(blob, dtype='float32')
+                    if embedding.shape[0] == self.dimension:
+                        found[key] = embedding
+
+        return {i: found[key] for i, key in enumerate(keys) if key in found}
+
+    def put_many(self, texts: List[str], model: str, embeddings: np.ndarray) -> None:
+        """Store embeddings for a list of chunk texts."""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        rows = [
+            (self.make_key(text, model), embedding.tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunk_embeddings (key, embedding) VALUES (?, ?)", rows
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
@@ -0,0 +1,290 @@
+import math
+import time
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+import faiss
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("auto", "flat", "ivf", "hnsw", "sq8", "ivfpq")
+
+# Engines whose vectors can be removed in place; the others are rebuilt on removal
+REMOVABLE_ENGINES = ("flat", "ivf", "sq8", "ivfpq")
+
+# Engines storing lossy codes instead of float32 vectors; their candidates are re-scored exactly
+COMPRESSED_ENGINES = ("sq8", "ivfpq")
+
+# Corpus size thresholds for auto-selection
+FLAT_MAX_VECTORS = 20_000
+IVF_MAX_VECTORS = 1_000_000
+
+# Minimum training points per IVF list / PQ centroid that FAISS needs for stable clustering
+MIN_POINTS_PER_CENTROID = 39
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return float32 copies of the vectors scaled to unit length, so inner product is cosine."""
+    vectors = np.array(vectors, dtype='float32', copy=True, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def choose_engine(n_vectors: int, compressed: bool = False) -> str:
+    """Pick an index engine for a corpus size, optionally among the compressed engines."""
+    if compressed:
+        return "sq8" if n_vectors <= FLAT_MAX_VECTORS else "ivfpq"
+    if n_vectors <= FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= IVF_MAX_VECTORS:
+        return "ivf"
+    return "ivfpq"
+
+def _nlist_for(n_vectors: int) -> int:
+    """Number of IVF lists: about 4*sqrt(n), capped so every list gets enough training points."""
+    nlist = int(4 * math.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID, 65536))
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest PQ sub-quantizer count from a standard set that divides the dimension."""
+    for m in (96, 64, 48, 32, 16, 8):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def _inner_index(index: faiss.Index) -> faiss.Index:
+    """Unwrap an IndexIDMap to the index doing the actual search."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def set_search_params(index: faiss.Index, params: Dict) -> None:
+    """Apply nprobe / efSearch from an index card's params."""
+    inner = _inner_index(index)
+    if "nprobe" in params:
+        faiss.extract_index_ivf(inner).nprobe = params["nprobe"]
+    if "efSearch" in params and isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = params["efSearch"]
+
+def filtered_search_params(index: faiss.Index, params: Dict, mask: np.ndarray) -> Tuple[faiss.SearchParameters, Tuple]:
+    """
+    Search parameters restricting a search to the vector IDs set in a bitmap.
+
+    IVF nprobe is scaled up by the inverse of the filter's selectivity (up to nlist),
+    so a filtered search still visits about as many matching vectors as an
+    unfiltered one.
+
+    Args:
+        index: Index to search
+        params: Index card params
+        mask: Boolean mask indexed by vector ID
+
+    Returns:
+        Tuple[faiss.SearchParameters, Tuple]: The parameters, and objects that must stay
+        alive while they are used
+    """
+    bitmap = np.packbits(mask, bitorder='little')
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))  # Size in bytes
+
+    if "nprobe" in params:
+        fraction = max(float(mask.sum()) / max(index.ntotal, 1), 1e-9)
+        search_params = faiss.SearchParametersIVF()
+        search_params.nprobe = int(min(params["nlist"], math.ceil(params["nprobe"] / fraction)))
+    else:
+        search_params = faiss.SearchParameters()
+    search_params.sel = selector
+    return search_params, (bitmap, selector)
+
+def _sample_queries(vectors: np.ndarray, n_queries: int, rng: np.random.Generator) -> np.ndarray:
+    """Synthetic queries: normalized midpoints of random pairs of corpus vectors."""
+    a = rng.integers(0, len(vectors), n_queries)
+    b = rng.integers(0, len(vectors), n_queries)
+    return normalize(vectors[a] + vectors[b])
+
+def exact_rerank(queries: np.ndarray,
+                 candidates: np.ndarray,
+                 get_vectors: Callable[[np.ndarray], np.ndarray],
+                 k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Re-score candidate IDs exactly and keep the best k per query.
+
+    Args:
+        queries: Normalized query vectors, shape (n_queries, dimension)
+        candidates: Candidate vector IDs from a first-pass search, -1 for none
+        get_vectors: Returns the normalized float32 vectors of an array of IDs
+        k: Number of results to keep per query
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Exact scores and IDs, best first, padded with -inf / -1
+    """
+    unique_ids, positions = np.unique(candidates, return_inverse=True)
+    positions = positions.reshape(candidates.shape)
+    valid_ids = unique_ids >= 0
+    vectors = np.zeros((len(unique_ids), queries.shape[1]), dtype='float32')
+    if valid_ids.any():
+        vectors[valid_ids] = get_vectors(unique_ids[valid_ids])
+
+    scores = np.take_along_axis(queries @ vectors.T, positions, axis=1)
+    scores[candidates < 0] = -np.inf
+
+    k = min(k, candidates.shape[1])
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+def measure_recall(index: faiss.Index,
+                   vectors: np.ndarray,
+                   ids: np.ndarray,
+                   queries: np.ndarray,
+                   k: int = 10,
+                   ground_truth: Optional[np.ndarray] = None,
+                   rerank: int = 1) -> float:
+    """
+    Recall@k of an index against exact inner-product search.
+
+    Args:
+        index: Index to evaluate (returns external IDs)
+        vectors: Normalized corpus vectors, row i has ID ids[i]
+        ids: Vector IDs
+        queries: Normalized query vectors
+        k: Number of neighbours compared
+        ground_truth: Precomputed exact neighbour IDs, shape (len(queries), k)
+        rerank: Fetch k * rerank candidates and re-score them exactly before comparing
+
+    Returns:
+        float: Fraction of exact neighbours the index found
+    """
+    k = min(k, len(vectors))
+    if ground_truth is None:
+        _, positions = faiss.knn(queries, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+        ground_truth = ids[positions]
+    if rerank > 1:
+        _, candidates = index.search(queries, min(k * rerank, len(vectors)))
+        sorter = np.argsort(ids)
+        rows_of = lambda found: vectors[sorter[np.searchsorted(ids, found, sorter=sorter)]]
+        _, found = exact_rerank(queries, candidates, rows_of, k)
+    else:
+        _, found = index.search(queries, k)
+    hits = sum(len(set(truth.tolist()) & set(result.tolist())) for truth, result in zip(ground_truth, found))
+    return hits / float(ground_truth.size)
+
+def build_index(vectors: np.ndarray,
+                ids: np.ndarray,
+                dimension: int,
+                engine: str = "auto",
+                target_recall: float = 0.95,
+                compressed: bool = False,
+                rerank: int = 1) -> Tuple[faiss.Index, Dict]:
+    """
+    Build, train and tune an inner-product index over normalized vectors.
+
+    IVF nprobe and HNSW efSearch are raised step by step until recall@10 on a sample
+    of synthetic queries reaches the target recall. For compressed engines, recall
+    is measured after exact re-scoring of k * rerank candidates.
+
+    Args:
+        vectors: Normalized float32 vectors
+        ids: int64 vector IDs, one per row
+        dimension: Vector dimension
+        engine: One of ENGINES
+        target_recall: Recall@10 to tune for
+        compressed: Let "auto" choose among the compressed engines
+        rerank: Candidate multiplier used when searching a compressed engine
+
+    Returns:
+        Tuple[faiss.Index, Dict]: The index (searching returns vector IDs) and its index card
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown index engine '{engine}', expected one of {ENGINES}")
+
+    started = time.time()
+    n_vectors = len(vectors)
+    requested = engine
+    if engine == "auto":
+        engine = choose_engine(n_vectors, compressed)
+
+    # Fall back to simpler engines when there is too little data to train
+    if engine == "ivfpq" and n_vectors < 256 * MIN_POINTS_PER_CENTROID:
+        logger.info(f"Only {n_vectors} vectors, too few to train PQ; using SQ8 instead")
+        engine = "sq8"
+    if engine == "sq8" and n_vectors < MIN_POINTS_PER_CENTROID:
+        logger.info(f"Only {n_vectors} vectors, too few to train SQ8; using flat instead")
+        engine = "flat"
+    if engine == "ivf" and _nlist_for(n_vectors) < 2:
+        logger.info(f"Only {n_vectors} vectors, too few to train IVF; using flat instead")
+        engine = "flat"
+
+    params: Dict = {}
+    if engine == "flat":
+        inner = faiss.IndexFlatIP(dimension)
+    elif engine == "hnsw":
+        params = {"M": 32, "efConstruction": 80}
+        inner = faiss.IndexHNSWFlat(dimension, params["M"], faiss.METRIC_INNER_PRODUCT)
+        inner.hnsw.efConstruction = params["efConstruction"]
+    elif engine == "sq8":
+        inner = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    elif engine == "ivf":
+        params = {"nlist": _nlist_for(n_vectors)}
+        quantizer = faiss.IndexFlatIP(dimension)
+        inner = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"], faiss.METRIC_INNER_PRODUCT)
+    else:
+        params = {"nlist": _nlist_for(n_vectors), "m": _pq_subquantizers(dimension), "nbits": 8}
+        quantizer = faiss.IndexFlatIP(dimension)
+        inner = faiss.IndexIVFPQ(quantizer, dimension, params["nlist"], params["m"], params["nbits"],
+                                 faiss.METRIC_INNER_PRODUCT)
+
+    if not inner.is_trained:
+        logger.info(f"Training {engine} index on {n_vectors} vectors...")
+        inner.train(vectors)
+
+    # IVF indexes store external IDs themselves (and IndexIDMap cannot remove from them);
+    # flat and HNSW need the ID map
+    index = inner if engine in ("ivf", "ivfpq") else faiss.IndexIDMap2(inner)
+    if n_vectors:
+        index.add_with_ids(vectors, ids)
+
+    rerank = rerank if engine in COMPRESSED_ENGINES else 1
+    if rerank > 1:
+        params["rerank"] = rerank
+
+    measured_recall = None
+    if engine != "flat" and n_vectors:
+        rng = np.random.default_rng(0)
+        queries = _sample_queries(vectors, min(100, n_vectors), rng)
+        k = min(10, n_vectors)
+        _, positions = faiss.knn(queries, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+        ground_truth = ids[positions]
+
+        if engine == "sq8":
+            # Nothing to tune: a full scan of the codes
+            knob, limit = None, None
+        elif engine == "hnsw":
+            knob, limit = "efSearch", 4096
+            value = 16
+        else:
+            knob, limit = "nprobe", params["nlist"]
+            value = 1
+
+        while True:
+            if knob:
+                params[knob] = min(value, limit)
+                set_search_params(index, params)
+            measured_recall = measure_recall(index, vectors, ids, queries, k, ground_truth, rerank)
+            if not knob or measured_recall >= target_recall or params[knob] >= limit:
+                break
+            value *= 2
+
+    card = {
+        "engine": engine,
+        "requested_engine": requested,
+        "metric": "inner_product",
+        "compressed": engine in COMPRESSED_ENGINES,
+        "normalized": True,
+        "dimension": dimension,
+        "n_vectors": n_vectors,
+        "params": params,
+        "target_recall": target_recall,
+        "measured_recall": 1.0 if engine == "flat" else measured_recall,
+        "build_seconds": round(time.time() - started, 3),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    }
+    logger.info(f"Built {engine} index over {n_vectors} vectors with {params}, "
+                f"recall@10={card['measured_recall']}")
+    return index, card
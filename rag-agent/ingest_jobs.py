@@ -0,0 +1,129 @@
+import threading
+import queue
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_STAGES = ("parsed", "chunked", "reused", "embedded", "indexed")
+
+class IngestionJob:
+    def __init__(self, pdf_path: str, filename: str, file_hash: Optional[str] = None):
+        """
+        State of one background ingestion job.
+
+        Args:
+            pdf_path: Path of the uploaded PDF on disk
+            filename: Original upload file name
+            file_hash: MD5 of the upload, computed while it was streamed to disk
+        """
+        self.id = uuid.uuid4().hex
+        self.pdf_path = pdf_path
+        self.filename = filename
+        self.file_hash = file_hash
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.progress = {stage: 0 for stage in PROGRESS_STAGES}
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def update(self, stage: str, count: int) -> None:
+        """Progress callback passed down to the PDF processor."""
+        with self._lock:
+            self.progress[stage] = count
+
+    def set_status(self, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.status = status
+            self.error = error
+            if status == "running":
+                self.started_at = time.time()
+            elif status in ("completed", "failed"):
+                self.finished_at = time.time()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "filename": self.filename,
+                "file_hash": self.file_hash,
+                "status": self.status,
+                "error": self.error,
+                "progress": dict(self.progress),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+class IngestionQueue:
+    def __init__(self,
+                 ingest: Callable[[str, Callable[[str, int], None]], object],
+                 max_jobs_kept: int = 500):
+        """
+        Background worker that ingests uploaded PDFs one at a time.
+
+        Args:
+            ingest: Called as ingest(pdf_path, progress) in the worker thread; raises on failure
+            max_jobs_kept: Number of finished jobs kept for status queries
+        """
+        self.ingest = ingest
+        self.max_jobs_kept = max_jobs_kept
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._queue: "queue.Queue[IngestionJob]" = queue.Queue()
+        self._lock = threading.Lock()
+
+        self._worker = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+        self._worker.start()
+        logger.info("Ingestion worker started")
+
+    def submit(self, pdf_path: str, filename: str, file_hash: Optional[str] = None) -> IngestionJob:
+        """Queue a PDF for ingestion and return its job."""
+        job = IngestionJob(pdf_path, filename, file_hash)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        logger.info(f"Queued ingestion job {job.id} for {filename}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return the status of a job, or None if it is unknown."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def list(self) -> List[Dict]:
+        """Return the status of all known jobs, newest first."""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def pending(self) -> int:
+        """Number of jobs waiting for the worker."""
+        return self._queue.qsize()
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond max_jobs_kept."""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("completed", "failed")]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs_kept)]:
+            del self.jobs[job_id]
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.set_status("running")
+            logger.info(f"Starting ingestion job {job.id} for {job.filename}")
+            try:
+                self.ingest(job.pdf_path, job.update)
+                job.set_status("completed")
+                logger.info(f"Ingestion job {job.id} completed")
+            except Exception as e:
+                job.set_status("failed", str(e))
+                logger.error(f"Ingestion job {job.id} failed: {str(e)}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,51 @@
+import threading
+from collections import deque
+from typing import Dict, Optional
+import numpy as np
+
+class LatencyTracker:
+    def __init__(self, window: int = 1000):
+        """
+        Rolling latency percentiles of recent chat requests.
+
+        Time to first token is the headline number: it is what a user waits before
+        the answer starts appearing. For non-streamed requests it equals the time to
+        the full answer.
+
+        Args:
+            window: Number of most recent requests summarized
+        """
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, metric: str, milliseconds: Optional[float]) -> None:
+        """Add one measurement of a metric, e.g. "ttft" or "total"."""
+        if milliseconds is None:
+            return
+        with self._lock:
+            if metric not in self._samples:
+                self._samples[metric] = deque(maxlen=self.window)
+                self._counts[metric] = 0
+            self._samples[metric].append(milliseconds)
+            self._counts[metric] += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """Return count and p50/p95/p99/max in milliseconds per metric."""
+        with self._lock:
+            samples = {metric: np.array(values) for metric, values in self._samples.items()}
+            counts = dict(self._counts)
+        stats = {}
+        for metric, values in samples.items():
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats[metric] = {
+                "count": counts[metric],
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "max_ms": round(float(values.max()), 1)
+            }
+        return stats
@@ -1,8 +1,10 @@
 import os
-from typing import List, Dict, Optional
-from openai import AzureOpenAI
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
 from dotenv import load_dotenv
 import logging
+from prompt_builder import PromptBuilder
+from llm_router import LLMRouter
+from clients import run_sync
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -10,6 +12,8 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+ERROR_MESSAGE = "I apologize, but I encountered an error while generating the response. Please try again."
+
 class LLMHandler:
     def __init__(self, model_name: str = None):
         """
@@ -30,18 +34,23 @@ class LLMHandler:
         if not self.deployment_name:
             raise ValueError("AZURE_OPENAI_DEPLOYMENT_NAME not found in environment variables")
             
-        # Initialize Azure OpenAI client
-        self.client = AzureOpenAI(
-            api_key=self.api_key,
-            api_version=self.api_version,
-            azure_endpoint=self.endpoint
+        # Deployments to route requests across (AZURE_OPENAI_DEPLOYMENTS, or the single one above)
+        self.router = LLMRouter.from_env(default_deployment=self.deployment_name)
+        
+        # Token budget of each prompt, split between instructions, history and retrieved context
+        self.prompt_builder = PromptBuilder(
+            max_tokens=int(os.getenv("PROMPT_MAX_TOKENS", "6000")),
+            history_tokens=int(os.getenv("PROMPT_HISTORY_TOKENS", "1000")),
+            recent_messages=int(os.getenv("PROMPT_RECENT_MESSAGES", "3")),
+            min_chunk_tokens=int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", "100"))
         )
-        logger.info(f"Azure OpenAI LLM handler initialized with deployment: {self.deployment_name}")
+        logger.info(f"Azure OpenAI LLM handler initialized with deployments: "
+                    f"{', '.join(target.name for target in self.router.targets)}")
     
     def generate_response(self, 
                          query: str, 
                          context: List[Dict], 
-                         conversation_history: Optional[str] = None,
+                         conversation_history: Optional[Union[str, List[Dict]]] = None,
                          chat_history: Optional[List[Dict]] = None) -> Dict:
         """
         Generate a response using Azure OpenAI.
@@ -49,81 +58,111 @@ class LLMHandler:
         Args:
             query: User query
             context: Retrieved context from RAG system
-            conversation_history: Optional conversation history string
+            conversation_history: Optional conversation memory, as turns or a formatted string
             chat_history: Optional chat history list for additional context
             
         Returns:
             Dict: Response containing text and optional audio
         """
-        try:
-            # Format the context
-            context_text = "\n\n".join([f"Document {i+1}:\n{chunk['text']}" 
-                                      for i, chunk in enumerate(context)])
+        messages = self.build_messages(query, context, conversation_history, chat_history)
+        return self.complete(messages)
+    
+    def build_messages(self,
+                       query: str,
+                       context: List[Dict],
+                       conversation_history: Optional[Union[str, List[Dict]]] = None,
+                       chat_history: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Assemble the chat messages for a query: instructions, history, retrieved context and the question.
+        
+        Args:
+            query: User query
+            context: Retrieved context from RAG system
+            conversation_history: Optional conversation memory, as turns or a formatted string
+            chat_history: Optional chat history list for additional context
             
-            # Create the system message with context and conversation history
-            system_message = "You are a helpful AI assistant. Use the following context to answer the user's question."
-            if conversation_history:
-                system_message += f"\n\n{conversation_history}"
-            if chat_history:
-                # Add recent chat history for additional context
-                recent_history = "\n\nRecent conversation:\n"
-                for msg in chat_history[-3:]:  # Only use last 3 messages for context
-                    role = msg.get('role', 'user')
-                    text = msg.get('text', '')
-                    recent_history += f"{role.title()}: {text}\n"
-                system_message += recent_history
-            if context_text:
-                system_message += f"\n\nRelevant context:\n{context_text}"
-
-            # Check if the query is asking for a comparison or table format
-            query_lower = query.lower()
-            is_comparison = any(keyword in query_lower for keyword in ["compare", "differences", "versus", "vs", "table", "format as table"])
-
-            if is_comparison:
-                system_message += """
-When formatting tables, follow these rules:
-1. Use proper Markdown table syntax with headers and alignment
-2. Include a clear title for the table using ### or #### heading
-3. Ensure all columns are properly aligned using :---: for center, :--- for left, ---: for right
-4. Use consistent formatting for similar data
-5. Add brief explanations if needed
-6. Format the table like this:
-
-### Table Title
-| Header 1 | Header 2 | Header 3 |
-|:--------:|:---------|---------:|
-| Data 1   | Data 2   | Data 3   |
-| Data 4   | Data 5   | Data 6   |
-
-For document comparisons, use this format:
-
-### Document Comparison
-📄 Document 1 Name
-| Aspect | Details |
-|:-------|:--------|
-| Point 1 | Info 1  |
-| Point 2 | Info 2  |
-
-📄 Document 2 Name
-| Aspect | Details |
-|:-------|:--------|
-| Point 1 | Info 1  |
-| Point 2 | Info 2  |
-
-Always ensure tables are properly aligned and formatted for readability.
-"""
-
-            # Single response using Azure OpenAI
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": query}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            return {"responses": [response.choices[0].message.content.strip()], "audio": None}
+        Returns:
+            List[Dict]: Messages for the chat completions API
+        """
+        return self.build_prompt(query, context, conversation_history, chat_history)[0]
+    
+    def build_prompt(self,
+                     query: str,
+                     context: List[Dict],
+                     conversation_history: Optional[Union[str, List[Dict]]] = None,
+                     chat_history: Optional[List[Dict]] = None) -> Tuple[List[Dict], Dict]:
+        """
+        Assemble the chat messages within the prompt token budget.
+        
+        Returns:
+            Tuple[List[Dict], Dict]: Messages, and token counts per part of the prompt (see PromptBuilder.build)
+        """
+        return self.prompt_builder.build(query, context, conversation_history, chat_history)
+    
+    def _completion_args(self, messages: List[Dict]) -> Dict:
+        # The router sets the model of the deployment it picks
+        return {
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 1000
+        }
+    
+    @staticmethod
+    def _usage(usage) -> Optional[Dict]:
+        if not usage:
+            return None
+        return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+    
+    def complete(self, messages: List[Dict]) -> Dict:
+        """
+        Generate a response to assembled messages using Azure OpenAI.
+        
+        Returns:
+            Dict: Response containing text, optional audio and the token usage reported by the API;
+                "error" is set if generation failed
+        """
+        return run_sync(self.acomplete(messages))
+    
+    async def acomplete(self, messages: List[Dict]) -> Dict:
+        """Async complete() on the shared connection pool; does not block the event loop."""
+        try:
+            response, target = await self.router.complete(self._completion_args(messages))
+            return {
+                "responses": [response.choices[0].message.content.strip()],
+                "audio": None,
+                "usage": self._usage(getattr(response, "usage", None)),
+                "deployment": target.name
+            }
         except Exception as e:
             logger.error(f"Error generating response with Azure OpenAI: {str(e)}")
-            return {"responses": ["I apologize, but I encountered an error while generating the response. Please try again."], "audio": None}
\ No newline at end of file
+            return {"responses": [ERROR_MESSAGE], "audio": None, "error": True}
+    
+    async def astream(self, messages: List[Dict]) -> AsyncIterator[Dict]:
+        """
+        Stream a response to assembled messages as it is generated.
+        
+        Yields:
+            Dict: {"deployment": name} once the answer starts, {"delta": text} for each piece of it,
+                then {"usage": {...}} if the API reports it
+            
+        Raises:
+            Exception: If the request fails; pieces already yielded are not retracted
+        """
+        request = dict(self._completion_args(messages), stream_options={"include_usage": True})
+        chunks = self.router.stream(request)
+        deployment = None
+        try:
+            async for chunk, target in chunks:
+                if deployment is None:
+                    deployment = target.name
+                    yield {"deployment": deployment}
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield {"delta": delta}
+                usage = self._usage(getattr(chunk, "usage", None))
+                if usage:
+                    yield {"usage": usage}
+        finally:
+            # Release the connection when the client goes away mid-answer
+            await chunks.aclose()
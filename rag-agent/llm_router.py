@@ -0,0 +1,410 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import numpy as np
+import openai
+import logging
+from clients import get_async_openai, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+def _is_failover_error(error: Exception) -> bool:
+    """Errors another deployment may not have: throttling, timeouts, connection and server errors."""
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class DeploymentTarget:
+    def __init__(self,
+                 name: str,
+                 deployment: str,
+                 endpoint: str,
+                 api_key: str,
+                 api_version: str,
+                 alpha: float = 0.2):
+        """
+        One chat deployment and its health.
+
+        Latency (full completion and time to first streamed token) and error rate are
+        tracked as exponentially weighted moving averages; recent latencies are kept
+        for the hedging delay.
+
+        Args:
+            name: Label used in logs and metrics
+            deployment: Azure OpenAI deployment name
+            endpoint: Resource endpoint (any compatible URL, e.g. a local stub)
+            api_key: API key
+            api_version: API version
+            alpha: EWMA weight of the newest observation
+        """
+        self.name = name
+        self.deployment = deployment
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.api_version = api_version
+        self.alpha = alpha
+
+        # "complete" and "ttft" -> EWMA seconds / recent seconds
+        self.latency: Dict[str, Optional[float]] = {"complete": None, "ttft": None}
+        self.recent: Dict[str, deque] = {"complete": deque(maxlen=200), "ttft": deque(maxlen=200)}
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+        self.hedge_wins = 0
+
+        # Circuit breaker
+        self.recent_throttles: deque = deque()
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    @property
+    def client(self):
+        """Shared client of the running event loop; retries are left to the router."""
+        return get_async_openai(self.endpoint, self.api_key, self.api_version, max_retries=0)
+
+    def expected_latency(self, kind: str, default: float) -> float:
+        """Score for routing: EWMA latency inflated by the error rate and queued work."""
+        latency = self.latency[kind] if self.latency[kind] is not None else default
+        return latency * (1 + 4 * self.error_rate) * (1 + 0.1 * self.in_flight)
+
+    def percentile(self, kind: str, q: float) -> Optional[float]:
+        samples = self.recent[kind]
+        return float(np.percentile(samples, q)) if len(samples) >= 5 else None
+
+    def record_success(self, kind: str, seconds: float) -> None:
+        previous = self.latency[kind]
+        self.latency[kind] = seconds if previous is None else self.alpha * seconds + (1 - self.alpha) * previous
+        self.recent[kind].append(seconds)
+        self.error_rate *= 1 - self.alpha
+        # A successful trial closes the breaker
+        self.open_until = 0.0
+        self.recent_throttles.clear()
+
+    def record_error(self) -> None:
+        self.errors += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+
+    def is_available(self, now: float) -> bool:
+        """Closed, or open past its cooldown with no trial request running (half-open)."""
+        return now >= self.open_until and not self.trial_in_flight
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "deployment": self.deployment,
+            "endpoint": self.endpoint,
+            "latency_ewma_ms": {kind: round(value * 1000, 1) if value is not None else None
+                                for kind, value in self.latency.items()},
+            "p95_ms": {kind: round(value * 1000, 1) if value is not None else None
+                       for kind, value in ((kind, self.percentile(kind, 95)) for kind in self.recent)},
+            "error_rate": round(self.error_rate, 3),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttles": self.throttles,
+            "hedge_wins": self.hedge_wins,
+            "circuit": "open" if now < self.open_until else ("half-open" if self.open_until else "closed"),
+            "circuit_open_seconds": round(max(0.0, self.open_until - now), 1)
+        }
+
+class LLMRouter:
+    def __init__(self,
+                 targets: List[DeploymentTarget],
+                 hedge: bool = True,
+                 hedge_percentile: float = 95,
+                 hedge_min_delay: float = 0.5,
+                 hedge_initial_delay: float = 3.0,
+                 breaker_threshold: int = 5,
+                 breaker_window: float = 10.0,
+                 breaker_cooldown: float = 30.0):
+        """
+        Route chat requests across deployments by observed latency and health.
+
+        Each request goes to the deployment with the lowest expected latency among
+        those whose circuit is closed. If hedging is on and no answer (or, when
+        streaming, no first token) has arrived after the primary's p95 latency, the
+        same request is also sent to the next-best deployment; the first to answer is
+        used and the other is cancelled. Throttling, timeouts and server errors fail
+        over to the next deployment. breaker_threshold 429s within breaker_window
+        seconds open a deployment's circuit for breaker_cooldown seconds (or the
+        server's Retry-After, if longer); afterwards one trial request decides
+        whether it closes again.
+
+        Args:
+            targets: Deployments, in preference order for ties
+            hedge: Send hedged duplicates of slow requests
+            hedge_percentile: Latency percentile of the primary after which to hedge
+            hedge_min_delay: Lower bound of the hedging delay in seconds
+            hedge_initial_delay: Hedging delay before enough latencies are known
+            breaker_threshold: 429s within breaker_window that open the circuit
+            breaker_window: Seconds over which 429s are counted
+            breaker_cooldown: Seconds the circuit stays open
+        """
+        if not targets:
+            raise ValueError("LLMRouter needs at least one deployment")
+        self.targets = targets
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_initial_delay = hedge_initial_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_window = breaker_window
+        self.breaker_cooldown = breaker_cooldown
+        self.hedged = 0
+
+    @classmethod
+    def from_env(cls, default_deployment: Optional[str] = None) -> "LLMRouter":
+        """
+        Router configured from the environment.
+
+        AZURE_OPENAI_DEPLOYMENTS is a JSON list of {"name", "deployment", "endpoint",
+        "api_key", "api_version"} objects; missing fields default to AZURE_OPENAI_ENDPOINT,
+        AZURE_OPENAI_API_KEY, AZURE_OPENAI_API_VERSION and AZURE_OPENAI_DEPLOYMENT_NAME.
+        Without it, the single deployment from those variables is used.
+
+        Args:
+            default_deployment: Deployment name overriding AZURE_OPENAI_DEPLOYMENT_NAME
+        """
+        defaults = {
+            "deployment": default_deployment or os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o"),
+            "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+            "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+            "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+        }
+        configured = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+        entries = json.loads(configured) if configured else [{}]
+        alpha = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.2"))
+
+        targets = []
+        for i, entry in enumerate(entries):
+            settings = {**defaults, **entry}
+            for key in ("endpoint", "api_key", "deployment"):
+                if not settings.get(key):
+                    raise ValueError(f"No {key} configured for LLM deployment {i} "
+                                     f"(set AZURE_OPENAI_DEPLOYMENTS or the AZURE_OPENAI_* variables)")
+            default_name = settings["deployment"] if len(entries) == 1 else f"{settings['deployment']}-{i}"
+            targets.append(DeploymentTarget(
+                name=settings.get("name") or default_name,
+                deployment=settings["deployment"],
+                endpoint=settings["endpoint"],
+                api_key=settings["api_key"],
+                api_version=settings["api_version"],
+                alpha=alpha
+            ))
+
+        return cls(
+            targets,
+            hedge=os.getenv("LLM_ROUTER_HEDGE", "true").lower() == "true",
+            hedge_percentile=float(os.getenv("LLM_ROUTER_HEDGE_PERCENTILE", "95")),
+            hedge_min_delay=float(os.getenv("LLM_ROUTER_HEDGE_MIN_DELAY", "0.5")),
+            hedge_initial_delay=float(os.getenv("LLM_ROUTER_HEDGE_INITIAL_DELAY", "3")),
+            breaker_threshold=int(os.getenv("LLM_ROUTER_BREAKER_THRESHOLD", "5")),
+            breaker_window=float(os.getenv("LLM_ROUTER_BREAKER_WINDOW", "10")),
+            breaker_cooldown=float(os.getenv("LLM_ROUTER_BREAKER_COOLDOWN", "30"))
+        )
+
+    def rank(self, kind: str) -> List[DeploymentTarget]:
+        """Available deployments, fastest expected first; if every circuit is open, the one reopening first."""
+        now = time.monotonic()
+        available = [target for target in self.targets if target.is_available(now)]
+        if not available:
+            return [min(self.targets, key=lambda target: target.open_until)]
+        return sorted(available, key=lambda target: target.expected_latency(kind, self.hedge_initial_delay))
+
+    def hedge_delay(self, target: DeploymentTarget, kind: str) -> float:
+        delay = target.percentile(kind, self.hedge_percentile)
+        return max(self.hedge_min_delay, delay if delay is not None else self.hedge_initial_delay)
+
+    def _begin(self, target: DeploymentTarget) -> bool:
+        """Count a request as started; returns whether it is the half-open trial."""
+        target.in_flight += 1
+        target.requests += 1
+        if target.open_until and not target.trial_in_flight:
+            # Past its cooldown: this request is the half-open trial
+            target.trial_in_flight = True
+            return True
+        return False
+
+    def _end(self, target: DeploymentTarget, trial: bool) -> None:
+        target.in_flight -= 1
+        if trial:
+            target.trial_in_flight = False
+
+    def _record_failure(self, target: DeploymentTarget, error: Exception) -> None:
+        target.record_error()
+        if not isinstance(error, openai.RateLimitError):
+            if target.open_until:
+                # Failed trial: stay open for another cooldown
+                target.open_until = time.monotonic() + self.breaker_cooldown
+            return
+
+        now = time.monotonic()
+        target.throttles += 1
+        target.recent_throttles.append(now)
+        while target.recent_throttles and target.recent_throttles[0] < now - self.breaker_window:
+            target.recent_throttles.popleft()
+        if len(target.recent_throttles) >= self.breaker_threshold or target.open_until:
+            cooldown = max(self.breaker_cooldown, retry_after_seconds(error) or 0)
+            target.open_until = now + cooldown
+            target.recent_throttles.clear()
+            logger.warning(f"Circuit opened for LLM deployment {target.name} for {cooldown:g}s after repeated 429s")
+
+    async def _cancel_losers(self, tasks) -> None:
+        """Cancel the requests that lost a hedge and wait until they have released their connections."""
+        for task in tasks:
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            # A stream that produced its first chunk before it could be cancelled
+            if isinstance(result, tuple) and len(result) == 5:
+                stream, _, _, target, trial = result
+                self._end(target, trial)
+                await stream.close()
+
+    async def _attempt(self, target: DeploymentTarget, request: Dict) -> Tuple[object, DeploymentTarget]:
+        """One non-streaming request to one deployment, recording its outcome."""
+        trial = self._begin(target)
+        started = time.perf_counter()
+        try:
+            response = await target.client.chat.completions.create(model=target.deployment, **request)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record_failure(target, e)
+            raise
+        finally:
+            self._end(target, trial)
+        target.record_success("complete", time.perf_counter() - started)
+        return response, target
+
+    async def complete(self, request: Dict) -> Tuple[object, DeploymentTarget]:
+        """
+        Send a chat completion request (without "model") to the best deployment.
+
+        Returns:
+            Tuple: (API response, deployment that answered)
+
+        Raises:
+            Exception: The last error if every deployment failed
+        """
+        candidates = self.rank("complete")
+        last_error: Optional[Exception] = None
+        while candidates:
+            primary = candidates.pop(0)
+            tasks = {asyncio.ensure_future(self._attempt(primary, request))}
+            try:
+                if self.hedge and candidates:
+                    done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary, "complete"))
+                    if not done:
+                        backup = candidates.pop(0)
+                        self.hedged += 1
+                        logger.info(f"Hedging slow request on {primary.name} with {backup.name}")
+                        tasks.add(asyncio.ensure_future(self._attempt(backup, request)))
+
+                while tasks:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            response, target = task.result()
+                            target.hedge_wins += target is not primary
+                            return response, target
+                        last_error = task.exception()
+            finally:
+                # Cancel the losing duplicate
+                await self._cancel_losers(tasks)
+
+            if not _is_failover_error(last_error):
+                raise last_error
+            logger.warning(f"LLM deployment {primary.name} failed ({str(last_error)}), failing over")
+        raise last_error
+
+    async def _open_stream(self, target: DeploymentTarget, request: Dict):
+        """
+        Start a streaming request and wait for its first chunk.
+
+        Returns:
+            Tuple: (stream, its iterator, first chunk, target, whether it is the half-open trial)
+        """
+        trial = self._begin(target)
+        started = time.perf_counter()
+        stream = None
+        try:
+            stream = await target.client.chat.completions.create(model=target.deployment, stream=True, **request)
+            iterator = stream.__aiter__()
+            first = await iterator.__anext__()
+        except BaseException as e:
+            self._end(target, trial)
+            if stream is not None:
+                await stream.close()
+            if isinstance(e, Exception) and not isinstance(e, StopAsyncIteration):
+                self._record_failure(target, e)
+            raise
+        target.record_success("ttft", time.perf_counter() - started)
+        return stream, iterator, first, target, trial
+
+    async def stream(self, request: Dict) -> AsyncIterator[Tuple[object, DeploymentTarget]]:
+        """
+        Stream a chat completion (request without "model") from the best deployment.
+
+        Hedging and failover apply until the first chunk arrives; after that the
+        stream stays on the deployment that produced it.
+
+        Yields:
+            Tuple: (stream chunk, deployment streaming it)
+        """
+        candidates = self.rank("ttft")
+        last_error: Optional[Exception] = None
+        opened = None
+        while candidates and opened is None:
+            primary = candidates.pop(0)
+            tasks = {asyncio.ensure_future(self._open_stream(primary, request))}
+            try:
+                if self.hedge and candidates:
+                    done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary, "ttft"))
+                    if not done:
+                        backup = candidates.pop(0)
+                        self.hedged += 1
+                        logger.info(f"Hedging slow stream on {primary.name} with {backup.name}")
+                        tasks.add(asyncio.ensure_future(self._open_stream(backup, request)))
+
+                while tasks and opened is None:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None and opened is None:
+                            opened = task.result()
+                        elif task.exception() is None:
+                            # Both produced a first chunk at once: drop the second
+                            await self._cancel_losers([task])
+                        else:
+                            last_error = task.exception()
+            finally:
+                await self._cancel_losers(tasks)
+
+            if opened is None and not _is_failover_error(last_error):
+                raise last_error
+            if opened is None:
+                logger.warning(f"LLM deployment {primary.name} failed ({str(last_error)}), failing over")
+
+        if opened is None:
+            raise last_error
+
+        stream, iterator, first, target, trial = opened
+        target.hedge_wins += target is not primary
+        try:
+            yield first, target
+            async for chunk in iterator:
+                yield chunk, target
+        finally:
+            self._end(target, trial)
+            await stream.close()
+
+    def stats(self) -> Dict:
+        """Health and latency of every deployment."""
+        return {
+            "hedged_requests": self.hedged,
+            "deployments": {target.name: target.stats() for target in self.targets}
+        }
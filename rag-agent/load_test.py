@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import time
+import uuid
+import wave
+from typing import Callable, Dict, List, Optional
+import httpx
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS = [
+    "What is the leave policy?",
+    "How many days of paid leave do employees get?",
+    "Summarise the travel reimbursement rules.",
+    "Who approves contract renewals?",
+    "What does clause 4.2 cover?",
+    "List the documents required for onboarding.",
+]
+
+def make_pdf(text: str) -> bytes:
+    """Minimal single-page PDF containing a line of text."""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+def make_wav(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    """Mono 16-bit WAV of a quiet tone."""
+    samples = (np.sin(2 * np.pi * 440 * np.arange(int(seconds * rate)) / rate) * 3000).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+class Result:
+    def __init__(self, scenario: str):
+        """Outcome of one request: latency, time to first token (streaming) and error, if any."""
+        self.scenario = scenario
+        self.latency: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.status: Optional[int] = None
+        self.error: Optional[str] = None
+
+class LoadTest:
+    def __init__(self,
+                 rag_url: str,
+                 excel_url: str,
+                 mix: Dict[str, float],
+                 rps: float,
+                 duration: float,
+                 max_in_flight: int = 500,
+                 poisson: bool = True,
+                 sessions: int = 50,
+                 timeout: float = 120.0,
+                 seed: int = 0):
+        """
+        Open-loop load generator for the chat app and the ExcelAgent.
+
+        Requests start at the target rate whether or not earlier ones have finished,
+        so a slow server shows up as growing latency and errors rather than as a
+        lower offered load. Starts that would exceed max_in_flight are counted as
+        dropped instead of being sent.
+
+        Args:
+            rag_url: Base URL of the chat app
+            excel_url: Base URL of the ExcelAgent
+            mix: Relative weight of each scenario (see SCENARIOS)
+            rps: Target requests per second over all scenarios
+            duration: Seconds to generate load for
+            max_in_flight: Client-side cap on concurrent requests
+            poisson: Exponential gaps between requests (otherwise evenly spaced)
+            sessions: Number of chat sessions the chat requests rotate through
+            timeout: Per-request timeout in seconds
+            seed: Seed of the scenario and arrival draws
+        """
+        unknown = set(mix) - set(SCENARIOS)
+        if unknown:
+            raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        self.rag_url = rag_url.rstrip("/")
+        self.excel_url = excel_url.rstrip("/")
+        self.mix = {name: weight for name, weight in mix.items() if weight > 0}
+        self.rps = rps
+        self.duration = duration
+        self.max_in_flight = max_in_flight
+        self.poisson = poisson
+        self.sessions = sessions
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.wav = make_wav()
+
+        self.results: List[Result] = []
+        self.dropped: Dict[str, int] = {name: 0 for name in self.mix}
+        self.elapsed = 0.0
+
+    async def chat(self, client: httpx.AsyncClient, i: int, result: Result) -> None:
+        response = await client.post(f"{self.rag_url}/chat", json={
+            "text": f"{QUESTIONS[i % len(QUESTIONS)]} ({i})",
+            "session_id": f"load-{self.run_id}-{i % self.sessions}"
+        })
+        result.status = response.status_code
+        response.raise_for_status()
+
+    async def chat_stream(self, client: httpx.AsyncClient, i: int, result: Result) -> None:
+        started = time.perf_counter()
+        async with client.stream("POST", f"{self.rag_url}/chat/stream", json={
+            "text": f"{QUESTIONS[i % len(QUESTIONS)]} ({i})",
+            "session_id": f"load-{self.run_id}-{i % self.sessions}"
+        }) as response:
+            result.status = response.status_code
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                    if event == "token" and result.ttft is None:
+                        result.ttft = time.perf_counter() - started
+                    elif event == "error":
+                        raise RuntimeError("stream ended with an error event")
+
+    async def upload(self, client: httpx.AsyncClient, i: int, result: Result) -> None:
+        # Each upload is a new document that stays in DATA/raw_pdfs and the index; the loadtest-
+        # file names and document set mark them for the manual cleanup described in the README
+        name = f"loadtest-{self.run_id}-{i}.pdf"
+        response = await client.post(
+            f"{self.rag_url}/upload-pdf",
+            files={"file": (name, make_pdf(f"Load test document {self.run_id} {i}"), "application/pdf")},
+            data={"doc_set": "loadtest"}
+        )
+        result.status = response.status_code
+        response.raise_for_status()
+
+    async def transcribe(self, client: httpx.AsyncClient, i: int, result: Result) -> None:
+        response = await client.post(f"{self.rag_url}/transcribe",
+                                     files={"file": ("speech.wav", self.wav, "audio/wav")})
+        result.status = response.status_code
+        response.raise_for_status()
+
+    async def excel_submit(self, client: httpx.AsyncClient, i: int, result: Result) -> None:
+        response = await client.post(f"{self.excel_url}/api/submit", json={
+            "input": f"Contract {self.run_id}-{i} between Acme and Globex for office cleaning, "
+                     f"starting next month for 12 months, handled by Facilities",
+            "overwrite": True
+        })
+        result.status = response.status_code
+        response.raise_for_status()
+
+    async def _run_one(self, client: httpx.AsyncClient, scenario: str, i: int) -> None:
+        result = Result(scenario)
+        started = time.perf_counter()
+        try:
+            await SCENARIOS[scenario](self, client, i, result)
+        except httpx.HTTPStatusError as e:
+            result.error = f"HTTP {e.response.status_code}"
+        except Exception as e:
+            result.error = type(e).__name__
+        result.latency = time.perf_counter() - started
+        self.results.append(result)
+
+    async def run(self) -> None:
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            tasks = set()
+            started = time.perf_counter()
+            next_start = started
+            i = 0
+            while next_start - started < self.duration:
+                delay = next_start - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                scenario = self.rng.choices(names, weights)[0]
+                if len(tasks) >= self.max_in_flight:
+                    self.dropped[scenario] += 1
+                else:
+                    task = asyncio.ensure_future(self._run_one(client, scenario, i))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                i += 1
+                gap = self.rng.expovariate(self.rps) if self.poisson else 1 / self.rps
+                next_start += gap
+            if tasks:
+                await asyncio.wait(tasks)
+            self.elapsed = time.perf_counter() - started
+
+    def report(self) -> Dict:
+        """Throughput, error rate and latency percentiles per scenario and overall."""
+        def summarise(results: List[Result], dropped: int) -> Dict:
+            ok = [r for r in results if r.error is None]
+            errors: Dict[str, int] = {}
+            for r in results:
+                if r.error is not None:
+                    errors[r.error] = errors.get(r.error, 0) + 1
+            latencies = np.array([r.latency for r in ok]) * 1000
+            ttfts = np.array([r.ttft for r in ok if r.ttft is not None]) * 1000
+            row = {
+                "sent": len(results),
+                "ok": len(ok),
+                "dropped": dropped,
+                "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+                "errors": errors,
+                "throughput_rps": round(len(ok) / self.elapsed, 2) if self.elapsed else 0.0,
+            }
+            for name, values in (("latency_ms", latencies), ("ttft_ms", ttfts)):
+                if len(values):
+                    row[name] = {f"p{q}": round(float(np.percentile(values, q)), 1) for q in (50, 95, 99)}
+                    row[name]["max"] = round(float(values.max()), 1)
+            return row
+
+        scenarios = {name: summarise([r for r in self.results if r.scenario == name], self.dropped[name])
+                     for name in self.mix}
+        return {
+            "target_rps": self.rps,
+            "duration_s": round(self.elapsed, 1),
+            "offered_rps": round((len(self.results) + sum(self.dropped.values())) / self.elapsed, 2)
+            if self.elapsed else 0.0,
+            "overall": summarise(self.results, sum(self.dropped.values())),
+            "scenarios": scenarios
+        }
+
+SCENARIOS: Dict[str, Callable] = {
+    "chat": LoadTest.chat,
+    "chat_stream": LoadTest.chat_stream,
+    "upload": LoadTest.upload,
+    "transcribe": LoadTest.transcribe,
+    "excel_submit": LoadTest.excel_submit,
+}
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse "chat=6,chat_stream=3,upload=0.5" into weights."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight) if weight else 1.0
+    return mix
+
+def print_report(report: Dict) -> None:
+    print(f"target {report['target_rps']} rps, offered {report['offered_rps']} rps over {report['duration_s']}s")
+    print(f"{'scenario':<13} {'sent':>6} {'ok':>6} {'drop':>5} {'err %':>6} {'rps':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft p95':>9}  errors")
+    rows = list(report["scenarios"].items()) + [("overall", report["overall"])]
+    for name, row in rows:
+        latency = row.get("latency_ms", {})
+        ttft = row.get("ttft_ms", {})
+        print(f"{name:<13} {row['sent']:>6} {row['ok']:>6} {row['dropped']:>5} {row['error_rate'] * 100:>6.1f} "
+              f"{row['throughput_rps']:>7.2f} {latency.get('p50', math.nan):>8.1f} {latency.get('p95', math.nan):>8.1f} "
+              f"{latency.get('p99', math.nan):>8.1f} {ttft.get('p95', math.nan):>9.1f}  "
+              f"{', '.join(f'{error} x{count}' for error, count in row['errors'].items())}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive the chat app and ExcelAgent at a target request rate and report latency, "
+                    "throughput and errors. Run the apps against mock_services.py to avoid real quota.")
+    parser.add_argument("--rag-url", default="http://localhost:8001",
+                        help="Base URL of the chat app (8001 in its Docker image, 8003 with python main.py)")
+    parser.add_argument("--excel-url", default="http://localhost:8005", help="Base URL of the ExcelAgent")
+    parser.add_argument("--mix", default="chat=6,chat_stream=3,transcribe=1",
+                        help=f"Scenario weights, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--rps", type=float, default=5, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load for")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="Client-side cap on concurrent requests")
+    parser.add_argument("--uniform", action="store_true", help="Evenly spaced requests instead of Poisson arrivals")
+    parser.add_argument("--sessions", type=int, default=50, help="Chat sessions to rotate through")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    test = LoadTest(args.rag_url, args.excel_url, parse_mix(args.mix), args.rps, args.duration,
+                    max_in_flight=args.max_in_flight, poisson=not args.uniform, sessions=args.sessions,
+                    timeout=args.timeout, seed=args.seed)
+    asyncio.run(test.run())
+    report = test.report()
+    print_report(report)
+    if report["scenarios"].get("upload", {}).get("ok"):
+        print(f"Uploaded documents are named loadtest-{test.run_id}-*.pdf; see the README to remove them")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
-from fastapi import FastAPI, Request, HTTPException, UploadFile, File
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from pydantic import BaseModel
 from llm import LLMHandler
 from pdf_processor import PDFProcessor
 from rag import RAGSystem
+from ingest_jobs import IngestionQueue
+from clients import close_async_clients
+from admission import AdmissionController, Lane, Overloaded, PRIORITY_INTERACTIVE, PRIORITY_SPEECH, PRIORITY_BATCH
+from starlette.background import BackgroundTask
 from fastapi.templating import Jinja2Templates
 import os
 from typing import List, Optional, Dict, Any
@@ -16,6 +20,11 @@ import json
 from gtts import gTTS  # Import gTTS for text-to-speech
 import io  # For handling in-memory bytes
 import base64  # For encoding audio data to base64
+import hashlib
+import hmac
+import uuid
+import time
+from starlette.concurrency import run_in_threadpool
 
 # Set up logging with more detailed format
 logging.basicConfig(
@@ -30,24 +39,11 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="RAG API", description="RAG System API for PDF Processing and Querying")
 
-# Create necessary directories
+# Data directories
 DATA_DIR = Path("DATA")
 RAW_PDFS_DIR = DATA_DIR / "raw_pdfs"
 EMBEDDINGS_DIR = DATA_DIR / "embeddings"
 
-# Create directories if they don't exist
-RAW_PDFS_DIR.mkdir(parents=True, exist_ok=True)
-EMBEDDINGS_DIR.mkdir(parents=True, exist_ok=True)
-
-# Verify embeddings, exclude .gitkeep
-embedding_dirs = [d for d in EMBEDDINGS_DIR.glob("*") if d.is_dir() and d.name != ".gitkeep"]
-if embedding_dirs:
-    logger.info(f"Found {len(embedding_dirs)} existing embedding directories:")
-    for dir in embedding_dirs:
-        logger.info(f"- {dir.name}")
-else:
-    logger.warning("No existing embeddings found!")
-
 # Set up templates
 templates = Jinja2Templates(directory="templates")
 
@@ -63,25 +59,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize RAG system components
-try:
-    logger.info("Initializing RAG system components...")
-    pdf_processor = PDFProcessor(data_dir="DATA")
-    llm_handler = LLMHandler()  # Will use Azure OpenAI deployment from env vars
-    rag_system = RAGSystem(pdf_processor, llm_handler)
+# RAG system components, built by the startup hook rather than at import: ingestion chunks PDFs in
+# spawned worker processes, and under `python main.py` each of them re-imports this module
+pdf_processor: Optional[PDFProcessor] = None
+llm_handler: Optional[LLMHandler] = None
+rag_system: Optional[RAGSystem] = None
+ingestion_queue: Optional[IngestionQueue] = None
+
+@app.on_event("startup")
+def init_rag_system():
+    """Create the data directories, build the RAG system components and load existing embeddings."""
+    global pdf_processor, llm_handler, rag_system, ingestion_queue
+
+    # Create directories if they don't exist
+    RAW_PDFS_DIR.mkdir(parents=True, exist_ok=True)
+    EMBEDDINGS_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Load existing embeddings
+    # Verify embeddings, exclude .gitkeep
+    embedding_dirs = [d for d in EMBEDDINGS_DIR.glob("*") if d.is_dir() and d.name != ".gitkeep"]
     if embedding_dirs:
-        logger.info("Loading existing embeddings...")
-        if rag_system.process_documents():
-            logger.info("Successfully loaded existing embeddings")
-        else:
-            logger.warning("Failed to load existing embeddings")
+        logger.info(f"Found {len(embedding_dirs)} existing embedding directories:")
+        for dir in embedding_dirs:
+            logger.info(f"- {dir.name}")
     else:
-        logger.warning("No embeddings found to load")
-except Exception as e:
-    logger.error(f"Failed to initialize RAG system: {str(e)}")
-    raise
+        logger.warning("No existing embeddings found!")
+
+    try:
+        logger.info("Initializing RAG system components...")
+        pdf_processor = PDFProcessor(data_dir="DATA")
+        llm_handler = LLMHandler()  # Will use Azure OpenAI deployment from env vars
+        rag_system = RAGSystem(pdf_processor, llm_handler)
+        ingestion_queue = IngestionQueue(rag_system.ingest_document)
+
+        # Load existing embeddings
+        if embedding_dirs:
+            logger.info("Loading existing embeddings...")
+            if rag_system.process_documents():
+                logger.info("Successfully loaded existing embeddings")
+            else:
+                logger.warning("Failed to load existing embeddings")
+        else:
+            logger.warning("No embeddings found to load")
+
+        # Pick up stores written by the processing workflow or other replicas without a restart
+        watch_interval = float(os.getenv("INDEX_WATCH_INTERVAL", "0"))
+        if watch_interval > 0:
+            rag_system.watch_documents(watch_interval)
+    except Exception as e:
+        logger.error(f"Failed to initialize RAG system: {str(e)}")
+        raise
+
+# Admission control: per-endpoint concurrency limits with bounded wait queues. Waiting
+# interactive chat gets freed capacity before speech, and speech before uploads and batch work.
+admission = AdmissionController(max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64")))
+admission.add_lane(Lane.from_env("chat", max_concurrency=32, max_queue=64, priority=PRIORITY_INTERACTIVE, max_wait=10))
+admission.add_lane(Lane.from_env("transcribe", max_concurrency=4, max_queue=16, priority=PRIORITY_SPEECH, max_wait=15))
+admission.add_lane(Lane.from_env("tts", max_concurrency=4, max_queue=16, priority=PRIORITY_SPEECH, max_wait=15))
+admission.add_lane(Lane.from_env("upload", max_concurrency=2, max_queue=8, priority=PRIORITY_BATCH, max_wait=30))
+admission.add_lane(Lane.from_env("batch", max_concurrency=1, max_queue=2, priority=PRIORITY_BATCH, max_wait=5))
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        {"detail": exc.reason},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def admitted(lane: str):
+    """Dependency holding a slot in an admission lane while the request is handled."""
+    async def hold_slot():
+        async with admission.admit(lane):
+            yield
+    return Depends(hold_slot)
+
+@app.on_event("shutdown")
+async def close_clients():
+    # Close the shared Azure OpenAI connection pool
+    await close_async_clients()
 
 class Message(BaseModel):
     role: str
@@ -93,9 +148,26 @@ class ChatRequest(BaseModel):
     text: str
     history: Optional[List[Message]] = []
     is_speech: Optional[bool] = False
+    # Conversation memory is kept per session; a new one is started when omitted
+    session_id: Optional[str] = None
+    # Optional retrieval scope: PDF file names, document sets and tags
+    sources: Optional[List[str]] = None
+    doc_sets: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+
+    def filters(self) -> Optional[Dict[str, List[str]]]:
+        filters = {"sources": self.sources, "doc_sets": self.doc_sets, "tags": self.tags}
+        return {key: values for key, values in filters.items() if values} or None
 
 class ChatResponse(BaseModel):
     responses: List[str]
+    cached: bool = False
+    session_id: Optional[str] = None
+    # Token counts of the assembled prompt (None when answered from cache) and usage reported by the API
+    prompt_tokens: Optional[Dict[str, int]] = None
+    usage: Optional[Dict[str, int]] = None
+    # Deployment that generated the answer (None when answered from cache)
+    deployment: Optional[str] = None
 
 class SheetRequest(BaseModel):
     text: str
@@ -107,32 +179,32 @@ async def get_index(request: Request):
     return templates.TemplateResponse("PGP.html", {"request": request})
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, response: Response, _slot: None = admitted("chat")):
     try:
         logger.info(f"Received chat request: {request.text}")
+        session_id = request.session_id or uuid.uuid4().hex
         
         # Check if we have any processed documents
         if not rag_system.documents_processed:
             return {
-                "responses": ["No documents have been processed. Please upload a PDF first."]
+                "responses": ["No documents have been processed. Please upload a PDF first."],
+                "session_id": session_id
             }
 
-        # Query the RAG system
-        context = rag_system.query(request.text)
-        if not context:
-            logger.warning("No response generated for query")
-            return {
-                "responses": ["No relevant information found in the documents. Please try a different query."]
-            }
-        
-        # Generate response using RAG system
-        response = rag_system.generate_response(
-            request.text, 
-            context
+        # Retrieve, assemble, generate and post-process in one pass
+        pipeline = rag_system.create_pipeline(
+            request.text,
+            history=[message.dict() for message in request.history or []],
+            filters=request.filters(),
+            require_context=True,
+            session_id=session_id
         )
+        result = dict(await pipeline.arun(), session_id=session_id)
+        response.headers["Server-Timing"] = pipeline.server_timing()
         
-        logger.info("Successfully generated response")
-        return response
+        logger.info(f"Successfully generated response ({pipeline.server_timing()}, "
+                    f"prompt tokens {pipeline.prompt_tokens})")
+        return result
 
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
@@ -140,6 +212,75 @@ async def chat(request: ChatRequest):
             "responses": ["I apologize, but I encountered an error. Please try again."]
         }
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream the answer as server-sent events: metadata first, then tokens, then done (or error)."""
+    logger.info(f"Received streaming chat request: {request.text}")
+    session_id = request.session_id or uuid.uuid4().hex
+
+    # Hold the chat slot until the stream ends, not just until the handler returns
+    await admission.acquire("chat")
+    started = time.perf_counter()
+    released = False
+
+    def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            admission.release("chat", time.perf_counter() - started)
+
+    async def events():
+        if not rag_system.documents_processed:
+            yield {"event": "metadata", "data": {"session_id": session_id, "cached": False, "sources": []}}
+            yield {"event": "token", "data": {"text": "No documents have been processed. Please upload a PDF first."}}
+            yield {"event": "done", "data": {"cached": False}}
+            return
+        pipeline = rag_system.create_pipeline(
+            request.text,
+            history=[message.dict() for message in request.history or []],
+            filters=request.filters(),
+            require_context=True,
+            session_id=session_id
+        )
+        async for event in pipeline.stream():
+            yield event
+        logger.info(f"Streamed response ({pipeline.server_timing()}, prompt tokens {pipeline.prompt_tokens})")
+
+    async def encode():
+        try:
+            async for event in events():
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            release_slot()
+
+    return StreamingResponse(
+        encode(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also covers a client that disconnects before the stream starts
+        background=BackgroundTask(release_slot)
+    )
+
+@app.get("/chat/latency")
+async def chat_latency():
+    """Rolling time-to-first-token and total latency percentiles of chat requests."""
+    return rag_system.latency.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Admission queue depth, in-flight requests and wait times per lane, chat latency, LLM deployment health and embedding quota."""
+    return {
+        "admission": admission.stats(),
+        "chat_latency": rag_system.latency.stats(),
+        "llm_deployments": llm_handler.router.stats(),
+        "embedding_quota": pdf_processor.quota.stats()
+    }
+
+@app.get("/quota")
+async def quota():
+    """Token and request budgets of the embedding deployment, and interactive/bulk calls waiting for them."""
+    return pdf_processor.quota.stats()
+
 @app.post("/sheets")
 async def process_sheets(request: SheetRequest):
     try:
@@ -166,30 +307,102 @@ async def process_sheets(request: SheetRequest):
             "message": str(e)
         }, status_code=500)
 
-@app.post("/upload-pdf")
-async def upload_pdf(file: UploadFile = File(...)):
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+@app.post("/upload-pdf", status_code=202)
+async def upload_pdf(file: UploadFile = File(...),
+                     doc_set: Optional[str] = Form(None),
+                     tags: Optional[str] = Form(None),
+                     _slot: None = admitted("upload")):
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    filename = Path(file.filename).name
+    file_path = RAW_PDFS_DIR / filename
+    tmp_path = RAW_PDFS_DIR / f".{uuid.uuid4().hex}.part"
     try:
-        if not file.filename.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-        
-        # Save the uploaded file
-        file_path = RAW_PDFS_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Process the PDF
-        if rag_system.process_document(str(file_path)):
-            return {"message": f"Successfully processed {file.filename}"}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to process PDF")
-
+        # Stream the upload to disk in chunks, hashing as we go
+        hasher = hashlib.md5()
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+        os.replace(tmp_path, file_path)
+        pdf_processor.register_pdf_hash(str(file_path), hasher.hexdigest())
+        if doc_set is not None or tags is not None:
+            # Comma-separated tags, e.g. "policy, travel"
+            tag_list = [tag.strip() for tag in (tags or "").split(",") if tag.strip()]
+            pdf_processor.set_pdf_labels(str(file_path), doc_set or None, tag_list)
     except Exception as e:
         logger.error(f"PDF upload error: {str(e)}")
+        if tmp_path.exists():
+            tmp_path.unlink()
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Parse, embed and index in the background; the document becomes searchable once indexed
+    job = ingestion_queue.submit(str(file_path), filename, hasher.hexdigest())
+    return {
+        "message": f"Queued {filename} for processing",
+        "job_id": job.id,
+        "status_url": f"/upload-pdf/jobs/{job.id}"
+    }
+
+@app.get("/upload-pdf/jobs/{job_id}")
+async def upload_job_status(job_id: str):
+    status = ingestion_queue.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job ID")
+    return status
+
+@app.get("/upload-pdf/jobs")
+async def upload_jobs():
+    return {"pending": ingestion_queue.pending(), "jobs": ingestion_queue.list()}
+
+# Admin endpoints are refused unless ADMIN_TOKEN is set: a reload re-embeds every PDF through the
+# paid embeddings API. ADMIN_OPEN_ACCESS=true opts into unauthenticated access (local development).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_OPEN_ACCESS = os.getenv("ADMIN_OPEN_ACCESS", "false").lower() == "true"
+
+def check_admin_token(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        if ADMIN_OPEN_ACCESS:
+            return
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled: ADMIN_TOKEN is not configured")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/reload")
+async def reload_index(x_admin_token: Optional[str] = Header(None), _slot: None = admitted("batch")):
+    """Rebuild the index from disk off to the side and swap it in; searches are not interrupted."""
+    check_admin_token(x_admin_token)
+    try:
+        return await run_in_threadpool(rag_system.reload_documents)
+    except Exception as e:
+        logger.error(f"Index reload error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to reload index: {str(e)}")
+
+@app.get("/admin/index")
+async def index_info(x_admin_token: Optional[str] = Header(None)):
+    check_admin_token(x_admin_token)
+    return pdf_processor.store.snapshot().info()
+
+@app.get("/documents/filters")
+async def document_filters():
+    return pdf_processor.available_filters()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = {"query_embeddings": pdf_processor.query_cache.stats()}
+    if rag_system.answer_cache is not None:
+        stats["answers"] = rag_system.answer_cache.stats()
+    stats["conversations"] = rag_system.conversation_store.stats()
+    return stats
 
 @app.post("/stream_audio")
-async def stream_audio(request: Request):
+async def stream_audio(request: Request, _slot: None = admitted("tts")):
     try:
         data = await request.json()
         text = data.get("text", "")
@@ -200,7 +413,7 @@ async def stream_audio(request: Request):
 
         # Use the TextToSpeech instance from tts.py
         from tts import tts
-        audio_path = tts.text_to_speech(text)
+        audio_path = await run_in_threadpool(tts.text_to_speech, text)
 
         # Read the audio file and convert to base64
         with open(audio_path, "rb") as audio_file:
@@ -219,7 +432,7 @@ async def stream_audio(request: Request):
         raise HTTPException(status_code=500, detail=f"Failed to generate audio: {str(e)}")
 
 @app.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...)):
+async def transcribe_audio(file: UploadFile = File(...), _slot: None = admitted("transcribe")):
     try:
         logger.info("Received audio transcription request")
 
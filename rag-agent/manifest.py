@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(path: str) -> str:
+    """MD5 of a file, read in chunks so large PDFs are never held in memory."""
+    hasher = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class Manifest:
+    def __init__(self, path: Path):
+        """
+        Record of every raw PDF seen: size, mtime, content hash and store location.
+
+        A file whose size and mtime match its entry is trusted without re-reading it,
+        so unchanged PDFs are neither re-hashed nor re-parsed at boot.
+
+        Args:
+            path: Location of manifest.json
+        """
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self) -> None:
+        self.entries = self._read()
+        if self.entries:
+            logger.info(f"Loaded manifest with {len(self.entries)} entries")
+
+    def _read(self) -> Dict[str, Dict]:
+        """Entries of the manifest file on disk."""
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                return data.get("files", {})
+            logger.warning(f"Ignoring manifest with unsupported version {data.get('version')}")
+        except Exception as e:
+            logger.error(f"Error reading manifest {self.path}, starting fresh: {str(e)}")
+        return {}
+
+    def refresh(self) -> None:
+        """
+        Merge in entries written to disk by another process (a replica or the processing workflow).
+
+        An entry on disk wins unless only the in-memory one still matches the file.
+        """
+        disk_entries = self._read()
+        with self._lock:
+            for key, entry in disk_entries.items():
+                ours = self.entries.get(key)
+                if ours is not None and ours != entry and self._matches_file(ours) and not self._matches_file(entry):
+                    continue
+                self.entries[key] = entry
+            self._dirty = self._dirty or any(key not in disk_entries for key in self.entries)
+
+    @staticmethod
+    def _matches_file(entry: Dict) -> bool:
+        """Whether an entry's size and mtime match the file as it is now."""
+        try:
+            stat = os.stat(entry["path"])
+        except (OSError, KeyError):
+            return False
+        return entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns
+
+    def get_hash(self, pdf_path: str) -> str:
+        """
+        Return the content hash of a PDF, hashing it only if it changed since it was recorded.
+        """
+        key = str(pdf_path)
+        stat = os.stat(pdf_path)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry["hash"]
+
+        pdf_hash = hash_file(key)
+        self.record(key, pdf_hash, stat=stat)
+        return pdf_hash
+
+    def record(self, pdf_path: str, pdf_hash: str, store: Optional[str] = None, stat: os.stat_result = None) -> None:
+        """
+        Record a PDF's content hash (and optionally its store directory).
+
+        Args:
+            pdf_path: Path of the raw PDF
+            pdf_hash: Content hash of the file as it is on disk now
+            store: Name of the store directory under the embeddings directory
+            stat: Result of os.stat taken when the hash was computed
+        """
+        key = str(pdf_path)
+        stat = stat or os.stat(key)
+        with self._lock:
+            entry = self.entries.get(key, {})
+            if entry.get("hash") != pdf_hash:
+                entry.pop("store", None)
+            entry.update({
+                "path": key,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": pdf_hash
+            })
+            if store is not None:
+                entry["store"] = store
+            self.entries[key] = entry
+            self._dirty = True
+
+    def set_store(self, pdf_path: str, store: str) -> None:
+        """Record where the store of an already hashed PDF lives."""
+        with self._lock:
+            entry = self.entries.get(str(pdf_path))
+            if entry is not None and entry.get("store") != store:
+                entry["store"] = store
+                self._dirty = True
+
+    def set_labels(self, pdf_path: str, doc_set: Optional[str] = None, tags: Optional[List[str]] = None) -> None:
+        """
+        Record the document set and tags of a PDF; they survive re-processing and restarts.
+
+        Args:
+            pdf_path: Path of the raw PDF
+            doc_set: Document set (e.g. a department) the PDF belongs to
+            tags: Free-form labels
+        """
+        key = str(pdf_path)
+        with self._lock:
+            if key not in self.entries:
+                self.get_hash(key)
+            entry = self.entries[key]
+            labels = {"doc_set": doc_set, "tags": sorted(set(tags or []))}
+            if any(entry.get(name) != value for name, value in labels.items()):
+                entry.update(labels)
+                self._dirty = True
+
+    def get_labels(self, pdf_path: str) -> Dict:
+        """Document set and tags recorded for a PDF."""
+        with self._lock:
+            entry = self.entries.get(str(pdf_path), {})
+            return {"doc_set": entry.get("doc_set"), "tags": list(entry.get("tags", []))}
+
+    def forget_missing(self) -> int:
+        """Drop entries whose PDF no longer exists."""
+        with self._lock:
+            missing = [key for key in self.entries if not os.path.exists(key)]
+            for key in missing:
+                del self.entries[key]
+            if missing:
+                self._dirty = True
+            return len(missing)
+
+    def save(self) -> None:
+        """Write the manifest atomically if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -0,0 +1,160 @@
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Filter keys accepted by search -> chunk metadata field they match
+FILTER_FIELDS = {
+    "sources": "source",
+    "doc_sets": "doc_set",
+    "tags": "tags"
+}
+
+def _field_values(field: str, metadata: Dict) -> Iterable[str]:
+    """Indexed values of one metadata field; sources are matched by file name."""
+    value = metadata.get(field)
+    if value is None:
+        return ()
+    if field == "source":
+        return (Path(value).name,)
+    if field == "tags":
+        return tuple(value)
+    return (value,)
+
+def normalize_filters(filters: Optional[Dict[str, List[str]]]) -> Optional[Tuple]:
+    """
+    Validate a filter and turn it into a hashable key.
+
+    Values are OR-ed within a key and keys are AND-ed, e.g.
+    {"doc_sets": ["hr"], "tags": ["policy", "travel"]} selects HR chunks tagged
+    "policy" or "travel". Empty keys are ignored; None or {} means no filter.
+
+    Returns:
+        Optional[Tuple]: Sorted ((field, values), ...) key, or None for no filter
+    """
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown filter keys {sorted(unknown)}, expected some of {sorted(FILTER_FIELDS)}")
+
+    key = []
+    for name, values in sorted(filters.items()):
+        if not values:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        field = FILTER_FIELDS[name]
+        if field == "source":
+            values = [Path(value).name for value in values]
+        key.append((field, tuple(sorted(set(values)))))
+    return tuple(key) or None
+
+class MetadataIndex:
+    def __init__(self, cache_size: int = 64):
+        """
+        Inverted index from chunk metadata values to vector IDs.
+
+        Each (field, value) pair keeps its vector IDs in a flat int64 array. A filter
+        is answered with a boolean bitmap over all vector IDs; bitmaps of recent
+        filters are cached until the next add or remove. Copies share posting
+        arrays until a value is first modified.
+
+        Args:
+            cache_size: Number of filter bitmaps kept
+        """
+        self.cache_size = cache_size
+        self._postings: Dict[Tuple[str, str], array] = {}
+        self._n_ids = 0
+        self._cache: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Keys whose posting arrays belong to this index alone
+        self._owned: set = set()
+
+    def copy(self) -> "MetadataIndex":
+        """Copy that can be modified without affecting this index."""
+        other = MetadataIndex(self.cache_size)
+        other._postings = dict(self._postings)
+        other._n_ids = self._n_ids
+        return other
+
+    def add(self, ids: List[int], chunks: List[Dict]) -> None:
+        """Index the filterable metadata of chunks by vector ID."""
+        for vector_id, chunk in zip(ids, chunks):
+            for field in FILTER_FIELDS.values():
+                for value in _field_values(field, chunk["metadata"]):
+                    key = (field, value)
+                    if key not in self._owned:
+                        self._postings[key] = array('q', self._postings.get(key, ()))
+                        self._owned.add(key)
+                    self._postings[key].append(vector_id)
+        if ids:
+            self._n_ids = max(self._n_ids, max(ids) + 1)
+        with self._cache_lock:
+            self._cache.clear()
+
+    def remove(self, ids: List[int], chunks: List[Dict]) -> None:
+        """Drop chunks, given the records they were indexed with."""
+        keys = {
+            (field, value)
+            for chunk in chunks
+            for field in FILTER_FIELDS.values()
+            for value in _field_values(field, chunk["metadata"])
+        }
+        removed = np.array(ids, dtype='int64')
+        for key in keys:
+            postings = self._postings.get(key)
+            if postings is None:
+                continue
+            kept = np.frombuffer(postings, dtype='int64')
+            kept = kept[~np.isin(kept, removed)]
+            if len(kept):
+                self._postings[key] = array('q', kept.tobytes())
+                self._owned.add(key)
+            else:
+                del self._postings[key]
+                self._owned.discard(key)
+        with self._cache_lock:
+            self._cache.clear()
+
+    def values(self, field: str) -> Dict[str, int]:
+        """Indexed values of a metadata field with their chunk counts."""
+        return {value: len(ids) for (name, value), ids in self._postings.items() if name == field}
+
+    def select(self, filters: Optional[Dict[str, List[str]]]) -> Optional[np.ndarray]:
+        """
+        Resolve a filter to a bitmap over vector IDs.
+
+        Returns:
+            Optional[np.ndarray]: Boolean mask indexed by vector ID (read-only), or None for no filter
+        """
+        key = normalize_filters(filters)
+        if key is None:
+            return None
+
+        with self._cache_lock:
+            mask = self._cache.get(key)
+            if mask is not None:
+                self._cache.move_to_end(key)
+                return mask
+
+        mask = np.ones(self._n_ids, dtype=bool)
+        for field, values in key:
+            field_mask = np.zeros(self._n_ids, dtype=bool)
+            for value in values:
+                postings = self._postings.get((field, value))
+                if postings is not None:
+                    field_mask[np.frombuffer(postings, dtype='int64')] = True
+            mask &= field_mask
+        mask.setflags(write=False)
+
+        with self._cache_lock:
+            self._cache[key] = mask
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return mask
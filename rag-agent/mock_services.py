@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import uvicorn
+import logging
+from quota import TokenBucket
+from tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Stand-ins for Azure OpenAI (chat completions and embeddings), the Microsoft Graph
+# drive content and token endpoints, and the Google speech endpoint, for load tests
+# that must not spend real quota or write to SharePoint. Point the apps at it with
+#   AZURE_OPENAI_ENDPOINT=http://localhost:8009
+#   GRAPH_BASE_URL=http://localhost:8009/v1.0  LOGIN_BASE_URL=http://localhost:8009
+#   GOOGLE_SPEECH_ENDPOINT=http://localhost:8009/speech-api/v2/recognize
+
+FILLER = ("Based on the provided documents the policy applies to all employees and "
+          "the relevant clause describes the conditions approval steps and timelines").split()
+
+class MockConfig:
+    def __init__(self):
+        """Latency, error injection and quota of the mock services, from MOCK_* variables."""
+        self.chat_latency_ms = float(os.getenv("MOCK_CHAT_LATENCY_MS", "300"))
+        self.token_delay_ms = float(os.getenv("MOCK_TOKEN_DELAY_MS", "20"))
+        self.embedding_latency_ms = float(os.getenv("MOCK_EMBEDDING_LATENCY_MS", "50"))
+        self.graph_latency_ms = float(os.getenv("MOCK_GRAPH_LATENCY_MS", "100"))
+        self.speech_latency_ms = float(os.getenv("MOCK_SPEECH_LATENCY_MS", "200"))
+        # Latencies vary uniformly by +/- this fraction
+        self.jitter = float(os.getenv("MOCK_JITTER", "0.2"))
+        self.error_rate = float(os.getenv("MOCK_ERROR_RATE", "0"))
+        self.throttle_rate = float(os.getenv("MOCK_THROTTLE_RATE", "0"))
+        self.retry_after = float(os.getenv("MOCK_RETRY_AFTER", "1"))
+        # Simulated deployment quota; 0 disables it
+        self.tokens_per_minute = int(os.getenv("MOCK_TPM", "0"))
+        self.requests_per_minute = int(os.getenv("MOCK_RPM", "0"))
+        self.completion_tokens = int(os.getenv("MOCK_COMPLETION_TOKENS", "60"))
+        self.embedding_dimension = int(os.getenv("MOCK_EMBEDDING_DIMENSION", "1536"))
+        self.transcript = os.getenv("MOCK_TRANSCRIPT", "What is the leave policy?")
+        self.seed = int(os.getenv("MOCK_SEED", "0"))
+
+    def update(self, values: Dict) -> None:
+        for key, value in values.items():
+            if not hasattr(self, key):
+                raise KeyError(key)
+            setattr(self, key, type(getattr(self, key))(value))
+
+config = MockConfig()
+app = FastAPI(title="Mock Azure OpenAI, Graph and speech services")
+
+_lock = threading.Lock()
+_random = random.Random(config.seed)
+_stats: Dict[str, Dict[str, int]] = {}
+_quotas: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+# Drive items uploaded through the Graph mock: (site, drive, path) -> bytes
+_drive: Dict[Tuple[str, str, str], bytes] = {}
+
+def _count(endpoint: str, outcome: str) -> None:
+    with _lock:
+        counts = _stats.setdefault(endpoint, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+async def _sleep(latency_ms: float) -> None:
+    with _lock:
+        factor = 1 + config.jitter * (2 * _random.random() - 1)
+    await asyncio.sleep(max(0.0, latency_ms * factor) / 1000)
+
+def _error(status_code: int, code: str, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": message}}, status_code=status_code, headers=headers)
+
+def _take_quota(deployment: str, tokens: int) -> Tuple[Optional[JSONResponse], Dict[str, str]]:
+    """Deduct a call from the deployment's simulated quota; returns (429 response or None, rate-limit headers)."""
+    if not config.tokens_per_minute or not config.requests_per_minute:
+        return None, {}
+    with _lock:
+        now = time.monotonic()
+        buckets = _quotas.get(deployment)
+        if buckets is None or buckets[0].capacity != config.tokens_per_minute \
+                or buckets[1].capacity != config.requests_per_minute:
+            buckets = _quotas[deployment] = (TokenBucket(config.tokens_per_minute),
+                                             TokenBucket(config.requests_per_minute))
+        token_bucket, request_bucket = buckets
+        token_bucket.refill(now)
+        request_bucket.refill(now)
+        tokens = min(tokens, token_bucket.capacity)
+        wait = max(token_bucket.seconds_until(tokens), request_bucket.seconds_until(1))
+        if wait == 0:
+            token_bucket.available -= tokens
+            request_bucket.available -= 1
+        headers = {
+            "x-ratelimit-remaining-tokens": str(int(max(0, token_bucket.available))),
+            "x-ratelimit-remaining-requests": str(int(max(0, request_bucket.available)))
+        }
+    if wait > 0:
+        retry_after = max(1, int(wait + 0.999))
+        return _error(429, "429", f"Requests to {deployment} have exceeded the simulated rate limit. "
+                                  f"Please retry after {retry_after} seconds.",
+                      dict(headers, **{"retry-after": str(retry_after), "retry-after-ms": str(int(wait * 1000))})), headers
+    return None, headers
+
+def _inject_failure(endpoint: str) -> Optional[JSONResponse]:
+    """Randomly fail a call as configured by error_rate and throttle_rate."""
+    with _lock:
+        roll = _random.random()
+    if roll < config.throttle_rate:
+        _count(endpoint, "throttled")
+        return _error(429, "429", "Injected throttling, please retry later.",
+                      {"retry-after": f"{config.retry_after:g}", "retry-after-ms": str(int(config.retry_after * 1000))})
+    if roll < config.throttle_rate + config.error_rate:
+        _count(endpoint, "error")
+        return _error(500, "InternalServerError", "Injected server error.")
+    return None
+
+def pseudo_embedding(text: str, dimension: int) -> List[float]:
+    """Deterministic unit vector for a text, so repeated texts embed identically across runs."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype('float32')
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+def _reply(messages: List[Dict], max_tokens: int) -> str:
+    """Deterministic answer: JSON with the requested keys for extraction prompts, otherwise filler text."""
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    question = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    digest = hashlib.sha256(question.encode("utf-8")).hexdigest()[:8]
+
+    keys = re.search(r"JSON object with EXACTLY these keys: (.+?)\.\s*$", system, re.MULTILINE)
+    if keys:
+        record = {}
+        for key in keys.group(1).split(", "):
+            if "(Y/N)" in key:
+                record[key] = "N"
+            elif "date" in key.lower():
+                record[key] = date.today().isoformat()
+            elif key.startswith("Sr"):
+                record[key] = f"MOCK-{digest}"
+            else:
+                record[key] = f"Mock {key.lower()} {digest}"
+        return json.dumps(record)
+
+    n_words = max(1, min(max_tokens, config.completion_tokens))
+    words = [FILLER[i % len(FILLER)] for i in range(n_words)]
+    return f"Mock answer ({digest}): " + " ".join(words) + "."
+
+def _chunk(completion_id: str, deployment: str, created: int, delta: Dict,
+           finish_reason: Optional[str] = None, usage: Optional[Dict] = None) -> str:
+    body = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": deployment,
+        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    if usage:
+        body["usage"] = usage
+    return f"data: {json.dumps(body)}\n\n"
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    prompt_tokens = sum(count_tokens(m.get("content") or "") + 4 for m in messages) + 3
+    max_tokens = int(body.get("max_tokens") or 1000)
+    endpoint = "chat_stream" if body.get("stream") else "chat"
+
+    throttled, headers = _take_quota(deployment, prompt_tokens + max_tokens)
+    if throttled is not None:
+        _count(endpoint, "throttled")
+        return throttled
+    failure = _inject_failure(endpoint)
+    if failure is not None:
+        return failure
+
+    content = _reply(messages, max_tokens)
+    completion_tokens = count_tokens(content)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+             "total_tokens": prompt_tokens + completion_tokens}
+    completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    _count(endpoint, "ok")
+
+    if not body.get("stream"):
+        await _sleep(config.chat_latency_ms + config.token_delay_ms * completion_tokens)
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        }, headers=headers)
+
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+    async def events():
+        # Time to first token, then one piece per word
+        await _sleep(config.chat_latency_ms)
+        yield _chunk(completion_id, deployment, created, {"role": "assistant", "content": ""})
+        for i, piece in enumerate(re.findall(r"\S+\s*", content)):
+            if i:
+                await _sleep(config.token_delay_ms)
+            yield _chunk(completion_id, deployment, created, {"content": piece})
+        yield _chunk(completion_id, deployment, created, {}, finish_reason="stop")
+        if include_usage:
+            yield _chunk(completion_id, deployment, created, {}, usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.post("/openai/deployments/{deployment}/embeddings")
+async def embeddings(deployment: str, request: Request):
+    body = await request.json()
+    texts = body.get("input", [])
+    if isinstance(texts, str):
+        texts = [texts]
+    n_tokens = sum(count_tokens(text) for text in texts)
+
+    throttled, headers = _take_quota(deployment, n_tokens)
+    if throttled is not None:
+        _count("embeddings", "throttled")
+        return throttled
+    failure = _inject_failure("embeddings")
+    if failure is not None:
+        return failure
+
+    await _sleep(config.embedding_latency_ms)
+    dimension = int(body.get("dimensions") or config.embedding_dimension)
+    _count("embeddings", "ok")
+    return JSONResponse({
+        "object": "list",
+        "model": deployment,
+        "data": [{"object": "embedding", "index": i, "embedding": pseudo_embedding(text, dimension)}
+                 for i, text in enumerate(texts)],
+        "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens}
+    }, headers=headers)
+
+@app.post("/{tenant_id}/oauth2/v2.0/token")
+async def token(tenant_id: str):
+    """Client-credentials token for the Graph mock; any client id and secret are accepted."""
+    _count("token", "ok")
+    return {"token_type": "Bearer", "expires_in": 3599, "access_token": f"mock-{tenant_id}-{uuid.uuid4().hex}"}
+
+@app.api_route("/v1.0/sites/{site_id}/drives/{drive_id}/root:/{item_path:path}", methods=["GET", "PUT"])
+async def drive_item_content(site_id: str, drive_id: str, item_path: str, request: Request):
+    """Download (GET) or upload (PUT) a drive item's content, as in root:/{path}:/content."""
+    if not item_path.endswith(":/content"):
+        return _error(400, "invalidRequest", "Only item content is supported by the mock")
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        return _error(401, "InvalidAuthenticationToken", "Access token is empty.")
+    path = item_path[:-len(":/content")]
+    endpoint = "graph_upload" if request.method == "PUT" else "graph_download"
+    failure = _inject_failure(endpoint)
+    if failure is not None:
+        return failure
+    await _sleep(config.graph_latency_ms)
+
+    key = (site_id, drive_id, path)
+    if request.method == "GET":
+        with _lock:
+            content = _drive.get(key)
+        if content is None:
+            _count(endpoint, "not_found")
+            return _error(404, "itemNotFound", "The resource could not be found.")
+        _count(endpoint, "ok")
+        return Response(content, media_type="application/octet-stream")
+
+    content = await request.body()
+    with _lock:
+        existed = key in _drive
+        _drive[key] = content
+    _count(endpoint, "ok")
+    name = path.rsplit("/", 1)[-1]
+    return JSONResponse({
+        "id": hashlib.sha1("/".join(key).encode("utf-8")).hexdigest(),
+        "name": name,
+        "size": len(content),
+        "webUrl": f"{str(request.base_url).rstrip('/')}/mock/drive/{path}"
+    }, status_code=200 if existed else 201)
+
+@app.post("/speech-api/v2/recognize")
+async def recognize(request: Request):
+    """Google speech v2 stand-in (as used by SpeechRecognition's recognize_google)."""
+    await request.body()
+    failure = _inject_failure("speech")
+    if failure is not None:
+        return failure
+    await _sleep(config.speech_latency_ms)
+    _count("speech", "ok")
+    result = {"result": [{"alternative": [{"transcript": config.transcript, "confidence": 0.95}], "final": True}],
+              "result_index": 0}
+    return Response('{"result":[]}\n' + json.dumps(result) + "\n", media_type="application/json")
+
+@app.get("/mock/stats")
+async def mock_stats():
+    """Calls per endpoint and outcome, and the simulated quota left per deployment."""
+    with _lock:
+        now = time.monotonic()
+        quotas = {}
+        for deployment, (token_bucket, request_bucket) in _quotas.items():
+            token_bucket.refill(now)
+            request_bucket.refill(now)
+            quotas[deployment] = {"tokens": int(token_bucket.available), "requests": int(request_bucket.available)}
+        return {"calls": {endpoint: dict(counts) for endpoint, counts in _stats.items()},
+                "quota": quotas, "drive_items": len(_drive)}
+
+@app.get("/mock/config")
+async def get_mock_config():
+    return vars(config)
+
+@app.post("/mock/config")
+async def set_mock_config(request: Request):
+    """Change latency, error injection or quota while a load test runs, e.g. {"error_rate": 0.05}."""
+    try:
+        config.update(await request.json())
+    except (KeyError, ValueError, TypeError) as e:
+        return _error(400, "invalidConfig", f"Invalid setting: {str(e)}")
+    return vars(config)
+
+@app.post("/mock/reset")
+async def reset():
+    """Clear counters, simulated quota and stored drive items."""
+    with _lock:
+        _stats.clear()
+        _quotas.clear()
+        _drive.clear()
+    return {"status": "reset"}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock Azure OpenAI, Graph and speech services")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8009)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Mock services on http://{args.host}:{args.port}: {vars(config)}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,30 @@
 import os
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple
 import numpy as np
-import faiss
 from dotenv import load_dotenv
 from llama_index.core import SimpleDirectoryReader, Document
 from llama_index.core.node_parser import SimpleNodeParser
 from llama_index.core.node_parser import SentenceSplitter
-from tqdm import tqdm
 import logging
 import json
 from pathlib import Path
-import hashlib
 import shutil
+from vector_store import IndexSnapshot, VectorStore
+from embedding_cache import QueryEmbeddingCache, ChunkEmbeddingCache
+from embedder import AsyncEmbedder
+from manifest import Manifest
+from sparse_index import term_frequencies, reciprocal_rank_fusion
+from diversify import mmr_select, merge_adjacent
+from index_engine import normalize
+from clients import create_async_openai, get_async_openai, retry_after_seconds, run_sync
+from quota import QuotaScheduler, PRIORITY_INTERACTIVE
+from tokens import count_tokens
+import openai
+import asyncio
+import concurrent.futures
+import multiprocessing
+import threading
+import time
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +34,59 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+def chunk_pdf(pdf_path: str, chunk_size: int, chunk_overlap: int) -> Tuple[List[str], int]:
+    """
+    Parse a PDF and split it into text chunks.
+    
+    Module-level so it can run in a worker process.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        chunk_size: Chunk size passed to SentenceSplitter
+        chunk_overlap: Chunk overlap passed to SentenceSplitter
+        
+    Returns:
+        Tuple[List[str], int]: Non-empty chunk texts in document order, and the number of pages parsed
+    """
+    # Load and parse PDF using LlamaIndex with optimized chunking
+    reader = SimpleDirectoryReader(input_files=[pdf_path])
+    documents = reader.load_data()
+    
+    # Use SentenceSplitter for better semantic chunking
+    parser = SentenceSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separator="\n"
+    )
+    nodes = parser.get_nodes_from_documents(documents)
+    
+    logger.info(f"Created {len(nodes)} chunks from {Path(pdf_path).name}")
+    
+    # Extract text chunks, skipping empty ones so chunks and embeddings stay aligned
+    chunks = [node.text.strip() for node in nodes if node.text and node.text.strip()]
+    return chunks, len(documents)
+
+# Per-PDF store layout under DATA/embeddings/<name>_<hash>/
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+TERMS_FILE = "terms.json"
+LEGACY_DOCUMENTS_FILE = "documents.json"
+LEGACY_INDEX_FILE = "faiss_index.bin"
+MANIFEST_FILE = "manifest.json"
+INDEX_CARD_FILE = "index_card.json"
+
+RETRIEVAL_MODES = ("dense", "sparse", "hybrid")
+
+def _embedding_failed(embeddings: np.ndarray) -> np.ndarray:
+    """Mask of query embedding rows left zero because the query could not be embedded."""
+    return ~np.asarray(embeddings).any(axis=1)
+
+def _require_embedding(embedding: np.ndarray) -> np.ndarray:
+    """Return a single query embedding, raising if it could not be generated."""
+    if not embedding.any():
+        raise RuntimeError("Failed to generate query embedding")
+    return embedding
+
 class PDFProcessor:
     def __init__(self, data_dir: str = "DATA"):
         """Initialize the PDF processor with FAISS vector store and Azure OpenAI embeddings."""
@@ -43,55 +109,311 @@ class PDFProcessor:
         )
         logger.info(f"Azure OpenAI client initialized with embedding deployment: {self.embedding_deployment}")
         
+        # Quota of the embedding deployment, shared by live queries (first) and bulk ingestion
+        self.quota = QuotaScheduler.from_env(self.embedding_deployment)
+        
+        # Concurrent embedder for bulk ingestion, on its own tuned connection pool per run
+        self.embedder = AsyncEmbedder(
+            client_factory=lambda: create_async_openai(
+                self.endpoint,
+                self.api_key,
+                self.api_version,
+                max_retries=0  # AsyncEmbedder does its own backoff
+            ),
+            deployment=self.embedding_deployment,
+            max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+            max_batch_tokens=int(os.getenv("EMBEDDING_BATCH_TOKENS", "32000")),
+            max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "256")),
+            quota=self.quota
+        )
+        
         # Initialize directory structure
         self.data_dir = Path(data_dir)
         self.raw_pdfs_dir = self.data_dir / "raw_pdfs"
         self.embeddings_dir = self.data_dir / "embeddings"
+        self.cache_dir = self.data_dir / "cache"
         
         # Create directories if they don't exist
         self.raw_pdfs_dir.mkdir(parents=True, exist_ok=True)
         self.embeddings_dir.mkdir(parents=True, exist_ok=True)
         
-        # Initialize FAISS index
+        # Corpus-wide FAISS index and chunk store, shared by all PDFs
         self.dimension = 1536  # Azure OpenAI ada-002 embedding dimension
-        self.index = None  # Will be initialized when we have data
+        self.store = VectorStore(
+            self.dimension,
+            engine=os.getenv("INDEX_ENGINE", "auto"),
+            target_recall=float(os.getenv("INDEX_TARGET_RECALL", "0.95")),
+            card_path=self.embeddings_dir / INDEX_CARD_FILE,
+            compressed=os.getenv("INDEX_COMPRESSED", "false").lower() == "true",
+            rerank_factor=int(os.getenv("INDEX_RERANK_FACTOR", "4"))
+        )
+        
+        # On-disk dtype of stored embeddings (float32 or float16)
+        self.storage_dtype = np.dtype(os.getenv("EMBEDDING_STORAGE_DTYPE", "float32"))
+        if self.storage_dtype not in (np.float32, np.float16):
+            raise ValueError("EMBEDDING_STORAGE_DTYPE must be float32 or float16")
+        
+        # Convert any stores written in the old JSON format
+        self.migrate_legacy_stores()
+        
+        # Size/mtime/hash/store record of every raw PDF, so unchanged files are not re-hashed
+        self.manifest = Manifest(self.embeddings_dir / MANIFEST_FILE)
         
-        # Document store
-        self.documents: List[Dict] = []
+        # Query embedding cache: in-process LRU, optionally backed by SQLite
+        persist_query_cache = os.getenv("QUERY_EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
+        self.query_cache = QueryEmbeddingCache(
+            max_size=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024")),
+            db_path=str(self.cache_dir / "query_embeddings.sqlite") if persist_query_cache else None,
+            max_disk_entries=int(os.getenv("QUERY_EMBEDDING_CACHE_DISK_SIZE", "100000"))
+        )
+        
+        # Content-addressed chunk embedding cache, shared across all documents
+        self.chunk_cache = ChunkEmbeddingCache(
+            str(self.cache_dir / "chunk_embeddings.sqlite"),
+            dimension=self.dimension
+        )
+        self.last_ingest_stats: Dict = {}
         
         # Configure chunking
         self.chunk_size = 1000  # Characters per chunk
         self.chunk_overlap = 200  # Overlap between chunks
+        
+        # Retrieval: dense (FAISS), sparse (BM25) or hybrid (both, fused with RRF; "score" is then the RRF score)
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "dense")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}")
+        self.hybrid_depth_factor = int(os.getenv("HYBRID_DEPTH_FACTOR", "4"))  # Candidates per retriever = k * factor
+        self._search_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+        
+        # Post-retrieval diversification: over-fetch, MMR, merge neighbouring chunks
+        self.mmr_diversify = os.getenv("MMR_DIVERSIFY", "false").lower() == "true"
+        self.mmr_lambda = float(os.getenv("MMR_LAMBDA", "0.7"))
+        self.mmr_fetch_factor = int(os.getenv("MMR_FETCH_FACTOR", "4"))
+        
+        # Number of processes used to parse and chunk PDFs in process_pdfs
+        self.ingest_workers = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+        
+        # One writer at a time: uploads, bulk loads and reloads each publish a new index version
+        self._ingest_lock = threading.RLock()
+        # What raw_pdfs and the stores looked like when the live index version was last synced with them
+        self._disk_signature: Optional[Tuple] = None
+        self._watcher: Optional[threading.Thread] = None
     
-    def process_pdfs(self) -> None:
-        """Process all PDFs in the raw_pdfs directory."""
+    def process_pdfs(self, workers: Optional[int] = None, fresh: bool = False) -> None:
+        """
+        Process all PDFs in the raw_pdfs directory.
+        
+        PDFs with a stored embedding matrix are loaded directly. The rest are parsed and
+        chunked in parallel on a process pool, then embedded together in a single
+        embedding stage and indexed in file-name order, so vector IDs do not depend on
+        which worker finishes first.
+        
+        Everything is published as one new index version; searches keep using the
+        current version until then.
+        
+        Args:
+            workers: Number of parsing processes (defaults to INGEST_WORKERS); 1 parses serially
+            fresh: Build the new version from scratch instead of on top of the current one,
+                so PDFs removed from disk disappear from the index
+        """
         if not self.raw_pdfs_dir.exists():
             logger.error(f"Raw PDFs directory not found: {self.raw_pdfs_dir}")
             return
         
-        pdf_files = [f for f in self.raw_pdfs_dir.glob("*.pdf") if f.name != ".gitkeep"]
+        pdf_files = sorted(f for f in self.raw_pdfs_dir.glob("*.pdf") if f.name != ".gitkeep")
         
-        if not pdf_files:
+        if not pdf_files and not fresh:
             logger.warning(f"No PDF files found in {self.raw_pdfs_dir}")
             return
         
         logger.info(f"Found {len(pdf_files)} PDF files to process")
         
+        with self._ingest_lock:
+            try:
+                # Build the index once for the whole batch instead of after every PDF
+                with self.store.deferred(fresh=fresh):
+                    self._process_pdf_files(pdf_files, workers)
+                # Includes the stores written just now, so they do not trigger a reload
+                self._disk_signature = self._read_disk_signature()
+            finally:
+                self.manifest.forget_missing()
+                self.manifest.save()
+    
+    def reload(self) -> Dict:
+        """
+        Rebuild the index from the PDFs and stores on disk and swap it in atomically.
+        
+        Picks up stores written by the pdf_processing workflow or another replica
+        sharing the data directory. The new version is built off to the side;
+        searches already running finish on the old one.
+        
+        Returns:
+            Dict: The new version's summary and how long the reload took
+        """
+        started = time.time()
+        with self._ingest_lock:
+            previous = self.store.version
+            self.manifest.refresh()
+            self.process_pdfs(fresh=True)
+        
+        info = self.store.snapshot().info()
+        info.update({"previous_version": previous, "reload_seconds": round(time.time() - started, 3)})
+        logger.info(f"Reloaded index: version {previous} -> {info['version']} in {info['reload_seconds']}s")
+        return info
+    
+    def _read_disk_signature(self) -> Tuple:
+        """Names, sizes and mtimes of the raw PDFs and store files, to detect changes made by other processes."""
+        entries = []
+        for path in sorted(self.raw_pdfs_dir.glob("*.pdf")):
+            stat = path.stat()
+            entries.append((path.name, stat.st_size, stat.st_mtime_ns))
+        for path in sorted(self.embeddings_dir.glob(f"*/{EMBEDDINGS_FILE}")):
+            stat = path.stat()
+            entries.append((path.parent.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(entries)
+    
+    def reload_if_changed(self) -> Optional[Dict]:
+        """Reload if raw PDFs or stores changed on disk since the index was last synced with them."""
+        with self._ingest_lock:
+            if self._read_disk_signature() == self._disk_signature:
+                return None
+            logger.info("PDFs or stores changed on disk, reloading the index")
+            return self.reload()
+    
+    def start_watcher(self, interval: float, on_reload: Optional[Callable[[Dict], None]] = None) -> None:
+        """
+        Poll the data directory every interval seconds and reload when it changes.
+        
+        Args:
+            interval: Seconds between checks
+            on_reload: Called with the reload summary after each reload
+        """
+        if self._watcher is not None:
+            return
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    info = self.reload_if_changed()
+                    if info is not None and on_reload:
+                        on_reload(info)
+                except Exception as e:
+                    logger.error(f"Error reloading the index: {str(e)}")
+        
+        self._watcher = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.data_dir} for changes every {interval}s")
+    
+    def _process_pdf_files(self, pdf_files: List[Path], workers: Optional[int]) -> None:
+        """Load, or parse, embed and index, a sorted list of raw PDFs."""
+        # Stage 0: load PDFs that already have a store
+        pending = []
         for pdf_path in pdf_files:
-            logger.info(f"\n{'='*50}")
-            logger.info(f"Processing: {pdf_path.name}")
-            logger.info(f"{'='*50}")
-            
             try:
-                self.process_pdf(str(pdf_path))
+                if self._load_cached_pdf(pdf_path) is None:
+                    pending.append(pdf_path)
+            except Exception as e:
+                logger.error(f"Error loading {pdf_path.name}: {str(e)}")
+        
+        if not pending:
+            return
+        
+        # Stage 1: parse and chunk on a process pool
+        workers = self.ingest_workers if workers is None else workers
+        chunked = self._chunk_pdfs(pending, workers)
+        pending = [pdf_path for pdf_path in pending if pdf_path in chunked]
+        
+        # Stage 2: embed every new chunk in one pass
+        all_chunks = [chunk for pdf_path in pending for chunk in chunked[pdf_path]]
+        try:
+            embeddings = self._embed_chunks(all_chunks)
+        except Exception as e:
+            logger.error(f"Error embedding {len(pending)} PDFs together, falling back to one at a time: {str(e)}")
+            embeddings = None
+        
+        # Stage 3: save and index in deterministic order
+        offset = 0
+        for pdf_path in pending:
+            chunks = chunked[pdf_path]
+            try:
+                if embeddings is None:
+                    pdf_embeddings = self._embed_chunks(chunks)
+                else:
+                    pdf_embeddings = embeddings[offset:offset + len(chunks)]
+                self._index_chunks(pdf_path, chunks, pdf_embeddings)
                 logger.info(f"Successfully processed {pdf_path.name}")
             except Exception as e:
                 logger.error(f"Error processing {pdf_path.name}: {str(e)}")
+            offset += len(chunks)
+    
+    def _chunk_pdfs(self, pdf_paths: List[Path], workers: int) -> Dict[Path, List[str]]:
+        """
+        Parse and chunk PDFs, in parallel when workers > 1.
+        
+        Returns:
+            Dict[Path, List[str]]: Chunks per PDF; PDFs that failed to parse are left out
+        """
+        chunked: Dict[Path, List[str]] = {}
+        
+        if workers <= 1 or len(pdf_paths) == 1:
+            for pdf_path in pdf_paths:
+                try:
+                    chunked[pdf_path], _ = chunk_pdf(str(pdf_path), self.chunk_size, self.chunk_overlap)
+                except Exception as e:
+                    logger.error(f"Error parsing {pdf_path.name}: {str(e)}")
+            return chunked
+        
+        workers = min(workers, len(pdf_paths))
+        logger.info(f"Parsing {len(pdf_paths)} PDFs on {workers} worker processes")
+        # Spawn rather than fork: the parent may already hold threads and open SQLite handles
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {
+                executor.submit(chunk_pdf, str(pdf_path), self.chunk_size, self.chunk_overlap): pdf_path
+                for pdf_path in pdf_paths
+            }
+            for future in concurrent.futures.as_completed(futures):
+                pdf_path = futures[future]
+                try:
+                    chunked[pdf_path], _ = future.result()
+                except Exception as e:
+                    logger.error(f"Error parsing {pdf_path.name}: {str(e)}")
+        
+        return chunked
     
     def _get_pdf_hash(self, pdf_path: str) -> str:
-        """Generate a hash for the PDF file to use as a unique identifier."""
-        with open(pdf_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+        """
+        Generate a hash for the PDF file to use as a unique identifier.
+        
+        The file is only read if its size or mtime changed since the manifest recorded it.
+        """
+        return self.manifest.get_hash(pdf_path)
+    
+    def register_pdf_hash(self, pdf_path: str, pdf_hash: str) -> None:
+        """Record a hash computed elsewhere (e.g. while streaming an upload) so the file is not re-read."""
+        self.manifest.record(pdf_path, pdf_hash)
+        self.manifest.save()
+    
+    def set_pdf_labels(self, pdf_path: str, doc_set: Optional[str] = None, tags: Optional[List[str]] = None) -> None:
+        """Record the document set and tags a PDF's chunks are filtered by; applied when it is next indexed."""
+        self.manifest.set_labels(pdf_path, doc_set, tags)
+        self.manifest.save()
+    
+    def _apply_labels(self, raw_pdf_path: Path, documents: List[Dict]) -> None:
+        """Copy the PDF's recorded document set and tags into its chunk metadata."""
+        labels = self.manifest.get_labels(str(raw_pdf_path))
+        for document in documents:
+            document["metadata"].update(labels)
+    
+    def available_filters(self) -> Dict[str, Dict[str, int]]:
+        """Filter values currently in the index, with chunk counts, keyed like search filters."""
+        metadata = self.store.snapshot().metadata
+        return {
+            "sources": metadata.values("source"),
+            "doc_sets": metadata.values("doc_set"),
+            "tags": metadata.values("tags")
+        }
     
     def _get_pdf_storage_path(self, pdf_path: str) -> Path:
         """Get the storage path for a specific PDF."""
@@ -114,221 +436,638 @@ class PDFProcessor:
         return target_path
     
     def _load_pdf_data(self, pdf_path: str) -> tuple:
-        """Load existing data for a specific PDF if available."""
+        """
+        Load existing data for a specific PDF if available.
+        
+        Returns:
+            tuple: (memory-mapped embedding matrix, chunk records, BM25 term counts or None),
+                or (None, [], None) if not stored yet
+        """
         pdf_dir = self._get_pdf_storage_path(pdf_path)
-        index_path = pdf_dir / "faiss_index.bin"
-        documents_path = pdf_dir / "documents.json"
+        embeddings_path = pdf_dir / EMBEDDINGS_FILE
+        chunks_path = pdf_dir / CHUNKS_FILE
+        
+        if not (embeddings_path.exists() and chunks_path.exists()):
+            self._migrate_legacy_store(pdf_dir)
         
-        if index_path.exists() and documents_path.exists():
+        if embeddings_path.exists() and chunks_path.exists():
             logger.info(f"Loading existing data for {pdf_path}")
-            index = faiss.read_index(str(index_path))
+            embeddings = np.load(embeddings_path, mmap_mode='r')
             
-            with open(documents_path, 'r') as f:
+            with open(chunks_path, 'r') as f:
                 documents = json.load(f)
-                # Convert string embeddings back to numpy arrays
-                for doc in documents:
-                    doc['embedding'] = np.array(doc['embedding'])
             
-            return index, documents
+            if len(documents) != len(embeddings):
+                logger.warning(f"Stored data for {pdf_path} is inconsistent, re-processing")
+                return None, [], None
+            
+            # Stores written before the sparse index existed get their terms computed on add
+            term_freqs = None
+            terms_path = pdf_dir / TERMS_FILE
+            if terms_path.exists():
+                with open(terms_path, 'r') as f:
+                    term_freqs = json.load(f)
+                if len(term_freqs) != len(documents):
+                    term_freqs = None
+            
+            self.manifest.set_store(pdf_path, pdf_dir.name)
+            return embeddings, documents, term_freqs
         
-        return None, []
+        return None, [], None
     
-    def _save_pdf_data(self, pdf_path: str, index: faiss.Index, documents: List[Dict]):
-        """Save data for a specific PDF."""
+    def _save_pdf_data(self, pdf_path: str, embeddings: np.ndarray, documents: List[Dict]) -> np.ndarray:
+        """
+        Save data for a specific PDF.
+        
+        Embeddings go into one contiguous .npy matrix (row i belongs to documents[i]);
+        chunk text and metadata go into a slim JSON file.
+        
+        Returns:
+            np.ndarray: The saved embedding matrix, memory-mapped from disk
+        """
         pdf_dir = self._get_pdf_storage_path(pdf_path)
+        self._write_pdf_store(pdf_dir, embeddings, documents)
+        self.manifest.set_store(pdf_path, pdf_dir.name)
+        return np.load(pdf_dir / EMBEDDINGS_FILE, mmap_mode='r')
+    
+    def _write_pdf_store(self, pdf_dir: Path, embeddings: np.ndarray, documents: List[Dict]):
+        """Write an embedding matrix, its chunk records and their BM25 term counts into a storage directory."""
+        # Write to temporary files first so a crash never leaves a half-written store
+        embeddings_path = pdf_dir / EMBEDDINGS_FILE
+        tmp_embeddings_path = pdf_dir / f"{EMBEDDINGS_FILE}.tmp"
+        with open(tmp_embeddings_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(embeddings, dtype=self.storage_dtype))
         
-        # Save FAISS index
-        index_path = pdf_dir / "faiss_index.bin"
-        faiss.write_index(index, str(index_path))
-        
-        # Save documents
-        documents_path = pdf_dir / "documents.json"
-        # Convert numpy arrays to lists for JSON serialization
-        documents_to_save = []
-        for doc in documents:
-            doc_copy = doc.copy()
-            doc_copy['embedding'] = doc_copy['embedding'].tolist()
-            documents_to_save.append(doc_copy)
-        
-        with open(documents_path, 'w') as f:
-            json.dump(documents_to_save, f)
-    
-    def _initialize_index(self, n_vectors: int):
-        """Initialize FAISS index based on the number of vectors."""
-        if self.index is not None:
-            return
+        chunks_path = pdf_dir / CHUNKS_FILE
+        tmp_chunks_path = pdf_dir / f"{CHUNKS_FILE}.tmp"
+        with open(tmp_chunks_path, 'w') as f:
+            json.dump(documents, f)
+        
+        terms_path = pdf_dir / TERMS_FILE
+        tmp_terms_path = pdf_dir / f"{TERMS_FILE}.tmp"
+        with open(tmp_terms_path, 'w') as f:
+            json.dump([term_frequencies(doc["text"]) for doc in documents], f)
+        
+        os.replace(tmp_embeddings_path, embeddings_path)
+        os.replace(tmp_chunks_path, chunks_path)
+        os.replace(tmp_terms_path, terms_path)
+    
+    def _migrate_legacy_store(self, pdf_dir: Path) -> bool:
+        """
+        Convert a legacy store (faiss_index.bin + documents.json with inline embeddings)
+        into the binary format.
+        
+        Args:
+            pdf_dir: Storage directory of one PDF
             
-        # For small datasets, use a simple flat index
-        if n_vectors < 100:
-            logger.info("Using flat index for small dataset")
-            self.index = faiss.IndexFlatL2(self.dimension)
-        else:
-            # For larger datasets, use IVF index
-            nlist = min(n_vectors // 10, 100)  # Number of clusters
-            logger.info(f"Using IVF index with {nlist} clusters")
-            quantizer = faiss.IndexFlatL2(self.dimension)
-            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist)
-            self.index.nprobe = min(nlist // 10, 10)  # Number of clusters to search
-    
-    def _get_embedding(self, text: str) -> np.ndarray:
-        """Get embedding from Azure OpenAI API."""
-        try:
-            response = self.client.embeddings.create(
-                input=text,
-                model=self.embedding_deployment
-            )
-            return np.array(response.data[0].embedding)
-        except Exception as e:
-            logger.error(f"Error generating embedding with Azure OpenAI: {str(e)}")
-            # Return zero vector as fallback
-            return np.zeros(self.dimension)
+        Returns:
+            bool: True if the directory was migrated
+        """
+        legacy_documents_path = pdf_dir / LEGACY_DOCUMENTS_FILE
+        if not legacy_documents_path.exists():
+            return False
+        
+        logger.info(f"Migrating legacy embedding store: {pdf_dir.name}")
+        with open(legacy_documents_path, 'r') as f:
+            documents = json.load(f)
+        
+        embeddings = np.array([doc.pop('embedding') for doc in documents], dtype='float32')
+        embeddings = embeddings.reshape(len(documents), self.dimension)
+        
+        self._write_pdf_store(pdf_dir, embeddings, documents)
+        
+        legacy_documents_path.unlink()
+        legacy_index_path = pdf_dir / LEGACY_INDEX_FILE
+        if legacy_index_path.exists():
+            legacy_index_path.unlink()
+        return True
+    
+    def migrate_legacy_stores(self) -> int:
+        """
+        One-shot migration of every legacy store under the embeddings directory.
+        
+        Returns:
+            int: Number of stores migrated
+        """
+        migrated = 0
+        for pdf_dir in sorted(self.embeddings_dir.iterdir()):
+            if not pdf_dir.is_dir():
+                continue
+            try:
+                if self._migrate_legacy_store(pdf_dir):
+                    migrated += 1
+            except Exception as e:
+                logger.error(f"Error migrating {pdf_dir.name}: {str(e)}")
+        
+        if migrated:
+            logger.info(f"Migrated {migrated} legacy embedding stores")
+        return migrated
     
-    def _get_embeddings_batch(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
-        """Get embeddings for a batch of texts using Azure OpenAI."""
-        all_embeddings = []
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embedding of a query as used for search (served from the query embedding cache when possible)."""
+        return self._get_embedding(query)
+    
+    def _get_embedding(self, query: str) -> np.ndarray:
+        """
+        Get a query embedding, serving repeat queries from the query embedding cache.
         
-        # Filter out empty or invalid texts
-        valid_texts = [text.strip() for text in texts if text and isinstance(text, str) and text.strip()]
+        Raises:
+            RuntimeError: If the query could not be embedded
+        """
+        return _require_embedding(self._get_query_embeddings([query])[0])
+    
+    async def aembed_query(self, query: str) -> np.ndarray:
+        """Async embed_query() on the shared connection pool; does not block the event loop."""
+        return _require_embedding((await self._aget_query_embeddings([query]))[0])
+    
+    @property
+    def async_client(self):
+        """Shared AsyncAzureOpenAI client of the running event loop."""
+        return get_async_openai(self.endpoint, self.api_key, self.api_version)
+    
+    def _get_query_embeddings(self, queries: List[str]) -> np.ndarray:
+        """
+        Get embeddings for many queries, serving repeats from the query embedding cache.
         
-        if not valid_texts:
-            logger.error("No valid texts found for embedding generation")
-            return np.array([])
-            
-        for i in tqdm(range(0, len(valid_texts), batch_size), desc="Generating embeddings with Azure OpenAI"):
-            batch = valid_texts[i:i + batch_size]
+        Cache misses are deduplicated and embedded in as few requests as possible.
+        
+        Returns:
+            np.ndarray: Matrix with one row per query; rows of queries that could not be
+            embedded are left zero (see _embedding_failed())
+        """
+        embeddings, positions, texts = self._lookup_query_embeddings(queries)
+        batch_size = self.embedder.max_batch_size
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
             try:
-                response = self.client.embeddings.create(
-                    input=batch,
-                    model=self.embedding_deployment
-                )
-                batch_embeddings = [data.embedding for data in response.data]
-                all_embeddings.extend(batch_embeddings)
+                response = self._embed_query_batch(batch)
             except Exception as e:
-                logger.error(f"Error generating embeddings for batch with Azure OpenAI: {str(e)}")
-                # If batch processing fails, try processing one by one
-                for text in batch:
-                    try:
-                        response = self.client.embeddings.create(
-                            input=text,
-                            model=self.embedding_deployment
-                        )
-                        all_embeddings.append(response.data[0].embedding)
-                    except Exception as e:
-                        logger.error(f"Error generating embedding for text with Azure OpenAI: {str(e)}")
-                        # Add a zero vector as placeholder for failed embeddings
-                        all_embeddings.append(np.zeros(self.dimension))
-        
-        return np.array(all_embeddings)
-    
-    def process_pdf(self, pdf_path: str) -> List[Dict]:
-        """
-        Process a PDF file and return its chunks with embeddings.
+                logger.error(f"Error generating embedding with Azure OpenAI: {str(e)}")
+                # Leave the rows zero so search reports no results for these queries; never cache them
+                continue
+            self._store_query_embeddings(embeddings, positions[start:start + batch_size], batch, response)
+        return embeddings
+    
+    async def _aget_query_embeddings(self, queries: List[str]) -> np.ndarray:
+        """Async _get_query_embeddings() on the shared connection pool; batches are sent concurrently."""
+        embeddings, positions, texts = self._lookup_query_embeddings(queries)
+        batch_size = self.embedder.max_batch_size
+        starts = list(range(0, len(texts), batch_size))
+        responses = await asyncio.gather(*(
+            self._aembed_query_batch(texts[start:start + batch_size]) for start in starts
+        ), return_exceptions=True)
+        for start, response in zip(starts, responses):
+            if isinstance(response, Exception):
+                logger.error(f"Error generating embedding with Azure OpenAI: {str(response)}")
+                # Leave the rows zero so search reports no results for these queries; never cache them
+                continue
+            self._store_query_embeddings(embeddings, positions[start:start + batch_size],
+                                         texts[start:start + batch_size], response)
+        return embeddings
+    
+    def _embed_query_batch(self, texts: List[str]):
+        """Embed query texts as an interactive call under the embedding deployment's quota."""
+        self.quota.acquire_sync(sum(count_tokens(text) for text in texts), PRIORITY_INTERACTIVE)
+        try:
+            raw = self.client.embeddings.with_raw_response.create(input=texts, model=self.embedding_deployment)
+        except openai.RateLimitError as e:
+            self.quota.record_throttle(retry_after_seconds(e))
+            raise
+        self.quota.record_headers(raw.headers)
+        return raw.parse()
+    
+    async def _aembed_query_batch(self, texts: List[str]):
+        """Async _embed_query_batch() on the shared connection pool."""
+        await self.quota.acquire(sum(count_tokens(text) for text in texts), PRIORITY_INTERACTIVE)
+        try:
+            raw = await self.async_client.embeddings.with_raw_response.create(
+                input=texts, model=self.embedding_deployment)
+        except openai.RateLimitError as e:
+            self.quota.record_throttle(retry_after_seconds(e))
+            raise
+        self.quota.record_headers(raw.headers)
+        return raw.parse()
+    
+    def _lookup_query_embeddings(self, queries: List[str]) -> Tuple[np.ndarray, List[List[int]], List[str]]:
+        """
+        Fill query embeddings from the cache.
         
-        Args:
-            pdf_path: Path to the PDF file
-            
         Returns:
-            List of document chunks with metadata
+            Tuple: (matrix with cached rows filled, positions of each missing query text, missing texts)
         """
-        logger.info(f"Processing PDF: {pdf_path}")
+        embeddings = np.zeros((len(queries), self.dimension), dtype='float32')
+        missing: Dict[str, List[int]] = {}
+        for position, query in enumerate(queries):
+            cached = self.query_cache.get(query, self.embedding_deployment)
+            if cached is not None:
+                embeddings[position] = cached
+            else:
+                key = self.query_cache.make_key(query, self.embedding_deployment)
+                missing.setdefault(key, []).append(position)
         
-        # Copy PDF to raw_pdfs directory
-        raw_pdf_path = self._copy_pdf_to_raw(pdf_path)
+        positions = list(missing.values())
+        return embeddings, positions, [queries[group[0]] for group in positions]
+    
+    def _store_query_embeddings(self, embeddings: np.ndarray, positions: List[List[int]], texts: List[str], response) -> None:
+        """Copy one embeddings response into the matrix and the query embedding cache."""
+        for group, text, item in zip(positions, texts, response.data):
+            embedding = np.array(item.embedding, dtype='float32')
+            embeddings[group] = embedding
+            self.query_cache.put(text, self.embedding_deployment, embedding)
+    
+    def _get_embeddings_batch(self,
+                              texts: List[str],
+                              on_progress: Optional[Callable[[int], None]] = None) -> np.ndarray:
+        """
+        Get embeddings for a batch of texts using the concurrent Azure OpenAI embedder.
         
-        # Check if we already have processed this PDF
-        existing_index, existing_documents = self._load_pdf_data(raw_pdf_path)
-        if existing_index is not None:
-            logger.info(f"Using cached embeddings for {pdf_path}")
-            self.index = existing_index
-            self.documents = existing_documents
-            return self.documents
-        
-        # Load and parse PDF using LlamaIndex with optimized chunking
-        reader = SimpleDirectoryReader(input_files=[str(raw_pdf_path)])
-        documents = reader.load_data()
-        
-        # Use SentenceSplitter for better semantic chunking
-        parser = SentenceSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            separator="\n"
-        )
-        nodes = parser.get_nodes_from_documents(documents)
+        Raises if any batch still fails after retries; no placeholder vectors are returned.
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+        return run_sync(self.embedder.embed(texts, on_progress=on_progress))
+    
+    def _embed_chunks(self,
+                      chunks: List[str],
+                      progress: Optional[Callable[[str, int], None]] = None) -> np.ndarray:
+        """
+        Embed chunk texts, only sending chunks missing from the chunk embedding cache to Azure.
         
-        logger.info(f"Created {len(nodes)} chunks from the document")
+        Args:
+            chunks: Chunk texts
+            progress: Optional callback receiving ("reused", count) and ("embedded", count) as chunks become available
+            
+        Returns:
+            np.ndarray: float32 matrix of shape (len(chunks), dimension)
+        """
+        embeddings = np.zeros((len(chunks), self.dimension), dtype='float32')
         
-        # Extract text chunks
-        chunks = [node.text for node in nodes]
+        cached = self.chunk_cache.get_many(chunks, self.embedding_deployment)
+        for i, embedding in cached.items():
+            embeddings[i] = embedding
+        if progress:
+            progress("reused", len(cached))
+            progress("embedded", len(cached))
         
-        # Generate embeddings using Azure OpenAI
-        logger.info("Generating embeddings...")
-        embeddings = self._get_embeddings_batch(chunks)
+        missing = [i for i in range(len(chunks)) if i not in cached]
+        if missing:
+            # Identical chunks within one document are embedded once
+            missing_texts = list(dict.fromkeys(chunks[i] for i in missing))
+            logger.info(f"Generating embeddings for {len(missing_texts)} new chunks...")
+            on_progress = None
+            if progress:
+                # Progress is reported in unique texts; close enough for a status display
+                done = len(cached)
+                def _report(n_done: int) -> None:
+                    nonlocal done
+                    done += n_done
+                    progress("embedded", min(done, len(chunks)))
+                on_progress = _report
+            new_embeddings = self._get_embeddings_batch(missing_texts, on_progress=on_progress)
+            positions = {text: row for row, text in enumerate(missing_texts)}
+            embeddings[missing] = new_embeddings[[positions[chunks[i]] for i in missing]]
+            self.chunk_cache.put_many(missing_texts, self.embedding_deployment, new_embeddings)
+            if progress:
+                progress("embedded", len(chunks))
         
-        # Initialize or update FAISS index
-        self._initialize_index(len(embeddings))
+        self.last_ingest_stats = {
+            "chunks": len(chunks),
+            "reused": len(cached),
+            "embedded": len(missing)
+        }
+        logger.info(f"Chunk embeddings: {len(cached)} reused from cache, {len(missing)} newly embedded")
+        return embeddings
+    
+    def remove_pdf(self, pdf_path: str) -> int:
+        """
+        Remove a PDF's chunks from the corpus-wide index.
         
-        # Add to FAISS index
-        if isinstance(self.index, faiss.IndexIVFFlat) and not self.index.is_trained:
-            logger.info("Training FAISS index...")
-            self.index.train(embeddings)
+        Args:
+            pdf_path: Path to the PDF file
+            
+        Returns:
+            int: Number of chunks removed
+        """
+        source = str(self.raw_pdfs_dir / Path(pdf_path).name)
+        with self._ingest_lock:
+            return self.store.remove_document(source)
+    
+    def _load_cached_pdf(self, raw_pdf_path: Path) -> Optional[List[Dict]]:
+        """
+        Add a PDF to the index from its stored embeddings, if it has a store.
         
-        logger.info("Adding vectors to FAISS index...")
-        self.index.add(embeddings)
+        Returns:
+            Optional[List[Dict]]: The stored chunks, or None if the PDF still needs processing
+        """
+        existing_embeddings, existing_documents, term_freqs = self._load_pdf_data(raw_pdf_path)
+        if existing_embeddings is None:
+            return None
         
-        # Store documents with metadata
-        self.documents = [
+        logger.info(f"Using cached embeddings for {raw_pdf_path}")
+        self._apply_labels(raw_pdf_path, existing_documents)
+        self.store.add_document(str(raw_pdf_path), existing_documents, existing_embeddings, term_freqs)
+        return existing_documents
+    
+    def _index_chunks(self, raw_pdf_path: Path, chunks: List[str], embeddings: np.ndarray) -> List[Dict]:
+        """Save a PDF's chunks and embeddings and add them to the corpus-wide index."""
+        # Store documents with metadata; embeddings live only in the matrix
+        documents = [
             {
                 "text": chunk,
-                "embedding": embedding,
                 "metadata": {
                     "source": str(raw_pdf_path),
                     "chunk_id": i,
                     "chunk_size": len(chunk)
                 }
             }
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+            for i, chunk in enumerate(chunks)
         ]
+        self._apply_labels(raw_pdf_path, documents)
+        
+        # Save the data for this PDF; the index keeps the memory-mapped copy, not the in-RAM one
+        stored_embeddings = self._save_pdf_data(raw_pdf_path, embeddings, documents)
+        
+        # Add to the corpus-wide index, replacing any previous version of this PDF
+        self.store.add_document(str(raw_pdf_path), documents, stored_embeddings)
+        return documents
+    
+    def process_pdf(self,
+                    pdf_path: str,
+                    progress: Optional[Callable[[str, int], None]] = None,
+                    doc_set: Optional[str] = None,
+                    tags: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Process a PDF file, add its chunks to the corpus-wide index and return them.
+        
+        A previous version of the same PDF is replaced; every other PDF stays searchable.
+        The new chunks only become searchable once the whole PDF is indexed.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            progress: Optional callback receiving (stage, count) for the
+                "parsed", "chunked", "reused", "embedded" and "indexed" stages
+            doc_set: Document set to file the PDF under (keeps the recorded one if None)
+            tags: Tags to label the PDF with (keeps the recorded ones if None)
+            
+        Returns:
+            List of document chunks with metadata
+        """
+        logger.info(f"Processing PDF: {pdf_path}")
+        
+        with self._ingest_lock:
+            documents = self._ingest_pdf(pdf_path, progress, doc_set, tags)
+            # The live index now matches this PDF and its store on disk
+            self._disk_signature = self._read_disk_signature()
+            return documents
+    
+    def _ingest_pdf(self,
+                    pdf_path: str,
+                    progress: Optional[Callable[[str, int], None]],
+                    doc_set: Optional[str],
+                    tags: Optional[List[str]]) -> List[Dict]:
+        """Copy, label and process one PDF; the caller holds the ingest lock."""
+        # Copy PDF to raw_pdfs directory
+        raw_pdf_path = self._copy_pdf_to_raw(pdf_path)
+        
+        try:
+            if doc_set is not None or tags is not None:
+                labels = self.manifest.get_labels(str(raw_pdf_path))
+                self.manifest.set_labels(
+                    str(raw_pdf_path),
+                    labels["doc_set"] if doc_set is None else doc_set,
+                    labels["tags"] if tags is None else tags
+                )
+            return self._process_raw_pdf(raw_pdf_path, progress)
+        finally:
+            self.manifest.save()
+    
+    def _process_raw_pdf(self,
+                         raw_pdf_path: Path,
+                         progress: Optional[Callable[[str, int], None]] = None) -> List[Dict]:
+        """Load a PDF from its store, or parse, embed and index it."""
+        # Check if we already have processed this PDF
+        existing_documents = self._load_cached_pdf(raw_pdf_path)
+        if existing_documents is not None:
+            if progress:
+                for stage in ("chunked", "embedded", "indexed"):
+                    progress(stage, len(existing_documents))
+            return existing_documents
         
-        # Save the data for this PDF
-        self._save_pdf_data(raw_pdf_path, self.index, self.documents)
+        chunks, pages = chunk_pdf(str(raw_pdf_path), self.chunk_size, self.chunk_overlap)
+        if progress:
+            progress("parsed", pages)
+            progress("chunked", len(chunks))
         
-        logger.info(f"Successfully processed {len(chunks)} chunks from {pdf_path}")
-        return self.documents
+        # Generate embeddings, reusing any chunk we have embedded before
+        embeddings = self._embed_chunks(chunks, progress=progress)
+        
+        documents = self._index_chunks(raw_pdf_path, chunks, embeddings)
+        if progress:
+            progress("indexed", len(documents))
+        
+        logger.info(f"Successfully processed {len(chunks)} chunks from {raw_pdf_path}")
+        return documents
     
-    def search(self, query: str, k: int = 5) -> List[Dict]:
+    def search(self,
+               query: str,
+               k: int = 5,
+               mode: Optional[str] = None,
+               diversify: Optional[bool] = None,
+               filters: Optional[Dict[str, List[str]]] = None,
+               snapshot: Optional[IndexSnapshot] = None) -> List[Dict]:
         """
-        Search for similar documents using FAISS and Azure OpenAI embeddings.
+        Search for similar documents using FAISS and Azure OpenAI embeddings, BM25, or both.
         
         Args:
             query: Search query
             k: Number of results to return
+            mode: "dense", "sparse" or "hybrid" (defaults to RETRIEVAL_MODE)
+            diversify: Over-fetch, pick a diverse top-k with MMR and merge neighbouring
+                chunks into passages (defaults to MMR_DIVERSIFY)
+            filters: Restrict results by metadata: {"sources": [...], "doc_sets": [...], "tags": [...]};
+                values are OR-ed within a key and keys are AND-ed
+            snapshot: Index version to search (defaults to the current one)
             
         Returns:
             List of similar documents with scores
         """
-        if not self.documents:
-            return []
+        return self.search_many([query], k=k, mode=mode, diversify=diversify, filters=filters, snapshot=snapshot)[0]
+    
+    def search_many(self,
+                    queries: List[str],
+                    k: int = 5,
+                    mode: Optional[str] = None,
+                    diversify: Optional[bool] = None,
+                    filters: Optional[Dict[str, List[str]]] = None,
+                    snapshot: Optional[IndexSnapshot] = None,
+                    query_embeddings: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Search for many queries at once.
+        
+        All queries are embedded in as few requests as possible and searched with a
+        single batched FAISS call; each result list is the same as search() would
+        return for that query.
+        
+        Args:
+            queries: Search queries
+            k: Number of results to return per query
+            mode: "dense", "sparse" or "hybrid" (defaults to RETRIEVAL_MODE)
+            diversify: See search()
+            filters: See search()
+            snapshot: See search()
+            query_embeddings: Embeddings of the queries if already computed
             
-        # Generate query embedding using Azure OpenAI
-        query_embedding = self._get_embedding(query)
+        Returns:
+            List[List[Dict]]: One result list per query, in query order
+        """
+        # Every step of the request reads the same index version, even if a new one is published meanwhile
+        snapshot = snapshot or self.store.snapshot()
+        if not len(snapshot) or not queries:
+            return [[] for _ in queries]
         
-        # Search in FAISS index
-        distances, indices = self.index.search(
-            query_embedding.reshape(1, -1).astype('float32'),
-            k
-        )
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        diversify = self.mmr_diversify if diversify is None else diversify
         
-        # Return results
+        depth = k * self.mmr_fetch_factor if diversify else k
         results = []
-        for idx, distance in zip(indices[0], distances[0]):
-            if idx < len(self.documents):
-                results.append({
-                    "text": self.documents[idx]["text"],
-                    "score": float(1 - distance),  # Convert distance to similarity score
-                    "metadata": self.documents[idx]["metadata"]
-                })
+        for hits, query_embedding in self._retrieve_many(snapshot, queries, depth, mode, filters, query_embeddings):
+            if diversify:
+                hits = self._diversify(snapshot, hits, k, query_embedding)
+            results.append(hits)
+        return results
+    
+    async def asearch(self,
+                      query: str,
+                      k: int = 5,
+                      mode: Optional[str] = None,
+                      diversify: Optional[bool] = None,
+                      filters: Optional[Dict[str, List[str]]] = None,
+                      snapshot: Optional[IndexSnapshot] = None) -> List[Dict]:
+        """Async search(): see search() for the arguments."""
+        return (await self.asearch_many([query], k=k, mode=mode, diversify=diversify,
+                                        filters=filters, snapshot=snapshot))[0]
+    
+    async def asearch_many(self,
+                           queries: List[str],
+                           k: int = 5,
+                           mode: Optional[str] = None,
+                           diversify: Optional[bool] = None,
+                           filters: Optional[Dict[str, List[str]]] = None,
+                           snapshot: Optional[IndexSnapshot] = None) -> List[List[Dict]]:
+        """
+        Async search_many(): queries are embedded on the shared connection pool and the
+        index is searched on a worker thread, so the event loop is never blocked.
+        """
+        snapshot = snapshot or self.store.snapshot()
+        mode = mode or self.retrieval_mode
+        query_embeddings = None
+        if mode != "sparse" and len(snapshot) and queries:
+            query_embeddings = await self._aget_query_embeddings(queries)
+        return await asyncio.to_thread(self.search_many, queries, k, mode, diversify, filters, snapshot, query_embeddings)
+    
+    def _retrieve_many(self,
+                       snapshot: IndexSnapshot,
+                       queries: List[str],
+                       k: int,
+                       mode: str,
+                       filters: Optional[Dict[str, List[str]]] = None,
+                       query_embeddings: Optional[np.ndarray] = None) -> List[Tuple[List[Dict], Optional[np.ndarray]]]:
+        """
+        Run the retriever(s) for a batch of queries.
+        
+        Returns:
+            List of (hits best first, query embedding or None in sparse mode), one per query
+        """
+        if mode == "sparse":
+            return [
+                ([self._format_hit(vector_id, chunk, score, sparse_score=score)
+                  for vector_id, chunk, score in snapshot.search_sparse(query, k, filters)], None)
+                for query in queries
+            ]
         
+        if mode == "dense":
+            # Generate query embeddings using Azure OpenAI (or the query embedding cache)
+            if query_embeddings is None:
+                query_embeddings = self._get_query_embeddings(queries)
+            # A zero vector would match arbitrary chunks: queries that could not be embedded get no results
+            failed = _embedding_failed(query_embeddings)
+            return [
+                ([] if query_failed else
+                 [self._format_hit(vector_id, chunk, score, dense_score=score)
+                  for vector_id, chunk, score in dense_hits], query_embedding)
+                for dense_hits, query_embedding, query_failed
+                in zip(snapshot.search_many(query_embeddings, k, filters), query_embeddings, failed)
+            ]
+        
+        # Hybrid: BM25 runs on worker threads while the queries are embedded, then fuse with RRF
+        depth = max(k * self.hybrid_depth_factor, k)
+        sparse_futures = [self._search_executor.submit(snapshot.search_sparse, query, depth, filters) for query in queries]
+        if query_embeddings is None:
+            query_embeddings = self._get_query_embeddings(queries)
+        all_dense_hits = snapshot.search_many(query_embeddings, depth, filters)
+        failed = _embedding_failed(query_embeddings)
+        
+        results = []
+        for dense_hits, sparse_future, query_embedding, query_failed in zip(all_dense_hits, sparse_futures,
+                                                                            query_embeddings, failed):
+            sparse_hits = sparse_future.result()
+            if query_failed:
+                results.append(([], query_embedding))
+                continue
+            chunks = {vector_id: chunk for vector_id, chunk, _ in dense_hits + sparse_hits}
+            dense_scores = {vector_id: score for vector_id, _, score in dense_hits}
+            sparse_scores = {vector_id: score for vector_id, _, score in sparse_hits}
+            fused = reciprocal_rank_fusion([
+                [vector_id for vector_id, _, _ in dense_hits],
+                [vector_id for vector_id, _, _ in sparse_hits]
+            ])
+            
+            hits = [
+                self._format_hit(vector_id, chunks[vector_id], score,
+                                 dense_score=dense_scores.get(vector_id),
+                                 sparse_score=sparse_scores.get(vector_id))
+                for vector_id, score in fused[:k]
+            ]
+            results.append((hits, query_embedding))
         return results
+    
+    def _diversify(self,
+                   snapshot: IndexSnapshot,
+                   hits: List[Dict],
+                   k: int,
+                   query_embedding: Optional[np.ndarray]) -> List[Dict]:
+        """Select a diverse top-k with MMR over the stored embeddings, then merge neighbouring chunks."""
+        if len(hits) > k:
+            vectors = snapshot.get_vectors([hit["id"] for hit in hits])
+            if query_embedding is not None:
+                relevance = vectors @ normalize(query_embedding)[0]
+            else:
+                # No query vector in sparse mode: use the retriever's scores scaled to [0, 1]
+                scores = np.array([hit["score"] for hit in hits], dtype='float32')
+                relevance = scores / max(float(scores.max()), 1e-9)
+            selected = mmr_select(relevance, vectors, k, self.mmr_lambda)
+            # Keep the retriever's ranking among the selected hits
+            hits = [hits[i] for i in sorted(selected)]
+        return merge_adjacent(hits, max_overlap=self.chunk_size * 4)
+    
+    @staticmethod
+    def _format_hit(vector_id: int,
+                    chunk: Dict,
+                    score: float,
+                    dense_score: Optional[float] = None,
+                    sparse_score: Optional[float] = None) -> Dict:
+        """Shape a search hit for callers; score is cosine, BM25 or RRF depending on the mode."""
+        return {
+            "id": vector_id,
+            "ids": [vector_id],
+            "text": chunk["text"],
+            "score": score,
+            "dense_score": dense_score,
+            "sparse_score": sparse_score,
+            "metadata": chunk["metadata"]
+        }
 
 def main():
     """Run the PDF processor independently."""
@@ -0,0 +1,232 @@
+from typing import Dict, List, Optional, Tuple, Union
+import logging
+from tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_INSTRUCTIONS = "You are a helpful AI assistant. Use the following context to answer the user's question."
+
+TABLE_KEYWORDS = ["compare", "differences", "versus", "vs", "table", "format as table"]
+
+TABLE_INSTRUCTIONS = """
+When formatting tables, follow these rules:
+1. Use proper Markdown table syntax with headers and alignment
+2. Include a clear title for the table using ### or #### heading
+3. Ensure all columns are properly aligned using :---: for center, :--- for left, ---: for right
+4. Use consistent formatting for similar data
+5. Add brief explanations if needed
+6. Format the table like this:
+
+### Table Title
+| Header 1 | Header 2 | Header 3 |
+|:--------:|:---------|---------:|
+| Data 1   | Data 2   | Data 3   |
+| Data 4   | Data 5   | Data 6   |
+
+For document comparisons, use this format:
+
+### Document Comparison
+📄 Document 1 Name
+| Aspect | Details |
+|:-------|:--------|
+| Point 1 | Info 1  |
+| Point 2 | Info 2  |
+
+📄 Document 2 Name
+| Aspect | Details |
+|:-------|:--------|
+| Point 1 | Info 1  |
+| Point 2 | Info 2  |
+
+Always ensure tables are properly aligned and formatted for readability.
+"""
+
+# Tokens the chat format adds per message, and once to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class PromptBuilder:
+    def __init__(self,
+                 max_tokens: int = 6000,
+                 history_tokens: int = 1000,
+                 recent_messages: int = 3,
+                 min_chunk_tokens: int = 100):
+        """
+        Assemble chat prompts within a fixed token budget.
+
+        The budget is spent in order on the instructions and the question, then on
+        history (newest first, up to history_tokens), and whatever is left on the
+        retrieved chunks in rank order. Duplicate chunks are dropped first; the chunk
+        that does not fit is truncated if at least min_chunk_tokens of it fit, and
+        every lower-ranked chunk is dropped.
+
+        Args:
+            max_tokens: Budget of the whole prompt
+            history_tokens: Budget of conversation memory and recent chat messages
+            recent_messages: Number of client chat messages considered
+            min_chunk_tokens: Smallest useful piece of a truncated chunk
+        """
+        self.max_tokens = max_tokens
+        self.history_tokens = history_tokens
+        self.recent_messages = recent_messages
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def build(self,
+              query: str,
+              context: List[Dict],
+              conversation_history: Optional[Union[str, List[Dict]]] = None,
+              chat_history: Optional[List[Dict]] = None) -> Tuple[List[Dict], Dict]:
+        """
+        Build the messages for a query.
+
+        Args:
+            query: User query
+            context: Retrieved chunks, best first
+            conversation_history: Session memory as turns ({"query", "response"}) or preformatted text
+            chat_history: Chat messages sent by the client ({"role", "text"})
+
+        Returns:
+            Tuple[List[Dict], Dict]: Messages for the chat completions API, and token counts
+                per part of the prompt with the number of chunks used, truncated and dropped
+        """
+        instructions = SYSTEM_INSTRUCTIONS
+        query_lower = query.lower()
+        table_instructions = TABLE_INSTRUCTIONS if any(keyword in query_lower for keyword in TABLE_KEYWORDS) else ""
+
+        instruction_tokens = (count_tokens(instructions) + count_tokens(table_instructions)
+                              + 2 * MESSAGE_OVERHEAD_TOKENS + REPLY_OVERHEAD_TOKENS)
+        query_tokens = count_tokens(query)
+        remaining = max(0, self.max_tokens - instruction_tokens - query_tokens)
+
+        memory_text, recent_text, history_tokens = self._fit_history(
+            query, conversation_history, chat_history, min(self.history_tokens, remaining)
+        )
+        remaining -= history_tokens
+
+        context_text, context_stats = self._fit_context(context, remaining)
+
+        system_message = instructions
+        if memory_text:
+            system_message += f"\n\n{memory_text}"
+        if recent_text:
+            system_message += f"\n\nRecent conversation:\n{recent_text}"
+        if context_text:
+            system_message += f"\n\nRelevant context:\n{context_text}"
+        system_message += table_instructions
+
+        counts = {
+            "instructions": instruction_tokens,
+            "query": query_tokens,
+            "history": history_tokens,
+            "context": context_stats.pop("tokens"),
+            **context_stats
+        }
+        counts["total"] = counts["instructions"] + counts["query"] + counts["history"] + counts["context"]
+        counts["budget"] = self.max_tokens
+        logger.debug(f"Prompt tokens: {counts}")
+
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": query}
+        ], counts
+
+    def _fit_history(self,
+                     query: str,
+                     conversation_history: Optional[Union[str, List[Dict]]],
+                     chat_history: Optional[List[Dict]],
+                     budget: int) -> Tuple[str, str, int]:
+        """Keep the newest history that fits the budget: recent chat messages first, then session memory."""
+        turns = conversation_history or []
+        if isinstance(turns, str):
+            turns = []
+            memory_block = truncate_tokens(conversation_history, budget)
+            budget -= count_tokens(memory_block)
+        else:
+            memory_block = ""
+
+        # The client's messages usually repeat the current question and answers already in memory
+        seen = {_normalize(query)}
+        for turn in turns:
+            seen.add(_normalize(turn["query"]))
+            seen.add(_normalize(turn["response"]))
+
+        used = count_tokens(memory_block)
+        recent_lines = []
+        for msg in reversed((chat_history or [])[-self.recent_messages:]):
+            text = msg.get('text', '')
+            if not text or _normalize(text) in seen:
+                continue
+            line = f"{msg.get('role', 'user').title()}: {text}\n"
+            tokens = count_tokens(line)
+            if tokens > budget:
+                break
+            recent_lines.insert(0, line)
+            budget -= tokens
+            used += tokens
+
+        kept_turns = []
+        for turn in reversed(turns):
+            entry = f"Q: {turn['query']}\n   A: {turn['response']}\n"
+            tokens = count_tokens(entry) + 2
+            if tokens > budget:
+                break
+            kept_turns.insert(0, entry)
+            budget -= tokens
+            used += tokens
+
+        if kept_turns:
+            memory_block = "Previous conversation:\n" + "".join(
+                f"{i}. {entry}" for i, entry in enumerate(kept_turns, 1)
+            )
+        return memory_block, "".join(recent_lines), used
+
+    def _fit_context(self, context: List[Dict], budget: int) -> Tuple[str, Dict]:
+        """Dedupe the chunks and keep the best-ranked ones that fit the budget."""
+        unique: List[str] = []
+        normalized: List[str] = []
+        for chunk in context:
+            text = chunk["text"].strip()
+            key = _normalize(text)
+            if not key or any(key in earlier for earlier in normalized):
+                continue
+            # A later, longer chunk can contain an earlier one; keep the earlier rank with the longer text
+            contained = [i for i, earlier in enumerate(normalized) if earlier in key]
+            if contained:
+                unique[contained[0]] = text
+                normalized[contained[0]] = key
+                for i in reversed(contained[1:]):
+                    del unique[i], normalized[i]
+                continue
+            unique.append(text)
+            normalized.append(key)
+
+        documents = []
+        used = 0
+        truncated = 0
+        for text in unique:
+            header = f"Document {len(documents) + 1}:\n"
+            separator = 2 if documents else 0
+            tokens = count_tokens(header) + count_tokens(text) + separator
+            if tokens <= budget - used:
+                documents.append(header + text)
+                used += tokens
+                continue
+            room = budget - used - count_tokens(header) - separator
+            if room >= self.min_chunk_tokens:
+                text = truncate_tokens(text, room)
+                documents.append(header + text)
+                used += count_tokens(header) + count_tokens(text) + separator
+                truncated = 1
+            break
+
+        return "\n\n".join(documents), {
+            "tokens": used,
+            "chunks_retrieved": len(context),
+            "chunks_deduplicated": len(context) - len(unique),
+            "chunks_used": len(documents),
+            "chunks_truncated": truncated,
+            "chunks_dropped": len(unique) - len(documents)
+        }
@@ -0,0 +1,274 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional
+import logging
+from admission import PRIORITY_INTERACTIVE, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+# Longest single sleep while waiting for quota, so waiters notice header updates and new arrivals
+MAX_POLL_SECONDS = 0.25
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """
+        Token bucket refilled continuously at a per-minute rate, holding at most one minute of quota.
+
+        Args:
+            per_minute: Quota per minute (tokens or requests)
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """Seconds until amount is available (after refill)."""
+        return max(0.0, (amount - self.available) / self.rate)
+
+    def sync(self, remaining: float, now: float) -> None:
+        """Adopt the server's view of the remaining quota."""
+        self.refill(now)
+        if remaining > self.capacity:
+            # The deployment's quota is larger than configured
+            self.capacity = remaining
+            self.rate = self.capacity / 60
+        self.available = remaining
+
+class QuotaScheduler:
+    def __init__(self,
+                 name: str,
+                 tokens_per_minute: int,
+                 requests_per_minute: int,
+                 bulk_reserve: float = 0.2,
+                 interactive_max_wait: float = 5.0):
+        """
+        Process-wide rate limiter sharing one deployment's quota between interactive and bulk calls.
+
+        Every call takes its estimated tokens and one request from two token buckets
+        refilled at the deployment's TPM and RPM. The x-ratelimit-remaining-tokens and
+        x-ratelimit-remaining-requests headers of each response reset the buckets to the
+        server's count, and a 429 empties them until its Retry-After has passed.
+
+        Interactive calls have strict priority: they run whenever the quota allows, and
+        bulk calls wait while any interactive call is waiting. Bulk calls also leave
+        bulk_reserve of each bucket untouched, so a query arriving during a large ingest
+        run finds quota available. Interactive calls wait at most interactive_max_wait
+        seconds and are then sent anyway, letting the server decide.
+
+        Thread-safe, and usable from any event loop or from sync code.
+
+        Args:
+            name: Label used in logs and stats (e.g. the deployment name)
+            tokens_per_minute: Deployment's token quota (TPM)
+            requests_per_minute: Deployment's request quota (RPM)
+            bulk_reserve: Fraction of each bucket that bulk calls may not use
+            interactive_max_wait: Seconds an interactive call waits for quota at most
+        """
+        self.name = name
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.bulk_reserve = bulk_reserve
+        self.interactive_max_wait = interactive_max_wait
+        self.paused_until = 0.0
+
+        self._lock = threading.Lock()
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._granted = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._wait_seconds = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BATCH: 0.0}
+        self.overdrafts = 0
+        self.throttles = 0
+        self.last_headers: Dict[str, Optional[float]] = {"remaining_tokens": None, "remaining_requests": None}
+
+    @classmethod
+    def from_env(cls, name: str) -> "QuotaScheduler":
+        """
+        Scheduler configured by EMBEDDING_TPM, EMBEDDING_RPM, EMBEDDING_BULK_RESERVE
+        and EMBEDDING_INTERACTIVE_MAX_WAIT.
+        """
+        return cls(
+            name,
+            tokens_per_minute=int(os.getenv("EMBEDDING_TPM", "240000")),
+            requests_per_minute=int(os.getenv("EMBEDDING_RPM", "1440")),
+            bulk_reserve=float(os.getenv("EMBEDDING_BULK_RESERVE", "0.2")),
+            interactive_max_wait=float(os.getenv("EMBEDDING_INTERACTIVE_MAX_WAIT", "5"))
+        )
+
+    def _try_acquire(self, tokens: int, priority: int, now: float) -> float:
+        """Take the quota if allowed; otherwise return the seconds to wait before trying again."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens.refill(now)
+        self.requests.refill(now)
+
+        # A call larger than the bucket would never fit; let it through on a full bucket
+        tokens = min(tokens, self.tokens.capacity)
+        if priority == PRIORITY_INTERACTIVE:
+            reserve_tokens = reserve_requests = 0.0
+        else:
+            if self._waiting[PRIORITY_INTERACTIVE]:
+                return MAX_POLL_SECONDS
+            tokens = min(tokens, self.tokens.capacity * (1 - self.bulk_reserve))
+            reserve_tokens = self.tokens.capacity * self.bulk_reserve
+            reserve_requests = self.requests.capacity * self.bulk_reserve
+
+        wait = max(self.tokens.seconds_until(tokens + reserve_tokens),
+                   self.requests.seconds_until(1 + reserve_requests))
+        if wait > 0:
+            return wait
+        self.tokens.available -= tokens
+        self.requests.available -= 1
+        return 0.0
+
+    def _grant(self, tokens: int, now: float) -> None:
+        """Take the quota unconditionally (an interactive call that waited long enough)."""
+        self.tokens.refill(now)
+        self.requests.refill(now)
+        self.tokens.available -= min(tokens, self.tokens.capacity)
+        self.requests.available -= 1
+        self.overdrafts += 1
+
+    def _start_wait(self, tokens: int, priority: int) -> float:
+        """Try once, registering as a waiter if the quota is not available; returns the wait."""
+        with self._lock:
+            wait = self._try_acquire(tokens, priority, time.monotonic())
+            if wait == 0:
+                self._granted[priority] += 1
+            else:
+                self._waiting[priority] += 1
+            return wait
+
+    def _retry(self, tokens: int, priority: int, waited: float) -> float:
+        """Try again as a registered waiter; returns 0 once granted."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._try_acquire(tokens, priority, now)
+            if wait > 0 and priority == PRIORITY_INTERACTIVE and waited >= self.interactive_max_wait \
+                    and now >= self.paused_until:
+                logger.warning(f"No {self.name} quota left after {waited:.1f}s, sending interactive call anyway")
+                self._grant(tokens, now)
+                wait = 0.0
+            if wait == 0:
+                self._waiting[priority] -= 1
+                self._granted[priority] += 1
+                self._wait_seconds[priority] += waited
+            return wait
+
+    def _cancel_wait(self, priority: int) -> None:
+        with self._lock:
+            self._waiting[priority] -= 1
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Wait until a call of the given size may be sent.
+
+        Args:
+            tokens: Estimated tokens of the call
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        wait = self._start_wait(tokens, priority)
+        if wait == 0:
+            return 0.0
+        started = time.perf_counter()
+        try:
+            while wait > 0:
+                await asyncio.sleep(min(wait, MAX_POLL_SECONDS))
+                wait = self._retry(tokens, priority, time.perf_counter() - started)
+        except BaseException:
+            if wait > 0:
+                self._cancel_wait(priority)
+            raise
+        return time.perf_counter() - started
+
+    def acquire_sync(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Blocking acquire() for sync callers."""
+        wait = self._start_wait(tokens, priority)
+        if wait == 0:
+            return 0.0
+        started = time.perf_counter()
+        try:
+            while wait > 0:
+                time.sleep(min(wait, MAX_POLL_SECONDS))
+                wait = self._retry(tokens, priority, time.perf_counter() - started)
+        except BaseException:
+            if wait > 0:
+                self._cancel_wait(priority)
+            raise
+        return time.perf_counter() - started
+
+    def record_headers(self, headers) -> None:
+        """Align the buckets with the x-ratelimit-remaining-* headers of a response."""
+        updates = {}
+        for key, header in (("remaining_tokens", "x-ratelimit-remaining-tokens"),
+                            ("remaining_requests", "x-ratelimit-remaining-requests")):
+            value = headers.get(header) if headers is not None else None
+            try:
+                if value is not None:
+                    updates[key] = float(value)
+            except ValueError:
+                continue
+        if not updates:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self.last_headers.update(updates)
+            if "remaining_tokens" in updates:
+                self.tokens.sync(updates["remaining_tokens"], now)
+            if "remaining_requests" in updates:
+                self.requests.sync(updates["remaining_requests"], now)
+
+    def record_throttle(self, retry_after: Optional[float]) -> None:
+        """Pause every call after a 429 until the server's Retry-After has passed."""
+        with self._lock:
+            now = time.monotonic()
+            self.throttles += 1
+            pause = retry_after if retry_after is not None else 1.0
+            self.paused_until = max(self.paused_until, now + pause)
+            self.tokens.refill(now)
+            self.requests.refill(now)
+            self.tokens.available = min(self.tokens.available, 0.0)
+            self.requests.available = min(self.requests.available, 0.0)
+        logger.warning(f"{self.name} throttled, pausing calls for {pause:g}s")
+
+    def stats(self) -> Dict:
+        """Current token and request budgets, waiting calls and grant counters."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens.refill(now)
+            self.requests.refill(now)
+            names = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "bulk"}
+            return {
+                "name": self.name,
+                "tokens": {
+                    "available": int(self.tokens.available),
+                    "per_minute": int(self.tokens.capacity),
+                    "bulk_reserve": int(self.tokens.capacity * self.bulk_reserve)
+                },
+                "requests": {
+                    "available": int(self.requests.available),
+                    "per_minute": int(self.requests.capacity),
+                    "bulk_reserve": int(self.requests.capacity * self.bulk_reserve)
+                },
+                "paused_seconds": round(max(0.0, self.paused_until - now), 1),
+                "last_headers": dict(self.last_headers),
+                "throttles": self.throttles,
+                "overdrafts": self.overdrafts,
+                "calls": {
+                    names[priority]: {
+                        "waiting": self._waiting[priority],
+                        "granted": self._granted[priority],
+                        "wait_seconds": round(self._wait_seconds[priority], 2)
+                    }
+                    for priority in names
+                }
+            }
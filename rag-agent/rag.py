@@ -1,10 +1,14 @@
 import os
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import logging
 from pdf_processor import PDFProcessor
 from llm import LLMHandler
+from answer_cache import SemanticAnswerCache
+from conversation_store import ConversationStore, InMemoryConversationStore, SQLiteConversationStore, DEFAULT_SESSION
+from chat_pipeline import ChatPipeline
+from latency import LatencyTracker
+from vector_store import IndexSnapshot
 from pathlib import Path
-from collections import deque
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,14 +20,16 @@ class RAGSystem:
     def __init__(self, 
                  pdf_processor: PDFProcessor,
                  llm_handler: LLMHandler,
-                 memory_size: int = 7):
+                 memory_size: int = 7,
+                 conversation_store: Optional[ConversationStore] = None):
         """
         Initialize the RAG system.
         
         Args:
             pdf_processor: Initialized PDFProcessor instance
             llm_handler: Initialized LLMHandler instance
-            memory_size: Number of previous questions to keep in memory
+            memory_size: Number of previous questions to keep in memory per session
+            conversation_store: Store for per-session memory (configured from the environment if not provided)
         """
         if not isinstance(pdf_processor, PDFProcessor):
             raise TypeError("pdf_processor must be an instance of PDFProcessor")
@@ -34,35 +40,74 @@ class RAGSystem:
         self.llm_handler = llm_handler
         self.documents_processed = False
         self.memory_size = memory_size
-        self.conversation_memory = deque(maxlen=memory_size)
+        
+        # Conversation memory per chat session; the SQLite backend is shared by all workers on a host
+        if conversation_store is None:
+            limits = {
+                "max_turns": memory_size,
+                "session_tokens": int(os.getenv("CONVERSATION_SESSION_TOKENS", "2000")),
+                "ttl_seconds": float(os.getenv("CONVERSATION_TTL", "3600")),
+                "max_sessions": int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000")),
+                "max_total_tokens": int(os.getenv("CONVERSATION_MAX_TOKENS", "2000000"))
+            }
+            if os.getenv("CONVERSATION_STORE", "memory").lower() == "sqlite":
+                db_path = os.getenv("CONVERSATION_DB_PATH",
+                                    str(Path(pdf_processor.data_dir) / "conversations.db"))
+                conversation_store = SQLiteConversationStore(db_path, **limits)
+            else:
+                conversation_store = InMemoryConversationStore(**limits)
+        self.conversation_store = conversation_store
+        
+        # Time to first token and total time of chat requests
+        self.latency = LatencyTracker()
+        
+        # Answers reused for paraphrased questions that retrieve the same chunks
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true":
+            self.answer_cache = SemanticAnswerCache(
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+                max_size=int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+            )
         logger.info(f"RAG system initialized successfully with memory size {memory_size}")
     
-    def add_to_memory(self, query: str, response: str) -> None:
+    def add_to_memory(self, query: str, response: str, session_id: str = DEFAULT_SESSION) -> None:
         """
-        Add a question-answer pair to the conversation memory.
+        Add a question-answer pair to a session's conversation memory.
         
         Args:
             query: User's question
             response: System's response
+            session_id: Chat session the pair belongs to
+        """
+        self.conversation_store.append(session_id, query, response)
+        logger.debug(f"Added to memory of session {session_id}")
+    
+    def get_memory(self, session_id: str = DEFAULT_SESSION) -> List[Dict]:
+        """
+        Get a session's conversation memory as question-answer turns, oldest first.
+        
+        Args:
+            session_id: Chat session to read
         """
-        self.conversation_memory.append({
-            "query": query,
-            "response": response
-        })
-        logger.debug(f"Added to memory. Current memory size: {len(self.conversation_memory)}")
+        return self.conversation_store.get(session_id)
     
-    def get_memory_context(self) -> str:
+    def get_memory_context(self, session_id: str = DEFAULT_SESSION) -> str:
         """
-        Get the conversation memory as a formatted string for context.
+        Get a session's conversation memory as a formatted string for context.
         
+        Args:
+            session_id: Chat session to read
+            
         Returns:
             str: Formatted conversation history
         """
-        if not self.conversation_memory:
+        turns = self.conversation_store.get(session_id)
+        if not turns:
             return ""
             
         context = "Previous conversation:\n"
-        for i, memory in enumerate(self.conversation_memory, 1):
+        for i, memory in enumerate(turns, 1):
             context += f"{i}. Q: {memory['query']}\n   A: {memory['response']}\n"
         return context
     
@@ -84,6 +129,41 @@ class RAGSystem:
             self.documents_processed = False
             return False
     
+    def reload_documents(self) -> Dict:
+        """
+        Rebuild the index from the PDFs and stores on disk and swap it in without downtime.
+        
+        Returns:
+            Dict: Summary of the new index version
+        """
+        info = self.pdf_processor.reload()
+        self._on_reload(info)
+        return info
+    
+    def watch_documents(self, interval: float) -> None:
+        """Reload automatically whenever PDFs or stores change on disk, checking every interval seconds."""
+        self.pdf_processor.start_watcher(interval, on_reload=self._on_reload)
+    
+    def _on_reload(self, info: Dict) -> None:
+        self.documents_processed = info["chunks"] > 0
+    
+    def ingest_document(self, pdf_path: str, progress: Optional[Callable[[str, int], None]] = None) -> List[Dict]:
+        """
+        Process a single PDF and update the document store, raising on failure.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            progress: Optional callback receiving (stage, count) ingestion progress
+            
+        Returns:
+            List[Dict]: The document's chunks
+        """
+        logger.info(f"Processing document: {pdf_path}")
+        documents = self.pdf_processor.process_pdf(pdf_path, progress=progress)
+        self.documents_processed = True
+        logger.info(f"Document processed and document store updated: {pdf_path}")
+        return documents
+    
     def process_document(self, pdf_path: str) -> bool:
         """
         Process a single PDF and update the document store.
@@ -94,23 +174,26 @@ class RAGSystem:
         Returns:
             bool: True if document was processed successfully
         """
-        logger.info(f"Processing document: {pdf_path}")
         try:
-            self.pdf_processor.process_pdf(pdf_path)
-            self.documents_processed = True
-            logger.info(f"Document processed and document store updated: {pdf_path}")
+            self.ingest_document(pdf_path)
             return True
         except Exception as e:
             logger.error(f"Error processing document {pdf_path}: {str(e)}")
             return False
     
-    def query(self, query: str, k: int = 5) -> Optional[List[Dict]]:
+    def query(self,
+              query: str,
+              k: int = 5,
+              filters: Optional[Dict[str, List[str]]] = None,
+              snapshot: Optional[IndexSnapshot] = None) -> Optional[List[Dict]]:
         """
         Query the RAG system.
         
         Args:
             query: User query
             k: Number of context chunks to retrieve
+            filters: Restrict retrieval by metadata: {"sources": [...], "doc_sets": [...], "tags": [...]}
+            snapshot: Index version to search (defaults to the current one)
             
         Returns:
             Optional[List[Dict]]: List of relevant document chunks with scores, or None if error
@@ -125,7 +208,7 @@ class RAGSystem:
         
         try:
             # Retrieve relevant context
-            context = self.pdf_processor.search(query, k=k)
+            context = self.pdf_processor.search(query, k=k, filters=filters, snapshot=snapshot)
             
             if not context:
                 logger.info("No relevant context found for query")
@@ -137,47 +220,99 @@ class RAGSystem:
             logger.error(f"Error querying RAG system: {str(e)}")
             return None
 
-    def generate_response(self, query: str, history: List[Dict] = None) -> Dict:
+    async def aquery(self,
+                     query: str,
+                     k: int = 5,
+                     filters: Optional[Dict[str, List[str]]] = None,
+                     snapshot: Optional[IndexSnapshot] = None) -> Optional[List[Dict]]:
         """
-        Generate a response using the LLM handler.
-        
-        Args:
-            query: User query
-            history: Chat history for context
-            
-        Returns:
-            Dict: Response containing text and optional audio
+        Async query() for request handlers: the query is embedded on the shared connection
+        pool and the index searched on a worker thread. See query() for the arguments.
         """
+        if not query or not isinstance(query, str):
+            logger.error("Invalid query: must be a non-empty string")
+            return None
+            
+        if not self.documents_processed:
+            logger.warning("No documents have been processed yet")
+            return None
+        
         try:
-            # First, try to get context from the RAG system
-            context = self.query(query, k=5)
+            context = await self.pdf_processor.asearch(query, k=k, filters=filters, snapshot=snapshot)
             
-            # If no context found, use empty context
             if not context:
-                context = []
+                logger.info("No relevant context found for query")
+                return None
+                
+            return context
             
-            # Get conversation memory context
-            memory_context = self.get_memory_context()
+        except Exception as e:
+            logger.error(f"Error querying RAG system: {str(e)}")
+            return None
+
+    def query_many(self,
+                   queries: List[str],
+                   k: int = 5,
+                   filters: Optional[Dict[str, List[str]]] = None) -> List[List[Dict]]:
+        """
+        Query the RAG system with many queries at once (evaluation, warm-up, offline tools).
+        
+        Args:
+            queries: User queries
+            k: Number of context chunks to retrieve per query
+            filters: See query()
             
-            # Generate response with memory context and RAG context
-            response = self.llm_handler.generate_response(
-                query, 
-                context, 
-                conversation_history=memory_context,
-                chat_history=history
-            )
+        Returns:
+            List[List[Dict]]: Relevant document chunks with scores for each query, in query order
+        """
+        if not queries:
+            return []
+        if any(not query or not isinstance(query, str) for query in queries):
+            raise ValueError("Invalid query: every query must be a non-empty string")
             
-            # Add to memory if response was successful
-            if response and response.get("responses"):
-                self.add_to_memory(query, response["responses"][0])
+        if not self.documents_processed:
+            logger.warning("No documents have been processed yet")
+            return [[] for _ in queries]
+        
+        return self.pdf_processor.search_many(queries, k=k, filters=filters)
+
+    def generate_response(self,
+                          query: str,
+                          history: List[Dict] = None,
+                          filters: Optional[Dict[str, List[str]]] = None,
+                          session_id: str = DEFAULT_SESSION) -> Dict:
+        """
+        Generate a response using the LLM handler.
+        
+        Args:
+            query: User query
+            history: Chat history for context
+            filters: See query()
+            session_id: Chat session whose conversation memory is used and updated
             
-            return response
-        except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
-            return {
-                "responses": ["I apologize, but I encountered an error while generating the response. Please try again."],
-                "audio": None
-            }
+        Returns:
+            Dict: Response containing text, optional audio, and whether it came from the answer cache
+        """
+        return self.create_pipeline(query, history, filters, session_id=session_id).run()
+    
+    def create_pipeline(self,
+                        query: str,
+                        history: List[Dict] = None,
+                        filters: Optional[Dict[str, List[str]]] = None,
+                        require_context: bool = False,
+                        session_id: str = DEFAULT_SESSION) -> ChatPipeline:
+        """
+        Create the request-scoped pipeline for one chat message; call run() on it.
+        
+        Args:
+            query: User query
+            history: Chat history for context
+            filters: See query()
+            require_context: Reply with a fixed message instead of calling the LLM when nothing is retrieved
+            session_id: Chat session whose conversation memory is used and updated
+        """
+        return ChatPipeline(self, query, history=history, filters=filters,
+                            require_context=require_context, session_id=session_id)
 
 def main():
     """Run the RAG system independently."""
@@ -209,12 +344,8 @@ def main():
             
             print("\nGenerating response...")
             try:
-                context = rag.query(query)
-                if context:
-                    response = rag.generate_response(query, context)
-                    print("\nResponse:", response["responses"][0])
-                else:
-                    print("\nNo relevant information found in the documents.")
+                response = rag.create_pipeline(query, require_context=True).run()
+                print("\nResponse:", response["responses"][0])
             except Exception as e:
                 logger.error(f"Error generating response: {str(e)}")
                 print("\nAn error occurred while generating the response.")
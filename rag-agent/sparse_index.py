@@ -0,0 +1,192 @@
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and codes such as "4.2.1", "HR-101" or "ISO/IEC" stay single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+what which who how when where do does i you we our your can
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into BM25 terms."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def term_frequencies(text: str) -> Dict[str, int]:
+    """Term -> count for one chunk."""
+    return dict(Counter(tokenize(text)))
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, compact_ratio: float = 0.2):
+        """
+        Incrementally updatable BM25 inverted index over vector IDs.
+
+        Postings are kept per term in two flat arrays (int64 IDs, uint32 term counts),
+        about 12 bytes per posting. Removal marks IDs as deleted; postings are
+        compacted once deleted IDs exceed compact_ratio of all indexed IDs. Copies
+        share posting arrays until a term is first modified.
+
+        Args:
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+            compact_ratio: Fraction of deleted IDs that triggers compaction
+        """
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+
+        self._posting_ids: Dict[str, array] = {}
+        self._posting_tfs: Dict[str, array] = {}
+        # Document length per vector ID (0 = not indexed)
+        self._doc_len = np.zeros(0, dtype='uint32')
+        self._n_docs = 0
+        self._total_len = 0
+        self._removed: set = set()
+        # Terms whose posting arrays belong to this index alone (the rest are shared with a copy)
+        self._owned: set = set()
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def copy(self) -> "BM25Index":
+        """Copy that can be modified without affecting this index."""
+        other = BM25Index(self.k1, self.b, self.compact_ratio)
+        other._posting_ids = dict(self._posting_ids)
+        other._posting_tfs = dict(self._posting_tfs)
+        other._doc_len = self._doc_len.copy()
+        other._n_docs = self._n_docs
+        other._total_len = self._total_len
+        other._removed = set(self._removed)
+        return other
+
+    def add(self, ids: List[int], term_freqs: List[Dict[str, int]]) -> None:
+        """Index chunks by vector ID."""
+        if not ids:
+            return
+        max_id = max(ids)
+        if max_id >= len(self._doc_len):
+            grown = np.zeros(max(max_id + 1, 2 * len(self._doc_len)), dtype='uint32')
+            grown[:len(self._doc_len)] = self._doc_len
+            self._doc_len = grown
+
+        for vector_id, freqs in zip(ids, term_freqs):
+            length = sum(freqs.values())
+            self._doc_len[vector_id] = max(length, 1)
+            self._total_len += max(length, 1)
+            self._n_docs += 1
+            self._removed.discard(vector_id)
+            for term, tf in freqs.items():
+                if term not in self._owned:
+                    self._posting_ids[term] = array('q', self._posting_ids.get(term, ()))
+                    self._posting_tfs[term] = array('I', self._posting_tfs.get(term, ()))
+                    self._owned.add(term)
+                self._posting_ids[term].append(vector_id)
+                self._posting_tfs[term].append(tf)
+
+    def remove(self, ids: List[int]) -> None:
+        """Remove chunks by vector ID."""
+        for vector_id in ids:
+            if vector_id < len(self._doc_len) and self._doc_len[vector_id]:
+                self._total_len -= int(self._doc_len[vector_id])
+                self._doc_len[vector_id] = 0
+                self._n_docs -= 1
+                self._removed.add(vector_id)
+
+        if len(self._removed) > self.compact_ratio * max(self._n_docs + len(self._removed), 1):
+            self.compact()
+
+    def compact(self) -> None:
+        """Drop postings of removed IDs."""
+        if not self._removed:
+            return
+        removed = np.fromiter(self._removed, dtype='int64')
+        for term in list(self._posting_ids):
+            ids = np.frombuffer(self._posting_ids[term], dtype='int64')
+            keep = ~np.isin(ids, removed)
+            if keep.all():
+                continue
+            if not keep.any():
+                del self._posting_ids[term]
+                del self._posting_tfs[term]
+                self._owned.discard(term)
+                continue
+            tfs = np.frombuffer(self._posting_tfs[term], dtype='uint32')
+            self._posting_ids[term] = array('q', ids[keep].tobytes())
+            self._posting_tfs[term] = array('I', tfs[keep].tobytes())
+            self._owned.add(term)
+        logger.debug(f"Compacted BM25 postings, dropped {len(self._removed)} removed chunks")
+        self._removed.clear()
+
+    def search(self, query: str, k: int = 5, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Score chunks against a query with BM25.
+
+        Args:
+            query: Search query
+            k: Number of results to return
+            mask: Optional boolean mask over vector IDs; only IDs set in it are scored
+
+        Returns:
+            List of (vector ID, BM25 score) pairs, best first
+        """
+        if not self._n_docs or (mask is not None and not mask.any()):
+            return []
+
+        avg_len = self._total_len / self._n_docs
+        all_ids, all_scores = [], []
+        for term in set(tokenize(query)):
+            if term not in self._posting_ids:
+                continue
+            ids = np.frombuffer(self._posting_ids[term], dtype='int64')
+            tfs = np.frombuffer(self._posting_tfs[term], dtype='uint32').astype('float32')
+            doc_len = self._doc_len[ids].astype('float32')
+            live = doc_len > 0
+            if not live.all():
+                ids, tfs, doc_len = ids[live], tfs[live], doc_len[live]
+            # Document frequency is corpus-wide, so filtering does not change scores
+            df = len(ids)
+            if mask is not None:
+                allowed = (ids < len(mask)) & mask[np.minimum(ids, len(mask) - 1)]
+                ids, tfs, doc_len = ids[allowed], tfs[allowed], doc_len[allowed]
+            if not len(ids):
+                continue
+
+            idf = math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+            scores = idf * tfs * (self.k1 + 1) / (tfs + self.k1 * (1 - self.b + self.b * doc_len / avg_len))
+            all_ids.append(ids)
+            all_scores.append(scores)
+
+        if not all_ids:
+            return []
+
+        unique_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(all_scores))
+        k = min(k, len(unique_ids))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return [(int(unique_ids[i]), float(totals[i])) for i in top]
+
+def reciprocal_rank_fusion(rankings: List[List[int]], rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuse ranked ID lists with reciprocal rank fusion.
+
+    Args:
+        rankings: Ranked lists of vector IDs, best first
+        rrf_k: RRF damping constant
+
+    Returns:
+        List of (vector ID, fused score) pairs, best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, vector_id in enumerate(ranking, 1):
+            fused[vector_id] = fused.get(vector_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -12,6 +12,8 @@ class SpeechToText:
         """
         self.logger = logging.getLogger(__name__)
         self.recognizer = sr.Recognizer()
+        # Optional replacement for Google's speech endpoint, e.g. a local stand-in for load tests
+        self.google_endpoint = os.getenv("GOOGLE_SPEECH_ENDPOINT")
         self.logger.info("Initialized SpeechRecognition")
 
     async def transcribe_audio(self, audio_data: bytes) -> Tuple[str, str]:
@@ -36,7 +38,10 @@ class SpeechToText:
                 
                 # Try Google's speech recognition first
                 try:
-                    text = self.recognizer.recognize_google(audio)
+                    if self.google_endpoint:
+                        text = self.recognizer.recognize_google(audio, endpoint=self.google_endpoint)
+                    else:
+                        text = self.recognizer.recognize_google(audio)
                 except sr.UnknownValueError:
                     self.logger.warning("Google Speech Recognition could not understand audio")
                     text = ""
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The app's modules are flat files in rag-agent/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from answer_cache import SemanticAnswerCache
+from chat_pipeline import ChatPipeline
+from conversation_store import InMemoryConversationStore
+
+
+class FakeRAG:
+    """Just enough of RAGSystem for a ChatPipeline: one fixed chunk and an LLM that counts its calls."""
+
+    def __init__(self):
+        self.answer_cache = SemanticAnswerCache()
+        self.conversation_store = InMemoryConversationStore()
+        self.latency = SimpleNamespace(record=lambda stage, ms: None)
+        self.llm_calls = 0
+
+        snapshot = SimpleNamespace(version=1)
+
+        async def aembed_query(query):
+            return np.ones(4, dtype=np.float32)
+
+        self.pdf_processor = SimpleNamespace(store=SimpleNamespace(snapshot=lambda: snapshot),
+                                             aembed_query=aembed_query)
+        self.llm_handler = SimpleNamespace(build_prompt=lambda query, context, **kwargs: ([], None),
+                                           acomplete=self._acomplete)
+
+    async def _acomplete(self, messages):
+        self.llm_calls += 1
+        return {"responses": [f"answer {self.llm_calls}"], "audio": None}
+
+    async def aquery(self, query, k=5, filters=None, snapshot=None):
+        return [{"text": "chunk", "ids": [0], "score": 0.9, "metadata": {"source": "a.pdf"}}]
+
+    def get_memory(self, session_id):
+        return self.conversation_store.get(session_id)
+
+    def add_to_memory(self, query, response, session_id):
+        self.conversation_store.append(session_id, query, response)
+
+
+def test_answer_cache_shared_only_without_conversation():
+    rag = FakeRAG()
+
+    first = ChatPipeline(rag, "what are the leave rules?", session_id="a").run()
+    repeat = ChatPipeline(rag, "what are the leave rules?", session_id="b").run()
+    assert not first["cached"]
+    assert repeat["cached"] and repeat["responses"] == first["responses"]
+
+    # Follow-ups depend on the session's own conversation, so they are never served from
+    # (or stored in) the cache, even when another session asked the same thing
+    follow_a = ChatPipeline(rag, "what about the second one?", session_id="a").run()
+    follow_b = ChatPipeline(rag, "what about the second one?", session_id="b").run()
+    assert not follow_a["cached"] and not follow_b["cached"]
+
+    with_history = ChatPipeline(rag, "what are the leave rules?", session_id="c",
+                                history=[{"role": "user", "text": "I work part time"}]).run()
+    assert not with_history["cached"]
+    assert rag.llm_calls == 4
@@ -0,0 +1,173 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from llm_router import DeploymentTarget, LLMRouter
+
+
+def rate_limit_error() -> openai.RateLimitError:
+    response = httpx.Response(429, request=httpx.Request("POST", "http://fake/chat/completions"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeTarget(DeploymentTarget):
+    """Deployment answered by a coroutine instead of Azure OpenAI."""
+
+    def __init__(self, name, handler):
+        super().__init__(name, name, "http://fake", "key", "2024-12-01-preview")
+        self.handler = handler
+
+    @property
+    def client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.handler)))
+
+
+def answering(text, delay=0.0):
+    async def create(model, stream=False, **request):
+        await asyncio.sleep(delay)
+        return FakeStream([f"{text} 1", f"{text} 2"]) if stream else text
+    return create
+
+
+def failing(error_factory):
+    async def create(model, stream=False, **request):
+        raise error_factory()
+    return create
+
+
+def test_breaker_opens_after_threshold_and_closes_after_trial():
+    target = FakeTarget("a", failing(rate_limit_error))
+    router = LLMRouter([target], hedge=False, breaker_threshold=3, breaker_window=10, breaker_cooldown=0.05)
+
+    async def run():
+        for _ in range(2):
+            try:
+                await router.complete({})
+            except openai.RateLimitError:
+                pass
+        assert router.stats()["deployments"]["a"]["circuit"] == "closed"
+
+        try:
+            await router.complete({})
+        except openai.RateLimitError:
+            pass
+        assert router.stats()["deployments"]["a"]["circuit"] == "open"
+        assert not target.is_available(target.open_until - 0.01)
+
+        # Past the cooldown the breaker is half-open; a failed trial reopens it for another cooldown
+        await asyncio.sleep(0.06)
+        assert router.stats()["deployments"]["a"]["circuit"] == "half-open"
+        try:
+            await router.complete({})
+        except openai.RateLimitError:
+            pass
+        assert router.stats()["deployments"]["a"]["circuit"] == "open"
+
+        # A successful trial closes it
+        await asyncio.sleep(0.06)
+        target.handler = answering("ok")
+        assert (await router.complete({}))[0] == "ok"
+        assert router.stats()["deployments"]["a"]["circuit"] == "closed"
+        assert not target.trial_in_flight
+
+    asyncio.run(run())
+
+
+def test_half_open_trial_flag_belongs_to_the_trial_request():
+    target = FakeTarget("a", answering("trial", delay=0.2))
+    router = LLMRouter([target], hedge=False, breaker_cooldown=30)
+    # Opened a while ago and past its cooldown
+    target.open_until = 1e-9
+
+    async def run():
+        trial = asyncio.ensure_future(router.complete({}))
+        await asyncio.sleep(0.05)
+        assert target.trial_in_flight
+
+        # With every circuit open or on trial, the router still sends requests to the deployment;
+        # one of them finishing must not end the trial
+        target.handler = answering("other")
+        assert (await router.complete({}))[0] == "other"
+        assert target.trial_in_flight
+        assert not target.is_available(float("inf"))
+
+        assert (await trial)[0] == "trial"
+        assert not target.trial_in_flight
+        assert target.open_until == 0.0
+
+    asyncio.run(run())
+
+
+def test_rank_skips_open_circuits_and_prefers_lower_latency():
+    slow, fast, broken = (FakeTarget(name, answering(name)) for name in ("slow", "fast", "broken"))
+    slow.latency["complete"], fast.latency["complete"], broken.latency["complete"] = 2.0, 0.5, 0.1
+    broken.open_until = float("inf")
+    router = LLMRouter([slow, fast, broken])
+    assert [target.name for target in router.rank("complete")] == ["fast", "slow"]
+
+
+def test_slow_primary_is_hedged_and_backup_wins():
+    primary = FakeTarget("primary", answering("primary", delay=1.0))
+    backup = FakeTarget("backup", answering("backup", delay=0.01))
+    primary.latency["complete"], backup.latency["complete"] = 0.1, 0.2
+    router = LLMRouter([primary, backup], hedge_initial_delay=0.05, hedge_min_delay=0.01)
+
+    response, target = asyncio.run(router.complete({}))
+    assert (response, target) == ("backup", backup)
+    assert router.hedged == 1
+    assert backup.hedge_wins == 1
+    # The losing duplicate was cancelled and released
+    assert primary.in_flight == 0 and backup.in_flight == 0
+
+
+def test_fast_primary_is_not_hedged():
+    primary = FakeTarget("primary", answering("primary"))
+    backup = FakeTarget("backup", answering("backup"))
+    primary.latency["complete"], backup.latency["complete"] = 0.1, 0.2
+    router = LLMRouter([primary, backup], hedge_initial_delay=0.5)
+
+    assert asyncio.run(router.complete({})) == ("primary", primary)
+    assert router.hedged == 0 and backup.requests == 0
+
+
+def test_stream_hedges_until_first_chunk():
+    primary = FakeTarget("primary", answering("primary", delay=1.0))
+    backup = FakeTarget("backup", answering("backup", delay=0.01))
+    primary.latency["ttft"], backup.latency["ttft"] = 0.1, 0.2
+    router = LLMRouter([primary, backup], hedge_initial_delay=0.05, hedge_min_delay=0.01)
+
+    async def run():
+        return [(chunk, target.name) async for chunk, target in router.stream({})]
+
+    assert asyncio.run(run()) == [("backup 1", "backup"), ("backup 2", "backup")]
+    assert router.hedged == 1
+    assert primary.in_flight == 0 and backup.in_flight == 0
+
+
+def test_throttled_primary_fails_over():
+    primary = FakeTarget("primary", failing(rate_limit_error))
+    backup = FakeTarget("backup", answering("backup"))
+    primary.latency["complete"], backup.latency["complete"] = 0.1, 0.2
+    router = LLMRouter([primary, backup], hedge=False)
+
+    assert asyncio.run(router.complete({})) == ("backup", backup)
+    assert primary.throttles == 1 and primary.error_rate > 0
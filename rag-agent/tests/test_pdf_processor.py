@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pdf_processor import PDFProcessor
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "http://localhost:9")
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test")
+    monkeypatch.setenv("INDEX_ENGINE", "flat")
+    # One query per embedding request, so one query can fail while the other succeeds
+    monkeypatch.setenv("EMBEDDING_BATCH_SIZE", "1")
+    processor = PDFProcessor(data_dir=str(tmp_path))
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((4, processor.dimension)).astype('float32')
+    chunks = [{"text": f"chunk {i} about leave policy", "metadata": {"source": "/data/a.pdf", "chunk_id": i}}
+              for i in range(4)]
+    processor.store.add_document("/data/a.pdf", chunks, embeddings)
+
+    def embed(texts):
+        if "unreachable" in texts[0]:
+            raise ConnectionError("embeddings endpoint unreachable")
+        return SimpleNamespace(data=[SimpleNamespace(embedding=embeddings[1]) for _ in texts])
+
+    async def aembed(texts):
+        return embed(texts)
+
+    processor._embed_query_batch = embed
+    processor._aembed_query_batch = aembed
+    return processor
+
+
+@pytest.mark.parametrize("mode", ["dense", "hybrid"])
+def test_queries_that_cannot_be_embedded_get_no_results(processor, mode):
+    queries = ["leave policy", "unreachable leave policy"]
+
+    for results in (processor.search_many(queries, k=2, mode=mode),
+                    asyncio.run(processor.asearch_many(queries, k=2, mode=mode))):
+        assert results[0] and results[0][0]["text"] == "chunk 1 about leave policy"
+        # Not the arbitrary neighbours of a zero vector
+        assert results[1] == []
+
+    assert processor.query_cache.get("unreachable leave policy", processor.embedding_deployment) is None
+
+
+def test_embed_query_raises_when_embedding_fails(processor):
+    assert processor.embed_query("leave policy").any()
+    with pytest.raises(RuntimeError):
+        processor.embed_query("unreachable leave policy")
+    with pytest.raises(RuntimeError):
+        asyncio.run(processor.aembed_query("unreachable leave policy"))
@@ -0,0 +1,41 @@
+import numpy as np
+from vector_store import VectorStore
+
+DIMENSION = 16
+
+def make_document(name: str, n_chunks: int, rng: np.random.Generator):
+    chunks = [{"text": f"{name} chunk {i} about leave policy",
+               "metadata": {"source": f"/data/{name}.pdf", "doc_set": "hr", "tags": ["policy"]}}
+              for i in range(n_chunks)]
+    return chunks, rng.standard_normal((n_chunks, DIMENSION)).astype('float32')
+
+def reload(store: VectorStore, documents) -> None:
+    with store.deferred(fresh=True):
+        for name, (chunks, embeddings) in documents.items():
+            store.add_document(f"/data/{name}.pdf", chunks, embeddings)
+
+def test_fresh_reloads_keep_ids_at_corpus_size():
+    rng = np.random.default_rng(0)
+    documents = {name: make_document(name, n_chunks, rng) for name, n_chunks in (("a", 5), ("b", 7), ("c", 3))}
+    corpus_size = sum(len(chunks) for chunks, _ in documents.values())
+    store = VectorStore(dimension=DIMENSION, engine="flat")
+
+    reload(store, documents)
+    first_doc_len = len(store.snapshot().sparse._doc_len)
+
+    for _ in range(20):
+        reload(store, documents)
+        snapshot = store.snapshot()
+        assert snapshot.next_id == corpus_size
+        assert sorted(snapshot.chunks) == list(range(corpus_size))
+        assert len(snapshot.metadata.select({"doc_sets": ["hr"]})) == corpus_size
+        # BM25 grows its length array geometrically, but never past that of the first build
+        assert len(snapshot.sparse._doc_len) == first_doc_len
+        assert corpus_size <= first_doc_len <= 2 * corpus_size
+
+    # The renumbered chunks are still found, with and without a filter
+    query = documents["b"][1][2]
+    for filters in (None, {"sources": ["b.pdf"]}):
+        vector_id, chunk, _ = store.search(query, k=1, filters=filters)[0]
+        assert chunk["text"] == "b chunk 2 about leave policy"
+        assert store.snapshot().chunks[vector_id] is chunk
@@ -0,0 +1,48 @@
+import threading
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loaded = False
+_lock = threading.Lock()
+
+def get_encoding():
+    """
+    Return the cl100k_base tiktoken encoding, loaded once per process.
+
+    Returns:
+        The encoding, or None when tiktoken is unavailable
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"tiktoken unavailable ({str(e)}), estimating token counts from text length")
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text: Optional[str]) -> int:
+    """Count the tokens of a text, estimating from its length without tiktoken."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 3)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 3]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
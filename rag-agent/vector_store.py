@@ -0,0 +1,502 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+import faiss
+import logging
+from index_engine import (build_index, choose_engine, exact_rerank, filtered_search_params, normalize,
+                          COMPRESSED_ENGINES, REMOVABLE_ENGINES)
+from metadata_index import MetadataIndex
+from sparse_index import BM25Index, term_frequencies
+
+logger = logging.getLogger(__name__)
+
+# Filters matching at most this many chunks are searched exactly over the stored vectors
+# instead of through an approximate index
+FILTER_EXACT_MAX = 4096
+
+class IndexSnapshot:
+    def __init__(self, dimension: int, version: int = 0, next_id: int = 0):
+        """
+        One version of the corpus: chunk store, FAISS index, BM25 and metadata indexes.
+
+        A snapshot is never modified once VectorStore publishes it, so any number of
+        searches can read it without locking. Writers work on a copy and publish
+        that as the next version.
+
+        Args:
+            dimension: Embedding dimension
+            version: Version number, increasing with every published change
+            next_id: First vector ID not used by this version (or by the version it was copied from)
+        """
+        self.dimension = dimension
+        self.version = version
+        self.created_at = time.time()
+
+        # Vector ID -> chunk record (text + metadata)
+        self.chunks: Dict[int, Dict] = {}
+        # Source path -> vector IDs belonging to that document, in row order
+        self.sources: Dict[str, List[int]] = {}
+        # Source path -> embedding matrix (usually memory-mapped from the PDF's store)
+        self.vectors: Dict[str, np.ndarray] = {}
+        # Sparse BM25 index over the same vector IDs
+        self.sparse = BM25Index()
+        # Metadata value (source, doc_set, tag) -> vector IDs, for filtered search
+        self.metadata = MetadataIndex()
+
+        self.index: Optional[faiss.Index] = None
+        self.card: Dict = {}
+        self.next_id = next_id
+        self._owns_index = True
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def copy(self, empty: bool = False) -> "IndexSnapshot":
+        """
+        Working copy for the next version.
+
+        Containers are copied shallowly and the FAISS index is shared until
+        own_index() is called, so copying costs little more than the dict copies.
+
+        Args:
+            empty: Start the next version from an empty corpus instead (full reload)
+        """
+        # An empty copy shares no IDs with this version, so it numbers its chunks from 0 again;
+        # the ID-sized bitmaps and arrays then stay at corpus size across reloads
+        draft = IndexSnapshot(self.dimension, self.version + 1, 0 if empty else self.next_id)
+        draft.index = self.index
+        draft.card = dict(self.card)
+        draft._owns_index = False
+        if not empty:
+            draft.chunks = dict(self.chunks)
+            draft.sources = dict(self.sources)
+            draft.vectors = dict(self.vectors)
+            draft.sparse = self.sparse.copy()
+            draft.metadata = self.metadata.copy()
+        return draft
+
+    def own_index(self) -> faiss.Index:
+        """Clone the shared FAISS index before modifying it in place."""
+        if not self._owns_index:
+            self.index = faiss.clone_index(self.index)
+            self._owns_index = True
+        return self.index
+
+    def info(self) -> Dict:
+        """Summary of this version."""
+        return {
+            "version": self.version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.created_at)),
+            "documents": len(self.sources),
+            "chunks": len(self.chunks),
+            "index": self.card
+        }
+
+    def has_document(self, source: str) -> bool:
+        """Check whether a document is in this version."""
+        return source in self.sources
+
+    def get_vectors(self, ids: List[int]) -> np.ndarray:
+        """
+        Fetch the normalized stored embeddings of chunks by vector ID.
+
+        Returns:
+            np.ndarray: float32 matrix with one row per ID
+        """
+        ids = np.asarray(ids, dtype='int64')
+        rows = np.zeros((len(ids), self.dimension), dtype='float32')
+        # IDs of one document are a contiguous range in row order
+        sources = sorted(self.sources, key=lambda source: self.sources[source][0])
+        starts = np.array([self.sources[source][0] for source in sources], dtype='int64')
+        owners = np.searchsorted(starts, ids, side='right') - 1
+        for owner in np.unique(owners).tolist():
+            positions = np.flatnonzero(owners == owner)
+            rows[positions] = self.vectors[sources[owner]][ids[positions] - starts[owner]]
+        faiss.normalize_L2(rows)
+        return rows
+
+    def search(self,
+               query_embedding: np.ndarray,
+               k: int = 5,
+               filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[int, Dict, float]]:
+        """
+        Dense search over the whole corpus.
+
+        Args:
+            query_embedding: Query vector
+            k: Number of results to return
+            filters: Restrict results by metadata, e.g. {"sources": [...], "doc_sets": [...], "tags": [...]}
+
+        Returns:
+            List of (vector ID, chunk record, cosine similarity), most similar first
+        """
+        return self.search_many(np.asarray(query_embedding).reshape(1, -1), k, filters)[0]
+
+    def search_many(self,
+                    query_embeddings: np.ndarray,
+                    k: int = 5,
+                    filters: Optional[Dict[str, List[str]]] = None) -> List[List[Tuple[int, Dict, float]]]:
+        """
+        Dense search for a matrix of query vectors in one FAISS call.
+
+        A filter is pushed down into the search: small selections are scored exactly
+        against their stored vectors, larger ones are searched through the index with
+        an ID selector built from the metadata bitmap. Candidates from a compressed
+        index are re-scored exactly.
+
+        Args:
+            query_embeddings: Matrix of shape (n_queries, dimension)
+            k: Number of results to return per query
+            filters: See search()
+
+        Returns:
+            One list of (vector ID, chunk record, cosine similarity) per query, most similar first
+        """
+        queries = normalize(query_embeddings)
+        if not self.chunks:
+            return [[] for _ in range(len(queries))]
+
+        rerank = self.card["params"].get("rerank", 1) if self.card["engine"] in COMPRESSED_ENGINES else 1
+        mask = self.metadata.select(filters)
+        if mask is None:
+            k = min(k, len(self.chunks))
+            scores, ids = self.index.search(queries, min(k * rerank, len(self.chunks)))
+        else:
+            allowed = np.flatnonzero(mask)
+            if not len(allowed):
+                return [[] for _ in range(len(queries))]
+            k = min(k, len(allowed))
+            if self.card["engine"] != "flat" and len(allowed) <= FILTER_EXACT_MAX:
+                scores, ids = self._search_exact(queries, allowed, k)
+                rerank = 1
+            else:
+                params, _keepalive = filtered_search_params(self.index, self.card["params"], mask)
+                scores, ids = self.index.search(queries, min(k * rerank, len(allowed)), params=params)
+        if rerank > 1:
+            scores, ids = exact_rerank(queries, ids, self.get_vectors, k)
+
+        return [
+            [
+                (vector_id, self.chunks[vector_id], float(score))
+                for vector_id, score in zip(row_ids.tolist(), row_scores.tolist())
+                if vector_id in self.chunks
+            ]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def _search_exact(self, queries: np.ndarray, allowed: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Brute-force inner-product search over a subset of vector IDs."""
+        scores = queries @ self.get_vectors(allowed).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), allowed[np.take_along_axis(top, order, axis=1)]
+
+    def search_sparse(self,
+                      query: str,
+                      k: int = 5,
+                      filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[int, Dict, float]]:
+        """
+        BM25 keyword search over the whole corpus.
+
+        Returns:
+            List of (vector ID, chunk record, BM25 score), best first
+        """
+        mask = self.metadata.select(filters)
+        return [
+            (vector_id, self.chunks[vector_id], score)
+            for vector_id, score in self.sparse.search(query, k, mask)
+            if vector_id in self.chunks
+        ]
+
+class VectorStore:
+    def __init__(self,
+                 dimension: int = 1536,
+                 engine: str = "auto",
+                 target_recall: float = 0.95,
+                 card_path: Optional[Path] = None,
+                 compressed: bool = False,
+                 rerank_factor: int = 4):
+        """
+        Initialize a corpus-wide FAISS index with an ID-mapped chunk store.
+
+        Every chunk gets a stable int64 vector ID. The same ID is used in the FAISS
+        index and as the key in the chunk store, so adding or removing a document
+        only touches that document's vectors. Vectors are L2-normalized and searched
+        by inner product, so scores are cosine similarities.
+
+        With a compressed engine (SQ8 or IVF-PQ) the index holds only lossy codes; it
+        returns k * rerank_factor candidates, which are re-scored exactly against the
+        float32 vectors memory-mapped from each PDF's store.
+
+        The corpus is held in immutable, versioned IndexSnapshots (read-copy-update):
+        writers build the next version on a copy and swap it in with one reference
+        assignment, and searches already running finish on the version they started on.
+
+        Args:
+            dimension: Embedding dimension
+            engine: Index engine ("auto", "flat", "ivf", "hnsw", "sq8" or "ivfpq")
+            target_recall: Recall@10 the engine parameters are tuned for
+            card_path: Where to write the index card describing the current build
+            compressed: Let "auto" choose among the compressed engines
+            rerank_factor: Candidates re-scored per result with a compressed engine
+        """
+        self.dimension = dimension
+        self.engine = engine
+        self.target_recall = target_recall
+        self.card_path = Path(card_path) if card_path else None
+        self.compressed = compressed
+        self.rerank_factor = max(1, rerank_factor)
+
+        # Serializes writers; readers never take it
+        self._lock = threading.RLock()
+        # Working copy while a deferred() batch is open
+        self._draft: Optional[IndexSnapshot] = None
+
+        snapshot = IndexSnapshot(dimension)
+        snapshot.index, snapshot.card = build_index(
+            np.zeros((0, dimension), dtype='float32'), np.zeros(0, dtype='int64'), dimension, engine,
+            compressed=compressed, rerank=self.rerank_factor
+        )
+        snapshot.card["n_vectors_at_build"] = 0
+        self._snapshot = snapshot
+
+    def snapshot(self) -> IndexSnapshot:
+        """The current version; use one snapshot for every step of a request."""
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    # Read-only views of the current version
+    @property
+    def chunks(self) -> Dict[int, Dict]:
+        return self._snapshot.chunks
+
+    @property
+    def sources(self) -> Dict[str, List[int]]:
+        return self._snapshot.sources
+
+    @property
+    def index(self) -> faiss.Index:
+        return self._snapshot.index
+
+    @property
+    def card(self) -> Dict:
+        return self._snapshot.card
+
+    @property
+    def metadata(self) -> MetadataIndex:
+        return self._snapshot.metadata
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def has_document(self, source: str) -> bool:
+        """Check whether a document is already in the index."""
+        return self._snapshot.has_document(source)
+
+    @contextmanager
+    def deferred(self, fresh: bool = False):
+        """
+        Batch many adds/removes into one new version, building the index once at the end.
+
+        Searches keep using the current version until the batch is published.
+
+        Args:
+            fresh: Build the new version from an empty corpus (full reload). If the batch
+                raises, it is discarded and the current version stays live.
+        """
+        with self._lock:
+            draft = self._snapshot.copy(empty=fresh)
+            self._draft = draft
+            try:
+                yield self
+            except Exception:
+                if fresh:
+                    logger.error(f"Discarding index version {draft.version}, keeping version {self.version}")
+                    raise
+                self._rebuild(draft)
+                self._publish(draft)
+                raise
+            finally:
+                self._draft = None
+            self._rebuild(draft)
+            self._publish(draft)
+
+    def add_document(self,
+                     source: str,
+                     chunks: List[Dict],
+                     embeddings: np.ndarray,
+                     term_freqs: Optional[List[Dict[str, int]]] = None) -> List[int]:
+        """
+        Add a document's chunks to the index, replacing any previous version of it.
+
+        Args:
+            source: Document identifier (path of the raw PDF)
+            chunks: Chunk records, one per embedding row
+            embeddings: Matrix of shape (len(chunks), dimension); kept by reference for rebuilds
+            term_freqs: Per-chunk BM25 term counts; computed from the chunk text if not given
+
+        Returns:
+            List[int]: Vector IDs assigned to the chunks
+        """
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"Got {len(chunks)} chunks but {len(embeddings)} embeddings for {source}")
+
+        with self._lock:
+            draft = self._draft if self._draft is not None else self._snapshot.copy()
+            self._remove(draft, source)
+
+            ids = np.arange(draft.next_id, draft.next_id + len(chunks), dtype='int64')
+            draft.next_id += len(chunks)
+
+            for vector_id, chunk in zip(ids.tolist(), chunks):
+                draft.chunks[vector_id] = chunk
+            draft.sources[source] = ids.tolist()
+            draft.vectors[source] = embeddings
+
+            if term_freqs is None:
+                term_freqs = [term_frequencies(chunk["text"]) for chunk in chunks]
+            draft.sparse.add(ids.tolist(), term_freqs)
+            draft.metadata.add(ids.tolist(), chunks)
+
+            if draft is not self._draft:
+                if self._needs_rebuild(draft):
+                    self._rebuild(draft)
+                elif len(ids):
+                    draft.own_index().add_with_ids(normalize(embeddings), ids)
+                    draft.card["n_vectors"] = int(draft.index.ntotal)
+                self._publish(draft)
+
+        logger.info(f"Indexed {len(ids)} chunks from {source} (corpus size: {len(draft.chunks)})")
+        return ids.tolist()
+
+    def remove_document(self, source: str) -> int:
+        """
+        Remove all chunks of a document from the index.
+
+        Args:
+            source: Document identifier
+
+        Returns:
+            int: Number of vectors removed
+        """
+        with self._lock:
+            draft = self._draft if self._draft is not None else self._snapshot.copy()
+            removed = self._remove(draft, source)
+            if removed and draft is not self._draft:
+                if self._needs_rebuild(draft):
+                    self._rebuild(draft)
+                self._publish(draft)
+
+        if removed:
+            logger.info(f"Removed {removed} chunks of {source} from the index")
+        return removed
+
+    def _remove(self, draft: IndexSnapshot, source: str) -> int:
+        """Drop a document's chunks; removes them from the index when the engine allows it."""
+        ids = draft.sources.pop(source, None)
+        draft.vectors.pop(source, None)
+        if not ids:
+            return 0
+
+        removed = [draft.chunks.pop(vector_id) for vector_id in ids]
+        draft.sparse.remove(ids)
+        draft.metadata.remove(ids, removed)
+        if draft is not self._draft and draft.card["engine"] in REMOVABLE_ENGINES:
+            draft.own_index().remove_ids(np.array(ids, dtype='int64'))
+            draft.card["n_vectors"] = int(draft.index.ntotal)
+        return len(ids)
+
+    def _needs_rebuild(self, draft: IndexSnapshot) -> bool:
+        """Whether the index is stale for the corpus and must be rebuilt."""
+        n_vectors = len(draft.chunks)
+        built = draft.card
+        at_build = built["n_vectors_at_build"]
+
+        # The engine cannot delete in place and still holds removed vectors
+        if built["engine"] not in REMOVABLE_ENGINES and draft.index.ntotal != n_vectors:
+            return True
+        if self.engine == "auto":
+            # The corpus crossed a size tier, so auto-selection would pick another engine
+            if choose_engine(n_vectors, self.compressed) != choose_engine(at_build, self.compressed):
+                return True
+            if built["engine"] in ("flat", "sq8"):
+                return False
+        elif self.engine == "flat":
+            return False
+        # Lists/graph were sized and tuned (or a fallback was chosen) for a very different corpus
+        return n_vectors > 2 * max(at_build, 1) or n_vectors < at_build // 4
+
+    def rebuild(self) -> None:
+        """Rebuild the index from all stored vectors, re-selecting and re-tuning the engine."""
+        with self._lock:
+            if self._draft is not None:
+                self._rebuild(self._draft)
+                return
+            draft = self._snapshot.copy()
+            self._rebuild(draft)
+            self._publish(draft)
+
+    def _rebuild(self, draft: IndexSnapshot) -> None:
+        """Build a new index for a working copy from its stored vectors."""
+        sources = list(draft.sources)
+        ids = np.array([vector_id for source in sources for vector_id in draft.sources[source]], dtype='int64')
+        if sources:
+            vectors = normalize(np.concatenate([draft.vectors[source] for source in sources]))
+        else:
+            vectors = np.zeros((0, self.dimension), dtype='float32')
+
+        draft.index, draft.card = build_index(vectors, ids, self.dimension, self.engine, self.target_recall,
+                                              compressed=self.compressed, rerank=self.rerank_factor)
+        draft.card["n_vectors_at_build"] = len(ids)
+        draft._owns_index = True
+
+    def _publish(self, draft: IndexSnapshot) -> None:
+        """Make a working copy the current version; searches pick it up from their next call."""
+        draft.card["version"] = draft.version
+        self._snapshot = draft
+        self._save_card(draft.card)
+        logger.info(f"Published index version {draft.version} "
+                    f"({len(draft.sources)} documents, {len(draft.chunks)} chunks)")
+
+    def _save_card(self, card: Dict) -> None:
+        """Write the index card next to the per-PDF stores."""
+        if self.card_path is None:
+            return
+        tmp_path = self.card_path.with_name(self.card_path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(card, f, indent=2)
+        os.replace(tmp_path, self.card_path)
+
+    def get_vectors(self, ids: List[int]) -> np.ndarray:
+        """Fetch the normalized stored embeddings of chunks by vector ID (current version)."""
+        return self._snapshot.get_vectors(ids)
+
+    def search(self,
+               query_embedding: np.ndarray,
+               k: int = 5,
+               filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[int, Dict, float]]:
+        """Dense search over the current version; see IndexSnapshot.search."""
+        return self._snapshot.search(query_embedding, k, filters)
+
+    def search_many(self,
+                    query_embeddings: np.ndarray,
+                    k: int = 5,
+                    filters: Optional[Dict[str, List[str]]] = None) -> List[List[Tuple[int, Dict, float]]]:
+        """Batched dense search over the current version; see IndexSnapshot.search_many."""
+        return self._snapshot.search_many(query_embeddings, k, filters)
+
+    def search_sparse(self,
+                      query: str,
+                      k: int = 5,
+                      filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[int, Dict, float]]:
+        """BM25 search over the current version; see IndexSnapshot.search_sparse."""
+        return self._snapshot.search_sparse(query, k, filters)